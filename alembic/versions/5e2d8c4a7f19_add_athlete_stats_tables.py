@@ -0,0 +1,97 @@
+"""add athlete stats tables
+
+the dashboards' aggregates of each athlete's matches, kept up to date by the
+load so that the dashboards don't recompute them on every request. they're
+filled from the tables here, after that the load refreshes them, see
+refresh_stats in the load. they have no foreign keys, so that the swap load can
+drop the tables they're made from
+
+Revision ID: 5e2d8c4a7f19
+Revises: c3f1a9d2e6b4
+Create Date: 2026-10-17 16:41:09.217436
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e2d8c4a7f19'
+down_revision: Union[str, None] = 'c3f1a9d2e6b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the athletes with a page on bjjheroes, subs are the wins that were finishes
+    op.execute(
+        """
+        CREATE TABLE athlete_stats (
+            athlete_id INTEGER PRIMARY KEY,
+            name VARCHAR NOT NULL,
+            wins INTEGER NOT NULL,
+            subs INTEGER NOT NULL,
+            total_matches INTEGER NOT NULL
+        );
+        """
+    )
+    # the wins of each of those athletes by each method, looked up by the method
+    op.execute(
+        """
+        CREATE TABLE athlete_method_stats (
+            method VARCHAR NOT NULL,
+            athlete_id INTEGER NOT NULL,
+            wins INTEGER NOT NULL,
+            PRIMARY KEY (method, athlete_id)
+        );
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO athlete_stats (athlete_id, name, wins, subs, total_matches)
+        SELECT a.id,
+               a.name,
+               SUM(CASE WHEN p.result = 'W' THEN 1 ELSE 0 END),
+               SUM(CASE
+                       WHEN m.method LIKE 'Pts:%' THEN 0
+                       WHEN m.method IN ('N/A', 'Points', 'DQ', 'Referee Decision', 'Adv', 'Pen', '---', 'Advantages') THEN 0
+                       WHEN m.method LIKE 'EBI%' THEN 0
+                       WHEN p.result = 'W' THEN 1
+                       ELSE 0
+                   END),
+               COUNT(*)
+        FROM athlete a
+                 JOIN performance p ON a.id = p.athlete_id
+                 JOIN match m ON p.match_id = m.id
+        WHERE a.url != ''
+        GROUP BY a.id, a.name;
+        """
+    )
+    op.execute(
+        """
+        INSERT INTO athlete_method_stats (method, athlete_id, wins)
+        SELECT m.method, a.id, COUNT(*)
+        FROM athlete a
+                 JOIN performance p ON a.id = p.athlete_id
+                 JOIN match m ON p.match_id = m.id
+        WHERE a.url != ''
+          AND p.result = 'W'
+          AND m.method IS NOT NULL
+        GROUP BY m.method, a.id;
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        DROP TABLE athlete_method_stats;
+        """
+    )
+    op.execute(
+        """
+        DROP TABLE athlete_stats;
+        """
+    )
@@ -0,0 +1,52 @@
+"""add unique index on performance
+
+so that a performance can be upserted by its match and athlete, the duplicates
+are deleted first
+
+Revision ID: 8107566f53d5
+Revises: 41d5099e1549
+Create Date: 2026-10-17 10:12:41.318204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8107566f53d5'
+down_revision: Union[str, None] = '41d5099e1549'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the scrapes from before one performance was kept per match and athlete could
+    # have the same athlete in a match twice with different results, the first one
+    # loaded is kept. sqlite doesn't fill in SERIAL ids, so it goes by the rowid
+    row_id = "rowid" if op.get_bind().dialect.name == "sqlite" else "id"
+    op.execute(
+        f"""
+        DELETE FROM performance
+        WHERE {row_id} NOT IN (
+            SELECT MIN({row_id})
+            FROM performance
+            GROUP BY match_id, athlete_id
+        );
+        """
+    )
+    op.execute(
+        """
+        CREATE UNIQUE INDEX performance_match_id_athlete_id
+        ON performance (match_id, athlete_id);
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        DROP INDEX performance_match_id_athlete_id;
+        """
+    )
@@ -0,0 +1,95 @@
+"""add dashboard indexes
+
+the dashboards join athlete to performance to match and filter on the method
+and the result, these indexes are for those joins and filters. the partial
+indexes have the same conditions as the queries, which is how postgres and
+sqlite know they can use them
+
+Revision ID: c3f1a9d2e6b4
+Revises: 8107566f53d5
+Create Date: 2026-10-17 14:03:27.540811
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3f1a9d2e6b4'
+down_revision: Union[str, None] = '8107566f53d5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the join from athlete, the join from match is covered by
+    # performance_match_id_athlete_id
+    op.execute(
+        """
+        CREATE INDEX performance_athlete_id_result
+        ON performance (athlete_id, result);
+        """
+    )
+    # the wins, which is all the submission dashboard counts
+    op.execute(
+        """
+        CREATE INDEX performance_win_athlete_id
+        ON performance (athlete_id, match_id)
+        WHERE result = 'W';
+        """
+    )
+    # the submission list groups by method, and the athletes are filtered on one
+    op.execute(
+        """
+        CREATE INDEX match_method
+        ON match (method);
+        """
+    )
+    # the matches that were finished, rather than won on points or decisions
+    op.execute(
+        """
+        CREATE INDEX match_finish_id
+        ON match (id, method)
+        WHERE method NOT LIKE 'Pts:%'
+          AND method NOT IN ('N/A', 'Points', 'DQ', 'Referee Decision', 'Adv', 'Pen', '---', 'Advantages')
+          AND method NOT LIKE 'EBI%';
+        """
+    )
+    # the athletes with a page on bjjheroes, not the opponents that only have a name
+    op.execute(
+        """
+        CREATE INDEX athlete_listed_id
+        ON athlete (id, name)
+        WHERE url != '';
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute(
+        """
+        DROP INDEX athlete_listed_id;
+        """
+    )
+    op.execute(
+        """
+        DROP INDEX match_finish_id;
+        """
+    )
+    op.execute(
+        """
+        DROP INDEX match_method;
+        """
+    )
+    op.execute(
+        """
+        DROP INDEX performance_win_athlete_id;
+        """
+    )
+    op.execute(
+        """
+        DROP INDEX performance_athlete_id_result;
+        """
+    )
@@ -0,0 +1,173 @@
+"""
+an end to end benchmark of the scraper. it crawls synthetic sites of increasing
+size served by the local stand-in and reports the pages per second, the time spent
+parsing, the peak memory and the total wall time of each crawl.
+the site is served from its own process and every crawl runs in a fresh process,
+so the peak memory is the scraper's alone.
+
+heres how you would run it from the root of the repo:
+python -m benchmarks.crawl --sizes 1000 10000 50000 --parser lxml --latency 0.01
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing.connection import Connection
+from typing import Any, Dict, Iterator
+
+from pipeline.extract import extract
+from pipeline.extract.extract import PARSER_BACKENDS, Scraper, scrape_sharded
+from pipeline.load.load import peak_rss_mb
+from tests.stand_in import StandInSite
+from tests.synthetic_site import generate_site
+
+
+def serve(
+    num_athletes: int,
+    matches_per_athlete: int,
+    opponent_overlap: float,
+    latency: float,
+    conn: Connection,
+) -> None:
+    """
+    serves a synthetic site until anything is sent down conn, the url of the site
+    and the number of matches on it are sent back once it is up
+    """
+    site = generate_site(num_athletes, matches_per_athlete, opponent_overlap)
+    with StandInSite(
+        site.pages, athlete_list=site.athlete_list, latency=latency
+    ) as stand_in:
+        conn.send((stand_in.url, site.num_matches))
+        conn.recv()
+
+
+@contextlib.contextmanager
+def silence_stdout() -> Iterator[None]:
+    """
+    sends stdout to /dev/null, at the file descriptor so that it covers the shards'
+    processes too, which inherit it
+    """
+    sys.stdout.flush()
+    saved = os.dup(1)
+    with open(os.devnull, "w") as devnull:
+        os.dup2(devnull.fileno(), 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+
+def crawl(url: str, options: Dict[str, Any], shards: int = 1) -> Dict[str, Any]:
+    """
+    scrapes the site at url, this runs in a fresh process for each crawl
+    with more than one shard, the parse time and peak memory are only this process's,
+    the shards run in processes of their own
+    """
+    extract.SOURCE_HOSTNAME = url
+    parse_seconds = 0.0
+    parse_athlete_page = extract.parse_athlete_page
+
+    def timed_parse_athlete_page(html: str, backend: str = "bs4") -> Any:
+        nonlocal parse_seconds
+        start = time.perf_counter()
+        try:
+            return parse_athlete_page(html, backend)
+        finally:
+            parse_seconds += time.perf_counter() - start
+
+    # the pages are parsed in a worker thread of this process, so they all go through here
+    extract.parse_athlete_page = timed_parse_athlete_page
+    start = time.perf_counter()
+    # the scraper's progress output would drown out the results
+    with silence_stdout():
+        if shards > 1:
+            scraper = scrape_sharded(shards, **options)
+        else:
+            scraper = Scraper(**options)
+            scraper.scrape()
+    wall = time.perf_counter() - start
+    pages = len(scraper.url_search) - len(scraper.failed_downloads)
+    return {
+        "pages": pages,
+        "matches": len(scraper.matches),
+        "wall_seconds": wall,
+        "pages_per_second": pages / wall,
+        "parse_seconds": parse_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run(size: int, args: argparse.Namespace) -> Dict[str, Any]:
+    context = multiprocessing.get_context("spawn")
+    conn, child_conn = context.Pipe()
+    server = context.Process(
+        target=serve,
+        args=(size, args.matches, args.overlap, args.latency, child_conn),
+    )
+    server.start()
+    try:
+        url, num_matches = conn.recv()
+        options = {
+            "pipelined": args.pipelined,
+            "parser_backend": args.parser,
+            "max_concurrency": args.concurrency,
+        }
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(crawl, url, options, args.shards).result()
+    finally:
+        conn.send(None)
+        server.join()
+    assert result["matches"] == num_matches, "the crawl missed some matches"
+    return {"athletes": size, **result}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark a full scrape")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10_000, 50_000])
+    parser.add_argument(
+        "--matches",
+        type=int,
+        default=20,
+        help="the matches per athlete, see generate_site",
+    )
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=0.7,
+        help="the opponent overlap, see generate_site",
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds the site takes to answer"
+    )
+    parser.add_argument("--parser", default="bs4", choices=list(PARSER_BACKENDS))
+    parser.add_argument("--pipelined", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=extract.MAX_CONCURRENCY)
+    parser.add_argument(
+        "--shards", type=int, default=1, help="crawl with this many processes"
+    )
+    parser.add_argument(
+        "--json", action="store_true", help="print the results as json lines"
+    )
+    args = parser.parse_args()
+    for size in args.sizes:
+        result = run(size, args)
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(
+                f"{size} athletes: {result['pages_per_second']:.0f} pages/s, "
+                f"parse {result['parse_seconds']:.1f}s, "
+                f"peak rss {result['peak_rss_mb']:.0f} MB, "
+                f"wall {result['wall_seconds']:.1f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,390 @@
+"""
+a benchmark of the load step. it writes made up snapshots with the given numbers of
+performances to parquet files, the way the extract uploads them, and loads them into
+a sqlite database, and into postgres too when --db-url is given, with each of
+upload_data's modes and with pandas' to_sql the way the load used to.
+before each load the database is loaded with the month before's snapshot, which has
+a few less matches, so that the modes have something to replace or merge into.
+each load runs in a fresh process, and the rows per second, the peak memory of the
+process and the time spent in transactions are reported for each.
+every table is counted in the rows.
+
+heres how you would run it from the root of the repo:
+python -m benchmarks.load --rows 10000 100000 1000000 --db-url postgresql://localhost/bench
+the postgres database is migrated to the latest schema and its tables are replaced.
+to compare runs, write the results of each to a json file with --output
+"""
+
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+import pandas as pd
+import sqlalchemy as sa
+from alembic import command
+from alembic.config import Config
+
+from pipeline.load.load import (
+    CHUNKSIZE,
+    LOAD_MODES,
+    LOAD_WORKERS,
+    TABLE_KEYS,
+    peak_rss_mb,
+    upload_from_directory,
+)
+
+# most matches are won on points or a decision, the rest by one of a few submissions
+POINTS = [f"Pts: {a}x{b}" for a in range(2, 32, 2) for b in range(0, a, 2)]
+DECISIONS = {
+    "Points": 6,
+    "Adv": 6,
+    "Referee Decision": 8,
+    "Pen": 2,
+    "N/A": 2,
+    "DQ": 1,
+    "EBI/OT": 2,
+    "---": 1,
+}
+SUBMISSIONS = {
+    "RNC": 30,
+    "Armbar": 20,
+    "Triangle": 12,
+    "Heel hook": 12,
+    "Choke": 8,
+    "Guillotine": 8,
+    "Kneebar": 5,
+    "Straight ankle lock": 4,
+    "Kimura": 4,
+    "Bow and arrow": 3,
+    "Darce": 3,
+    "Footlock": 3,
+    "Ezekiel": 2,
+    "Toe hold": 2,
+    "Cross face": 1,
+}
+# and most of them happen at a few big competitions, the rest at a long tail of opens
+MAJORS = {
+    "IBJJF Worlds": 12,
+    "IBJJF Pans": 10,
+    "IBJJF Europeans": 8,
+    "Brasileiro": 8,
+    "ADCC": 5,
+    "IBJJF Worlds No Gi": 5,
+    "WNO": 2,
+    "Polaris": 1,
+    "EBI": 1,
+    "Kasai": 1,
+}
+OPENS = [f"Open {i}" for i in range(2000)]
+STAGES = ["F", "SF", "4F", "8F", "R1", "R2", "RR", "3RD", "SPF"]
+WEIGHTS = ["66KG", "77KG", "88KG", "99KG", "ABS", "O99KG", "60KG", "94KG"]
+
+
+def weighted(rng: np.random.Generator, weights: Dict[str, int], size: int) -> Any:
+    p = np.array(list(weights.values()), dtype=float)
+    return rng.choice(list(weights), size, p=p / p.sum())
+
+
+def zipf(n: int) -> Any:
+    """
+    the probabilities of n things where the kth is k times less likely than the first
+    """
+    p = 1 / np.arange(1, n + 1)
+    return p / p.sum()
+
+
+def make_frames(num_performances: int, seed: int = 0) -> Dict[str, pd.DataFrame]:
+    """
+    every match has two performances, and there is an athlete for every ten of them.
+    a few of the athletes have most of the matches, and only some of them have a page
+    on bjjheroes, the rest are opponents that only have a name
+    """
+    rng = np.random.default_rng(seed)
+    num_matches = max(num_performances // 2, 1)
+    num_athletes = max(num_performances // 10, 2)
+    athlete_ids = np.arange(1, num_athletes + 1)
+    athlete_df = pd.DataFrame(
+        {
+            "id": athlete_ids,
+            "name": [f"First{i} Last{i}" for i in athlete_ids],
+            "nickname": np.where(rng.random(num_athletes) < 0.8, "", "Nick"),
+            "url": np.where(
+                rng.random(num_athletes) < 0.3,
+                [f"https://www.bjjheroes.com/?p={i}" for i in athlete_ids],
+                "",
+            ),
+        }
+    )
+    kind = rng.choice(3, num_matches, p=[0.55, 0.25, 0.2])
+    method = np.where(
+        kind == 0,
+        rng.choice(POINTS, num_matches),
+        np.where(
+            kind == 1,
+            weighted(rng, DECISIONS, num_matches),
+            weighted(rng, SUBMISSIONS, num_matches),
+        ),
+    )
+    competition = np.where(
+        rng.random(num_matches) < 0.7,
+        weighted(rng, MAJORS, num_matches),
+        rng.choice(OPENS, num_matches, p=zipf(len(OPENS))),
+    )
+    match_ids = np.arange(1, num_matches + 1)
+    match_df = pd.DataFrame(
+        {
+            "id": match_ids,
+            # the recent years have the most matches
+            "year": np.maximum(2024 - rng.geometric(0.15, num_matches) + 1, 1995),
+            "competition": competition,
+            "method": method,
+            "stage": rng.choice(STAGES, num_matches),
+            "weight": rng.choice(WEIGHTS, num_matches),
+        }
+    )
+    # the first athlete in a match is one of the busy ones more often than not,
+    # and the two athletes in a match are never the same one
+    first = np.minimum(rng.zipf(1.5, num_matches) - 1, num_athletes - 1)
+    second = (first + rng.integers(1, num_athletes, num_matches)) % num_athletes
+    # one of them wins, unless it was a draw
+    result = np.where(rng.random(num_matches) < 0.02, "D", "W")
+    other = np.where(result == "D", "D", "L")
+    performance_df = pd.DataFrame(
+        {
+            "match_id": np.repeat(match_ids, 2)[:num_performances],
+            "athlete_id": athlete_ids[
+                np.column_stack([first, second]).ravel()[:num_performances]
+            ],
+            "result": np.column_stack([result, other]).ravel()[:num_performances],
+        }
+    )
+    return {"athlete": athlete_df, "match": match_df, "performance": performance_df}
+
+
+def month_before(frames: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """
+    the snapshot without the last 2% of the matches, as if they were scraped since
+    """
+    last = frames["match"].id.quantile(0.98)
+    return {
+        "athlete": frames["athlete"],
+        "match": frames["match"][frames["match"].id <= last],
+        "performance": frames["performance"][frames["performance"].match_id <= last],
+    }
+
+
+def write_snapshot(directory: str, frames: Dict[str, pd.DataFrame]) -> None:
+    os.makedirs(directory, exist_ok=True)
+    for name, df in frames.items():
+        df.to_parquet(os.path.join(directory, f"{name}.parquet"), index=False)
+
+
+def to_sql_load(
+    directory: str, engine: sa.Engine, chunksize: int, workers: int
+) -> None:
+    """
+    the load before the bulk loader, the whole snapshot is read into dataframes and
+    loaded with multi-row inserts from to_sql
+    """
+    frames = {
+        name: pd.read_parquet(os.path.join(directory, f"{name}.parquet"))
+        for name in TABLE_KEYS
+    }
+    # sqlite can't take a whole table's values in one statement, this is the chunks
+    # the load used to send it
+    to_sql_chunksize = 1000 if engine.dialect.name == "sqlite" else None
+    with engine.begin() as con:
+        for name in ["athlete", "performance", "match"]:
+            con.execute(sa.text(f"DELETE FROM {name}"))
+        for name in ["match", "athlete", "performance"]:
+            frames[name].to_sql(
+                name,
+                con,
+                if_exists="append",
+                index=False,
+                method="multi",
+                chunksize=to_sql_chunksize,
+            )
+
+
+def upload_loader(mode: str) -> Callable[[str, sa.Engine, int, int], None]:
+    def load(directory: str, engine: sa.Engine, chunksize: int, workers: int) -> None:
+        upload_from_directory(
+            directory, engine, mode=mode, chunksize=chunksize, workers=workers
+        )
+
+    return load
+
+
+LOADERS: Dict[str, Callable[[str, sa.Engine, int, int], None]] = {
+    **{mode: upload_loader(mode) for mode in LOAD_MODES},
+    "to_sql": to_sql_load,
+}
+
+
+def migrate(db_url: str) -> None:
+    os.environ["DB_URL"] = db_url
+    command.upgrade(Config("alembic.ini"), "head")
+
+
+def time_transactions(engine: sa.Engine) -> List[float]:
+    """
+    the seconds each of the engine's transactions was open for, from its begin to
+    its commit or rollback, this is how long a load holds its locks
+    """
+    seconds: List[float] = []
+    started: Dict[sa.Connection, float] = {}
+
+    def begin(con: sa.Connection) -> None:
+        started[con] = time.perf_counter()
+
+    def end(con: sa.Connection) -> None:
+        if con in started:
+            seconds.append(time.perf_counter() - started.pop(con))
+
+    sa.event.listen(engine, "begin", begin)
+    sa.event.listen(engine, "commit", end)
+    sa.event.listen(engine, "rollback", end)
+    return seconds
+
+
+def load(
+    db_url: str, directory: str, loader: str, chunksize: int, workers: int
+) -> Dict[str, Any]:
+    """
+    loads the snapshot in directory, this runs in a fresh process for each load
+    """
+    import_rss_mb = peak_rss_mb()
+    engine = sa.create_engine(db_url)
+    transactions = time_transactions(engine)
+    try:
+        start = time.perf_counter()
+        # the load's progress output would drown out the results
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            LOADERS[loader](directory, engine, chunksize, workers)
+        seconds = time.perf_counter() - start
+    finally:
+        engine.dispose()
+    return {
+        "seconds": seconds,
+        "transactions": len(transactions),
+        "transaction_seconds": sum(transactions),
+        "longest_transaction_seconds": max(transactions, default=0.0),
+        "peak_rss_mb": peak_rss_mb(),
+        "import_rss_mb": import_rss_mb,
+    }
+
+
+def run(
+    db_url: str, directory: str, previous: str, loader: str, args: argparse.Namespace
+) -> Dict[str, Any]:
+    """
+    loads the previous snapshot into the database, then times loading the one in
+    directory over it
+    """
+    migrate(db_url)
+    engine = sa.create_engine(db_url)
+    try:
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            upload_from_directory(previous, engine)
+    finally:
+        engine.dispose()
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        result = pool.submit(
+            load, db_url, directory, loader, args.chunksize, args.workers
+        ).result()
+    return {
+        "database": sa.make_url(db_url).get_backend_name(),
+        "loader": loader,
+        **result,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark the load step")
+    parser.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000, 1_000_000],
+        help="the performances in each snapshot",
+    )
+    parser.add_argument(
+        "--db-url",
+        action="append",
+        default=[],
+        help="a postgres database to load into as well as sqlite, can be repeated",
+    )
+    parser.add_argument(
+        "--loaders", nargs="+", default=list(LOADERS), choices=list(LOADERS)
+    )
+    parser.add_argument("--chunksize", type=int, default=CHUNKSIZE)
+    parser.add_argument("--workers", type=int, default=LOAD_WORKERS)
+    parser.add_argument(
+        "--json", action="store_true", help="print the results as json lines"
+    )
+    parser.add_argument(
+        "--output",
+        help="write the results and the setup they were run with to a json file",
+    )
+    args = parser.parse_args()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        db_urls: List[str] = [f"sqlite:///{os.path.join(directory, 'bench.db')}"]
+        for num_performances in args.rows:
+            frames = make_frames(num_performances)
+            snapshot = os.path.join(directory, str(num_performances))
+            previous = os.path.join(directory, f"{num_performances}-previous")
+            write_snapshot(snapshot, frames)
+            write_snapshot(previous, month_before(frames))
+            rows = sum(len(df) for df in frames.values())
+            del frames
+            for db_url in db_urls + args.db_url:
+                for loader in args.loaders:
+                    result = {
+                        "performances": num_performances,
+                        "rows": rows,
+                        **run(db_url, snapshot, previous, loader, args),
+                    }
+                    result["rows_per_second"] = rows / result["seconds"]
+                    results.append(result)
+                    if args.json:
+                        print(json.dumps(result))
+                    else:
+                        print(
+                            f"{result['database']} {loader}, "
+                            f"{num_performances} performances: "
+                            f"{result['rows_per_second']:.0f} rows/s, "
+                            f"{result['seconds']:.1f}s, "
+                            f"longest transaction {result['longest_transaction_seconds']:.1f}s, "
+                            f"peak rss {result['peak_rss_mb']:.0f} MB"
+                        )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "time": datetime.now().isoformat(),
+                    "python": platform.python_version(),
+                    "pandas": pd.__version__,
+                    "sqlalchemy": sa.__version__,
+                    "chunksize": args.chunksize,
+                    "workers": args.workers,
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
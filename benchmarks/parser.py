@@ -0,0 +1,57 @@
+"""
+a microbenchmark of the html parser backends in the extract script.
+it parses the same synthetic athlete pages with every backend and reports
+the pages per second each one manages.
+
+heres how you would run it from the root of the repo:
+python -m benchmarks.parser --pages 2000 --matches 40
+"""
+
+import argparse
+import random
+import time
+from typing import List
+
+from pipeline.extract.extract import PARSER_BACKENDS
+from tests.synthetic_site import SyntheticMatch, athlete_page
+
+
+def make_pages(num_pages: int, matches_per_page: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    pages = []
+    for page in range(num_pages):
+        matches = []
+        for match in range(rng.randint(0, matches_per_page * 2)):
+            opponent = rng.randrange(num_pages)
+            matches.append(
+                SyntheticMatch(
+                    match_id=page * matches_per_page * 2 + match,
+                    opponent=f"Athlete {opponent}",
+                    href=f"/?p={opponent}" if rng.random() < 0.7 else None,
+                    result=rng.choice(["W", "L", "D"]),
+                )
+            )
+        pages.append(athlete_page(matches))
+    return pages
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="benchmark the html parser backends")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument(
+        "--matches", type=int, default=30, help="the average matches per page"
+    )
+    args = parser.parse_args()
+    pages = make_pages(args.pages, args.matches)
+    megabytes = sum(len(page) for page in pages) / 1024**2
+    print(f"parsing {len(pages)} pages ({megabytes:.1f} MB)")
+    for name, backend in PARSER_BACKENDS.items():
+        start = time.perf_counter()
+        for page in pages:
+            backend.parse_athlete_page(page)
+        elapsed = time.perf_counter() - start
+        print(f"{name}: {len(pages) / elapsed:.0f} pages/s ({elapsed:.2f}s)")
+
+
+if __name__ == "__main__":
+    main()
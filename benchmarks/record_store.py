@@ -0,0 +1,130 @@
+"""
+compares the memory it takes to hold the scraper's records as sets of frozen
+dataclasses, the way the scraper used to, with the columnar record tables it
+uses now. the records are made up but have roughly the mix of repeated and
+unique strings the real scrape has.
+
+heres how you would run it from the root of the repo:
+python -m benchmarks.record_store --matches 200000
+"""
+
+import argparse
+import random
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from pipeline.extract.extract import (
+    Athlete,
+    AthleteTable,
+    Match,
+    MatchTable,
+    Performance,
+    PerformanceTable,
+)
+
+COMPETITIONS = [f"Competition {i}" for i in range(2000)]
+METHODS = [f"Method {i}" for i in range(150)]
+STAGES = ["F", "SF", "4F", "8F", "R1", "R2", "RR", "3RD", "SPF"]
+WEIGHTS = ["66KG", "77KG", "88KG", "99KG", "ABS", "O99KG", "60KG", "94KG"]
+YEARS = [str(year) for year in range(1995, 2025)]
+
+
+def make_rows(
+    num_matches: int, seed: int = 0
+) -> Tuple[List[Tuple[Any, ...]], List[Tuple[Any, ...]], List[Tuple[Any, ...]]]:
+    rng = random.Random(seed)
+    num_athletes = max(num_matches // 10, 2)
+    athletes = [
+        (
+            i,
+            f"First{i} Last{i}",
+            rng.choice(["", "", "", f"Nick{i % 500}"]),
+            f"https://www.bjjheroes.com/?p={i}" if rng.random() < 0.7 else "",
+        )
+        for i in range(1, num_athletes + 1)
+    ]
+    matches = []
+    performances = []
+    for match_id in range(1, num_matches + 1):
+        matches.append(
+            (
+                match_id,
+                rng.choice(YEARS),
+                rng.choice(COMPETITIONS),
+                rng.choice(METHODS),
+                rng.choice(STAGES),
+                rng.choice(WEIGHTS),
+            )
+        )
+        first, second = rng.sample(range(1, num_athletes + 1), 2)
+        result = rng.choice(["W", "L", "D"])
+        performances.append((match_id, first, result))
+        performances.append((match_id, second, {"W": "L", "L": "W"}.get(result, "D")))
+    return athletes, matches, performances
+
+
+def measure(build: Callable[[], Any]) -> int:
+    """
+    :return: the bytes still allocated by whatever build returns
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return after - before
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="compare the memory of the scraper's record stores"
+    )
+    parser.add_argument("--matches", type=int, default=100_000)
+    args = parser.parse_args()
+    athletes, matches, performances = make_rows(args.matches)
+
+    # the strings in the rows are shared by both stores, so the rows are copied
+    # with fresh strings each time to count what each store really holds onto
+    def fresh(rows: List[Tuple[Any, ...]]) -> List[Tuple[Any, ...]]:
+        return [
+            tuple("".join(v) if isinstance(v, str) else v for v in row) for row in rows
+        ]
+
+    stores: Dict[str, Callable[[], Any]] = {
+        "sets of dataclasses": lambda: (
+            {Athlete(*row) for row in fresh(athletes)},
+            {Match(*row) for row in fresh(matches)},
+            {Performance(*row) for row in fresh(performances)},
+        ),
+        "record tables": lambda: build_tables(
+            fresh(athletes), fresh(matches), fresh(performances)
+        ),
+    }
+    print(
+        f"{len(athletes)} athletes, {len(matches)} matches, "
+        f"{len(performances)} performances"
+    )
+    for name, build in stores.items():
+        print(f"{name}: {measure(build) / 1024**2:.1f} MB")
+
+
+def build_tables(
+    athletes: List[Tuple[Any, ...]],
+    matches: List[Tuple[Any, ...]],
+    performances: List[Tuple[Any, ...]],
+) -> Tuple[AthleteTable, MatchTable, PerformanceTable]:
+    athlete_table = AthleteTable()
+    for row in athletes:
+        athlete_table.add_row(*row)
+    match_table = MatchTable()
+    for row in matches:
+        match_table.add_row(*row)
+    performance_table = PerformanceTable()
+    for row in performances:
+        performance_table.add_row(*row)
+    return athlete_table, match_table, performance_table
+
+
+if __name__ == "__main__":
+    main()
@@ -8,14 +8,54 @@ or to upload to s3:
 python extract.py --s3 's3_folder_name'
 """
 
+import abc
+import array
+import bisect
+import collections
+import contextlib
 import dataclasses
+import fcntl
+import functools
+import gzip
+import hashlib
+import itertools
+import json
 import os
+import random
+import re
+import tempfile
+import time
+import urllib.parse
+import zipfile
 import argparse
-from typing import Optional, Any, Dict, Set, Tuple
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import (
+    Optional,
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Literal,
+    NamedTuple,
+    Set,
+    Tuple,
+    Type,
+    Union,
+)
 from datetime import datetime
 
+import boto3  # comes with the lambda python base image
 import bs4
+import lxml.etree  # type: ignore
+import lxml.html  # type: ignore
+import numpy as np
 import pandas as pd
+import pyarrow as pa  # type: ignore
+import pyarrow.fs  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
 import requests  # type: ignore
 from aws_lambda_powertools.utilities.data_classes import ALBEvent
 from aws_lambda_powertools.utilities.typing import LambdaContext
@@ -23,6 +63,49 @@ import aiohttp
 import asyncio
 
 SOURCE_HOSTNAME = "https://www.bjjheroes.com"
+# the number of athlete pages that are kept downloading at once
+MAX_CONCURRENCY = 100
+# the number of pooled connections the crawl's session keeps open to the site
+CONNECTION_LIMIT = 100
+# seconds before a single athlete page download is given up on
+REQUEST_TIMEOUT = 30.0
+# how many times a page is retried after a throttled, failed or timed out download
+MAX_RETRIES = 4
+# seconds the first retry waits on average, each retry after that waits twice as long
+RETRY_BACKOFF = 1.0
+MAX_RETRY_BACKOFF = 30.0
+# the statuses that mean the site is overloaded and the download should be retried
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# how long before the lambda times out the scrape stops so it can be checkpointed,
+# this has to leave time for the downloads in flight and the upload of the checkpoint
+STOP_MARGIN_MS = 90_000
+# the default size the on-disk page cache is allowed to grow to before evicting pages
+PAGE_CACHE_MAX_BYTES = 1024**3
+# the share of max_bytes the cache is evicted down to, so that it has room for a lot
+# of pages before the next eviction has to go through the whole directory again
+PAGE_CACHE_LOW_WATER = 0.9
+# the number of downloaded pages that are held in memory waiting to be parsed, once
+# there are this many the downloads wait for the parsing to catch up, or the pages
+# are spilled to disk if there is a spill directory
+SCRAPE_QUEUE_SIZE = 500
+# the rows in each row group of the parquet output, and how it is compressed
+PARQUET_ROW_GROUP_SIZE = 100_000
+PARQUET_COMPRESSION = "zstd"
+# seconds an idle shard waits before checking its inbox again
+SHARD_POLL_INTERVAL = 0.1
+# the folder the snapshots of every scrape go in
+SNAPSHOT_ROOT = "s3://bjjstats/bjjheroes-scrape-v1"
+# where the ids given to the athletes are kept between the monthly scrapes
+ID_REGISTRY_PATH = f"{SNAPSHOT_ROOT}/id_registry.json"
+# the upper bounds in seconds of the buckets the download and parse latencies are counted in
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# the metrics' names start with this in the prometheus text
+METRICS_PREFIX = "bjjstats_extract"
+# the labels the stage timings keep in the prometheus text, the timings are added up
+# over the rest of them, eg the iteration, which would make a new series every scrape
+STAGE_LABELS = ("stage", "shard")
+# seconds between pushes of the metrics while a scrape runs
+METRICS_PUSH_INTERVAL = 15.0
 
 
 @dataclasses.dataclass(frozen=True)
@@ -35,133 +118,1546 @@ class Athlete:
     def to_csv_row(self) -> str:
         return f'{self.id},"{self.name}","{self.nickname}","{self.url}"'
 
-    def __hash__(self) -> int:
-        return hash((self.id, self.name, self.nickname, self.url))
+
+@dataclasses.dataclass(frozen=True)
+class Match:
+    id: int
+    year: str
+    competition: str
+    method: str
+    stage: str
+    weight: str
+
+    def to_csv_row(self) -> str:
+        return f'{self.id},{self.year},"{self.competition}","{self.method}","{self.stage}","{self.weight}"'
+
+
+@dataclasses.dataclass(frozen=True)
+class Performance:
+    match_id: int
+    athlete_id: int
+    result: str
+
+    def to_csv_row(self) -> str:
+        return f'{self.match_id},{self.athlete_id},"{self.result}"'
+
+
+class IntColumn:
+    """
+    a column of 64 bit integers packed into an array
+    """
+
+    def __init__(self) -> None:
+        self.values = array.array("q")
+
+    def append(self, value: int) -> None:
+        self.values.append(value)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.values)
+
+    def to_numpy(self) -> np.ndarray:
+        # copied so that the array isn't stuck exporting its buffer and can still grow
+        values: np.ndarray = np.frombuffer(self.values, dtype=np.int64).copy()
+        return values
+
+    def to_arrow(self, start: int, stop: int, type_: pa.DataType) -> pa.Array:
+        values = np.frombuffer(self.values, dtype=np.int64)[start:stop].copy()
+        return pa.array(values, type=type_)
+
+
+class StringColumn:
+    """
+    a column of mostly unique strings, like names and urls, stored back to back
+    as utf-8 in one bytearray instead of as one python object each
+    """
+
+    def __init__(self) -> None:
+        self.data = bytearray()
+        self.offsets = array.array("Q", [0])
+
+    def append(self, value: str) -> None:
+        self.data += value.encode()
+        self.offsets.append(len(self.data))
+
+    def __iter__(self) -> Iterator[str]:
+        data = self.data
+        offsets = self.offsets
+        for i in range(len(offsets) - 1):
+            yield data[offsets[i] : offsets[i + 1]].decode()
+
+    def to_numpy(self) -> np.ndarray:
+        return np.array(list(self), dtype=object)
+
+    def to_arrow(self, start: int, stop: int, type_: pa.DataType) -> pa.Array:
+        # the utf-8 and offsets are already laid out the way arrow stores strings,
+        # so the rows are copied over as two buffers instead of string by string
+        offsets = np.frombuffer(self.offsets, dtype=np.uint64)[start : stop + 1]
+        offsets = offsets.astype(np.int64)
+        data = bytes(self.data[offsets[0] : offsets[-1]])
+        offsets -= offsets[0]
+        strings = pa.LargeStringArray.from_buffers(
+            stop - start, pa.py_buffer(offsets), pa.py_buffer(data)
+        )
+        return strings.cast(type_)
+
+
+class DictionaryColumn:
+    """
+    a column of strings that repeat a lot, like competitions and methods, stored as
+    codes into a list of the distinct values so each value is only kept once
+    """
+
+    def __init__(self) -> None:
+        self.codes = array.array("I")
+        self.values: List[str] = []
+        self.index: Dict[str, int] = {}
+
+    def append(self, value: str) -> None:
+        code = self.index.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.index[value] = code
+        self.codes.append(code)
+
+    def __iter__(self) -> Iterator[str]:
+        values = self.values
+        return (values[code] for code in self.codes)
+
+    def to_numpy(self) -> np.ndarray:
+        codes = np.frombuffer(self.codes, dtype=np.uint32).copy()
+        values: np.ndarray = np.array(self.values, dtype=object)[codes]
+        return values
+
+    def to_arrow(self, start: int, stop: int, type_: pa.DataType) -> pa.Array:
+        """
+        :param type_: a string type, or an integer type for columns of numbers like
+        the year, in which case the values that aren't numbers become nulls
+        """
+        if pa.types.is_integer(type_):
+            dictionary = pa.array(
+                [int(v) if v.strip().isdigit() else None for v in self.values], type_
+            )
+        else:
+            dictionary = pa.array(self.values, type_)
+        codes = np.frombuffer(self.codes, dtype=np.uint32)[start:stop].copy()
+        return dictionary.take(pa.array(codes))
+
+
+Column = Union[IntColumn, StringColumn, DictionaryColumn]
+
+
+class RecordTable:
+    """
+    A compact columnar store for the records the scraper finds, with one typed column
+    per field. A record is only added once per key, so a match that is found on the
+    pages of both athletes is only stored once.
+    Iterating over the table gives the records as dataclasses, but those are only
+    built on the fly, the table itself never holds them.
+    """
+
+    record_type: Type[Any]
+    # the column type of each field of the record, in the order of the record's fields
+    schema: Dict[str, Type[Column]]
+    # the type of each column in the parquet output
+    arrow_schema: pa.Schema
+
+    def __init__(self) -> None:
+        self.columns: Dict[str, Column] = {
+            name: column_type() for name, column_type in self.schema.items()
+        }
+        self._columns = list(self.columns.values())
+        self.keys: Set[int] = set()
+
+    @staticmethod
+    def key(values: Tuple[Any, ...]) -> int:
+        # the id is the first field
+        return int(values[0])
+
+    def add_row(self, *values: Any) -> bool:
+        """
+        adds the record with these values, in the order of the schema, unless a
+        record with the same key has been added already
+        :return: whether the record was added
+        """
+        key = self.key(values)
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        for column, value in zip(self._columns, values):
+            column.append(value)
+        return True
+
+    def add(self, record: Any) -> bool:
+        return self.add_row(*dataclasses.astuple(record))
+
+    def rows(self) -> Iterator[Tuple[Any, ...]]:
+        return zip(*self._columns)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __iter__(self) -> Iterator[Any]:
+        record_type = self.record_type
+        return (record_type(*row) for row in self.rows())
+
+    def __contains__(self, record: Any) -> bool:
+        """
+        whether a record with the same key has been added, which is when add would
+        leave the record out
+        """
+        return self.key(dataclasses.astuple(record)) in self.keys
 
     def __eq__(self, other: Any) -> bool:
-        if not isinstance(other, Athlete):
+        if not isinstance(other, RecordTable):
             return False
-        return (
-            self.id == other.id
-            and self.name == other.name
-            and self.nickname == other.nickname
-            and self.url == other.url
+        return self.record_type is other.record_type and set(self.rows()) == set(
+            other.rows()
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        df: pd.DataFrame = pd.DataFrame(
+            {name: column.to_numpy() for name, column in self.columns.items()}
+        )
+        return df
+
+    def to_arrow(self, start: int = 0, stop: Optional[int] = None) -> pa.RecordBatch:
+        """
+        the rows from start to stop as an arrow record batch with the arrow_schema
+        """
+        stop = len(self) if stop is None else stop
+        return pa.record_batch(
+            [
+                column.to_arrow(start, stop, field.type)
+                for column, field in zip(self._columns, self.arrow_schema)
+            ],
+            schema=self.arrow_schema,
+        )
+
+    @property
+    def dictionary_columns(self) -> List[str]:
+        return [
+            name
+            for name, column_type in self.schema.items()
+            if column_type is DictionaryColumn
+        ]
+
+
+class AthleteTable(RecordTable):
+    record_type = Athlete
+    schema = {
+        "id": IntColumn,
+        "name": StringColumn,
+        "nickname": DictionaryColumn,
+        "url": StringColumn,
+    }
+    arrow_schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("name", pa.string()),
+            ("nickname", pa.string()),
+            ("url", pa.string()),
+        ]
+    )
+
+
+class MatchTable(RecordTable):
+    record_type = Match
+    schema = {
+        "id": IntColumn,
+        "year": DictionaryColumn,
+        "competition": DictionaryColumn,
+        "method": DictionaryColumn,
+        "stage": DictionaryColumn,
+        "weight": DictionaryColumn,
+    }
+    arrow_schema = pa.schema(
+        [
+            ("id", pa.int64()),
+            ("year", pa.int16()),
+            ("competition", pa.string()),
+            ("method", pa.string()),
+            ("stage", pa.string()),
+            ("weight", pa.string()),
+        ]
+    )
+
+
+class PerformanceTable(RecordTable):
+    record_type = Performance
+    schema = {
+        "match_id": IntColumn,
+        "athlete_id": IntColumn,
+        "result": DictionaryColumn,
+    }
+    arrow_schema = pa.schema(
+        [
+            ("match_id", pa.int64()),
+            ("athlete_id", pa.int64()),
+            ("result", pa.string()),
+        ]
+    )
+
+    @staticmethod
+    def key(values: Tuple[Any, ...]) -> int:
+        # each athlete has one performance per match, whatever the result, which the
+        # unique index on performance in the database relies on. the two ids are packed
+        # into one int because a set of ints is much smaller than a set of tuples
+        return (int(values[0]) << 32) | int(values[1])
+
+
+def resolve_directory(directory: str) -> Tuple[pyarrow.fs.FileSystem, str]:
+    """
+    the pyarrow filesystem and path of a local directory or an s3://bucket/prefix
+    """
+    if "://" in directory:
+        filesystem, path = pyarrow.fs.FileSystem.from_uri(directory)
+        return filesystem, path
+    return pyarrow.fs.LocalFileSystem(), os.path.abspath(directory)
+
+
+class ParquetOutput:
+    """
+    Streams record tables into one parquet file per table, eg athlete.parquet, in a
+    local directory or an s3://bucket/prefix. Every time write is called, each table's
+    new rows are written out as row groups once there are row_group_size of them, so
+    the files are built up as the scrape goes instead of all at once at the end.
+    The repeated strings are dictionary encoded in the files, and close writes out
+    the rows that are left and finishes the files.
+    """
+
+    def __init__(
+        self,
+        destination: str,
+        compression: str = PARQUET_COMPRESSION,
+        row_group_size: int = PARQUET_ROW_GROUP_SIZE,
+    ):
+        self.filesystem, self.directory = resolve_directory(destination)
+        self.filesystem.create_dir(self.directory, recursive=True)
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.writers: Dict[str, pq.ParquetWriter] = {}
+        # the number of rows of each table that have been written so far, the tables
+        # only ever have rows added to the end so the rest still have to be written
+        self.written: Dict[str, int] = {}
+
+    def writer(self, name: str, table: RecordTable) -> pq.ParquetWriter:
+        if name not in self.writers:
+            self.writers[name] = pq.ParquetWriter(
+                f"{self.directory}/{name}.parquet",
+                table.arrow_schema,
+                filesystem=self.filesystem,
+                compression=self.compression,
+                use_dictionary=table.dictionary_columns,
+            )
+        return self.writers[name]
+
+    def write(self, tables: Dict[str, RecordTable], final: bool = False) -> None:
+        """
+        :param tables: the tables keyed by the name of their file
+        :param final: write out every row that is left, even if it isn't a full row group
+        """
+        for name, table in tables.items():
+            start = self.written.get(name, 0)
+            while len(table) - start >= self.row_group_size or (
+                final and start < len(table)
+            ):
+                stop = min(start + self.row_group_size, len(table))
+                self.writer(name, table).write_batch(
+                    table.to_arrow(start, stop), row_group_size=self.row_group_size
+                )
+                start = stop
+            self.written[name] = start
+
+    def close(self, tables: Dict[str, RecordTable]) -> None:
+        self.write(tables, final=True)
+        for name, table in tables.items():
+            # so that an empty table still gets a file
+            self.writer(name, table)
+        for writer in self.writers.values():
+            writer.close()
+
+
+def write_file(path: str, data: bytes) -> None:
+    """
+    writes the data to a local path or to an s3://bucket/key path
+    """
+    if path.startswith("s3://"):
+        bucket, key = path[len("s3://") :].split("/", 1)
+        boto3.client("s3").put_object(Bucket=bucket, Key=key, Body=data)
+    else:
+        with open(path, "wb") as f:
+            f.write(data)
+
+
+def read_file(path: str) -> bytes:
+    """
+    reads the data from a local path or from an s3://bucket/key path
+    """
+    if path.startswith("s3://"):
+        bucket, key = path[len("s3://") :].split("/", 1)
+        client = boto3.client("s3")
+        try:
+            body: bytes = client.get_object(Bucket=bucket, Key=key)["Body"].read()
+        except client.exceptions.NoSuchKey:
+            # the same error as a missing local file
+            raise FileNotFoundError(path)
+        return body
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class IdRegistry:
+    """
+    The ids that have been given to athletes, so that an athlete keeps the same id
+    from one scrape to the next whatever order the scrape finds them in. Athletes are
+    keyed by the path and query of their url (eg url:/?p=9246) so the host can change,
+    or for the opponents without a page, by their name with the case and spacing
+    normalized (eg name:john doe). New athletes get the next id after the highest
+    one given out so far, ids are never reused.
+    The registry is saved with each snapshot and loaded at the start of the next scrape.
+    """
+
+    def __init__(self, ids: Optional[Dict[str, int]] = None):
+        self.ids: Dict[str, int] = dict(ids or {})
+        self.next_id = max(self.ids.values(), default=0) + 1
+
+    @staticmethod
+    def url_key(url: str) -> str:
+        parts = urllib.parse.urlsplit(url.strip())
+        path = parts.path.rstrip("/") or "/"
+        return f"url:{path}?{parts.query}" if parts.query else f"url:{path}"
+
+    @staticmethod
+    def name_key(name: str) -> str:
+        return f"name:{' '.join(name.split()).casefold()}"
+
+    def athlete_id(self, url: str = "", name: str = "") -> int:
+        """
+        the id of the athlete with this url, or with this name if they have no url,
+        a new id is given out the first time an athlete is seen
+        """
+        key = self.url_key(url) if url else self.name_key(name)
+        athlete_id = self.ids.get(key)
+        if athlete_id is None:
+            athlete_id = self.next_id
+            self.ids[key] = athlete_id
+            self.next_id += 1
+        return athlete_id
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def to_json(self) -> bytes:
+        return json.dumps(self.ids, separators=(",", ":")).encode()
+
+    @classmethod
+    def from_json(cls, data: bytes) -> "IdRegistry":
+        return cls(json.loads(data))
+
+    def save(self, path: str) -> None:
+        """
+        saves the registry to a local path or an s3://bucket/key path
+        """
+        write_file(path, self.to_json())
+
+    @classmethod
+    def load(cls, path: str) -> "IdRegistry":
+        """
+        loads the registry saved at path, or starts an empty one if there isn't one yet
+        """
+        try:
+            return cls.from_json(read_file(path))
+        except FileNotFoundError:
+            return cls()
+
+
+@dataclasses.dataclass(frozen=True)
+class CachedPage:
+    page: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+
+    def revalidation_headers(self) -> Dict[str, str]:
+        """
+        the headers that ask the server to answer with a 304 if the page has not changed
+        """
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class PageCache:
+    """
+    An on-disk cache of downloaded pages, so that a re-scrape only has to revalidate
+    the pages it has already seen. Each page is stored in its own file named after the
+    hash of its url, along with the ETag and Last-Modified headers it was served with.
+    When the files grow past max_bytes, the least recently used pages are evicted
+    until they're back under PAGE_CACHE_LOW_WATER of it.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = PAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(size for _, size, _ in self.entries())
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """
+        the modified time, size and path of each page in the cache. the shards of a
+        crawl share the directory, so a page can be evicted by another shard while
+        this runs, those pages are left out
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        try:
+            with open(self.path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return CachedPage(entry["page"], entry["etag"], entry["last_modified"])
+
+    def touch(self, url: str) -> None:
+        """
+        marks a page as recently used, the eviction goes by the file's modified time
+        """
+        try:
+            os.utime(self.path(url))
+        except OSError:
+            pass
+
+    def put(
+        self,
+        url: str,
+        page: str,
+        etag: Optional[str],
+        last_modified: Optional[str],
+    ) -> None:
+        path = self.path(url)
+        try:
+            self.size -= os.path.getsize(path)
+        except FileNotFoundError:
+            pass
+        data = json.dumps(
+            {
+                "url": url,
+                "etag": etag,
+                "last_modified": last_modified,
+                "page": page,
+            }
+        ).encode()
+        # the page is written to a temporary file first so a crash never leaves half a
+        # page, the file is this process's own so the shards never write to the same one
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(data)
+        os.replace(temporary, path)
+        # the size of what was written, the file itself could be evicted by now
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """
+        deletes the least recently used pages until the cache is back under the
+        low water mark
+        """
+        entries = sorted(self.entries())
+        # the other shards add and evict pages in the same directory, so what's in
+        # it is counted again rather than trusting the size this process kept
+        self.size = sum(size for _, size, _ in entries)
+        low_water = self.max_bytes * PAGE_CACHE_LOW_WATER
+        for _, size, path in entries:
+            if self.size <= low_water:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another shard evicted it first
+                pass
+            self.size -= size
+
+
+class PageArchive:
+    """
+    A single zip file of the pages a scrape downloaded, so that the scrape can be
+    replayed later without the network. Pages are keyed by their path and query
+    (eg /?p=9246) rather than the full url, so an archive recorded from one host
+    can be replayed against any SOURCE_HOSTNAME. The index of which entry holds
+    which page is written to index.json when the archive is closed.
+    usage:
+    with PageArchive("scrape.zip", "w") as archive:
+        Scraper(record_to=archive).scrape()
+    with PageArchive("scrape.zip") as archive:
+        Scraper(replay_from=archive).scrape()
+    """
+
+    def __init__(self, path: str, mode: Literal["r", "w"] = "r"):
+        if mode not in ("r", "w"):
+            raise ValueError(f"unknown archive mode {mode}, expected r or w")
+        self.path = path
+        self.mode = mode
+        self.zip = zipfile.ZipFile(path, mode, compression=zipfile.ZIP_DEFLATED)
+        self.index: Dict[str, str] = (
+            json.loads(self.zip.read("index.json")) if mode == "r" else {}
+        )
+
+    @staticmethod
+    def key(url: str) -> str:
+        parts = urllib.parse.urlsplit(url)
+        return f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+    def get(self, url: str) -> Optional[str]:
+        name = self.index.get(self.key(url))
+        if name is None:
+            return None
+        return self.zip.read(name).decode()
+
+    def put(self, url: str, page: str) -> None:
+        key = self.key(url)
+        if key in self.index:
+            return
+        name = f"pages/{len(self.index)}.html"
+        self.zip.writestr(name, page)
+        self.index[key] = name
+
+    def __contains__(self, url: str) -> bool:
+        return self.key(url) in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def close(self) -> None:
+        if self.mode == "w":
+            self.zip.writestr("index.json", json.dumps(self.index))
+        self.zip.close()
+
+    def __enter__(self) -> "PageArchive":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+
+class AthleteRecord(NamedTuple):
+    """
+    one row of the a-z list of athletes
+    """
+
+    row_number: int
+    name: str
+    nickname: str
+    # the link to the athlete's page relative to SOURCE_HOSTNAME
+    href: str
+
+
+class MatchRecord(NamedTuple):
+    """
+    one row of the match table on an athlete's page, as plain values so that
+    it can be sent back from a worker process
+    """
+
+    match_id: int
+    result: str
+    method: str
+    competition: str
+    weight: str
+    stage: str
+    year: str
+    opponent_name: str
+    # the link to the opponent's page relative to SOURCE_HOSTNAME, if they have one
+    opponent_href: Optional[str]
+
+
+def clean_opponent_name(opponent_name: str) -> str:
+    if opponent_name.lower() in ["n/a", "na"]:
+        return "Unknown"
+    return opponent_name
+
+
+def clean_athlete_name(first_name: str, last_name: str) -> str:
+    name = f"{first_name} {last_name}"
+    return name.replace("  ", " ")
+
+
+class PageParser(abc.ABC):
+    """
+    the interface of the parser backends in PARSER_BACKENDS, each backend
+    must return exactly the same records for the same html
+    """
+
+    @classmethod
+    @abc.abstractmethod
+    def parse_athlete_list(cls, html: str) -> List[AthleteRecord]:
+        """
+        the athletes in the table of the athlete list page, in the order they're listed
+        """
+
+    @classmethod
+    @abc.abstractmethod
+    def parse_athlete_page(cls, html: str) -> List[MatchRecord]:
+        """
+        the matches in the table of an athlete's page, in the order they're listed
+        """
+
+
+class Bs4Parser(PageParser):
+    """
+    parses the pages into a full BeautifulSoup tree with python's html.parser
+    """
+
+    @classmethod
+    def parse_athlete_list(cls, html: str) -> List[AthleteRecord]:
+        soup = bs4.BeautifulSoup(html, "html.parser")
+        table = soup.find_all("tr")
+        records = []
+        for rowNumber, row in enumerate(table):
+            data = row.find_all("td")
+            if data:
+                records.append(
+                    AthleteRecord(
+                        row_number=rowNumber,
+                        name=clean_athlete_name(data[0].text, data[1].text),
+                        nickname=data[2].text,
+                        href=str(data[0].find("a").get("href")),
+                    )
+                )
+        return records
+
+    @classmethod
+    def parse_athlete_page(cls, html: str) -> List[MatchRecord]:
+        bs = bs4.BeautifulSoup(html, "html.parser")
+        table = bs.find("table", {"class": "table table-striped sort_table"})
+        if table is None:
+            # this is an athlete that has no recorded matches
+            return []
+        body = table.find("tbody")
+        records = []
+        for row in body.find_all("tr"):
+            match_details = row.find_all("td")
+            opponent_name_cell = match_details[1]
+            opponent_url_element = opponent_name_cell.find("a")
+            records.append(
+                MatchRecord(
+                    match_id=int(match_details[0].text),
+                    result=match_details[2].text,
+                    method=match_details[3].text,
+                    competition=match_details[4].text,
+                    weight=match_details[5].text,
+                    stage=match_details[6].text,
+                    year=match_details[7].text,
+                    opponent_name=clean_opponent_name(
+                        opponent_name_cell.find("span").text
+                    ),
+                    opponent_href=(
+                        str(opponent_url_element.get("href"))
+                        if opponent_url_element is not None
+                        else None
+                    ),
+                )
+            )
+        return records
+
+
+class LxmlParser(PageParser):
+    """
+    parses the pages with libxml2 and walks straight to the rows that are needed
+    with xpath, without building any python objects for the rest of the page
+    """
+
+    html_parser = lxml.html.HTMLParser(encoding="utf-8")
+
+    @classmethod
+    def parse_tree(cls, html: str) -> Optional[lxml.html.HtmlElement]:
+        # the html is passed as bytes because lxml refuses strings with an encoding declaration
+        tree: Optional[lxml.html.HtmlElement] = lxml.etree.fromstring(
+            html.encode("utf-8"), cls.html_parser
+        )
+        return tree
+
+    @staticmethod
+    def text(element: lxml.html.HtmlElement) -> str:
+        # text_content returns a str subclass that keeps the whole tree alive
+        return str(element.text_content())
+
+    @classmethod
+    def parse_athlete_list(cls, html: str) -> List[AthleteRecord]:
+        tree = cls.parse_tree(html)
+        if tree is None:
+            return []
+        records = []
+        for rowNumber, row in enumerate(tree.iter("tr")):
+            data = row.xpath(".//td")
+            if data:
+                records.append(
+                    AthleteRecord(
+                        row_number=rowNumber,
+                        name=clean_athlete_name(cls.text(data[0]), cls.text(data[1])),
+                        nickname=cls.text(data[2]),
+                        href=str(data[0].xpath(".//a")[0].get("href")),
+                    )
+                )
+        return records
+
+    @classmethod
+    def parse_athlete_page(cls, html: str) -> List[MatchRecord]:
+        tree = cls.parse_tree(html)
+        if tree is None:
+            return []
+        bodies = tree.xpath(
+            "(//table[@class='table table-striped sort_table'])[1]/tbody"
+        )
+        if not bodies:
+            # this is an athlete that has no recorded matches
+            return []
+        records = []
+        for row in bodies[0].xpath(".//tr"):
+            match_details = row.xpath(".//td")
+            opponent_name_cell = match_details[1]
+            opponent_url_elements = opponent_name_cell.xpath(".//a")
+            records.append(
+                MatchRecord(
+                    match_id=int(cls.text(match_details[0])),
+                    result=cls.text(match_details[2]),
+                    method=cls.text(match_details[3]),
+                    competition=cls.text(match_details[4]),
+                    weight=cls.text(match_details[5]),
+                    stage=cls.text(match_details[6]),
+                    year=cls.text(match_details[7]),
+                    opponent_name=clean_opponent_name(
+                        cls.text(opponent_name_cell.xpath(".//span")[0])
+                    ),
+                    opponent_href=(
+                        str(opponent_url_elements[0].get("href"))
+                        if opponent_url_elements
+                        else None
+                    ),
+                )
+            )
+        return records
+
+
+PARSER_BACKENDS: Dict[str, Type[PageParser]] = {
+    "bs4": Bs4Parser,
+    "lxml": LxmlParser,
+}
+
+
+def parse_athlete_page(html: str, backend: str = "bs4") -> List[MatchRecord]:
+    """
+    This function parses the match table from an athlete's page.
+    It doesn't touch any scraper state, so it can run in a worker process.
+    :param html: the text html of the athlete's page
+    :param backend: the name of the parser in PARSER_BACKENDS to use
+    :return: one record per row of the match table
+    """
+    return PARSER_BACKENDS[backend].parse_athlete_page(html)
+
+
+class PageQueue:
+    """
+    The downloaded athlete pages waiting to be parsed, first in first out.
+    At most max_pages pages are held in memory. Once it is full, put waits until
+    a page is popped, so the downloads can't get ahead of the parsing, unless there
+    is a spill_dir, then the pages that don't fit are gzipped to files in it instead.
+    add never waits, it is for callers that have nothing parsing the queue at the
+    same time.
+    """
+
+    def __init__(
+        self, max_pages: int = SCRAPE_QUEUE_SIZE, spill_dir: Optional[str] = None
+    ):
+        if max_pages < 1:
+            # put would wait forever for room that never comes
+            raise ValueError(
+                f"the scrape queue must hold at least 1 page, not {max_pages}"
+            )
+        self.max_pages = max_pages
+        self.spill_dir = spill_dir
+        # the athlete id with either the page or the path of the file it was spilled to
+        self._pages: Deque[Tuple[int, Optional[str], Optional[str]]] = (
+            collections.deque()
+        )
+        self.in_memory = 0
+        self.spilled = 0
+        # once closed, put stops waiting for room, so that nothing is left stuck
+        # waiting when the parsing stops early
+        self.closed = False
+        self._waiters: List[asyncio.Future[None]] = []
+
+    @property
+    def full(self) -> bool:
+        return self.in_memory >= self.max_pages
+
+    def add(self, item: Tuple[int, str]) -> None:
+        athlete_id, page = item
+        if self.full and self.spill_dir is not None:
+            fd, path = tempfile.mkstemp(suffix=".html.gz", dir=self.spill_dir)
+            with os.fdopen(fd, "wb") as f:
+                f.write(gzip.compress(page.encode(), compresslevel=1))
+            self._pages.append((athlete_id, None, path))
+            self.spilled += 1
+        else:
+            self._pages.append((athlete_id, page, None))
+            self.in_memory += 1
+
+    async def put(self, athlete_id: int, page: str) -> None:
+        while self.full and self.spill_dir is None and not self.closed:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            await waiter
+        self.add((athlete_id, page))
+
+    def pop(self) -> Tuple[int, str]:
+        athlete_id, page, path = self._pages.popleft()
+        if path is not None:
+            with open(path, "rb") as f:
+                page = gzip.decompress(f.read()).decode()
+            os.remove(path)
+            self.spilled -= 1
+        else:
+            self.in_memory -= 1
+            self._wake()
+        assert page is not None
+        return athlete_id, page
+
+    def ids(self) -> List[int]:
+        return [athlete_id for athlete_id, _, _ in self._pages]
+
+    def clear(self) -> None:
+        for _, _, path in self._pages:
+            if path is not None:
+                os.remove(path)
+        self._pages.clear()
+        self.in_memory = 0
+        self.spilled = 0
+        self._wake()
+
+    def close(self) -> None:
+        self.closed = True
+        self._wake()
+
+    def open(self) -> None:
+        self.closed = False
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        """
+        the pages in the queue without popping them, spilled pages are read back from disk
+        """
+        for athlete_id, page, path in list(self._pages):
+            if path is not None:
+                with open(path, "rb") as f:
+                    page = gzip.decompress(f.read()).decode()
+            assert page is not None
+            yield athlete_id, page
+
+    def _wake(self) -> None:
+        # every waiter checks for room again for itself once it's woken up
+        while self._waiters:
+            waiter = self._waiters.pop()
+            if not waiter.done():
+                waiter.set_result(None)
+
+
+class AdaptiveLimiter:
+    """
+    An additive increase, multiplicative decrease limit on the number of downloads in flight.
+    Every successful download raises the limit by 1/limit, so it grows by about one each
+    time a full window of downloads succeeds. A throttled, failed or timed out download
+    cuts it by decrease_factor, but only once per window: downloads that were started
+    before the last cut don't cut it again, since they were sent at the old rate.
+    """
+
+    def __init__(
+        self, max_limit: int, min_limit: int = 1, decrease_factor: float = 0.5
+    ):
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        self.decrease_factor = decrease_factor
+        self.limit = float(max_limit)
+        self.last_decrease = 0.0
+
+    @property
+    def concurrency(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def on_success(self) -> None:
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_throttle(self, started_at: float) -> None:
+        """
+        :param started_at: the time.monotonic() the failed download was started at
+        """
+        if started_at < self.last_decrease:
+            return
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        self.last_decrease = time.monotonic()
+
+
+class Histogram:
+    """
+    counts observations in fixed buckets, the same way a prometheus histogram does
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        # the last count is for the observations above the last bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """
+        the number of observations at or below each bucket's bound, like prometheus has them
+        """
+        bounds = [repr(bound) for bound in self.buckets] + ["+Inf"]
+        return list(zip(bounds, itertools.accumulate(self.counts)))
+
+
+class ScrapeMetrics:
+    """
+    The counters, gauges, latency histograms and stage timings of a scrape.
+    A disabled one, which is what the scraper has unless it's given one, ignores
+    everything it's sent so the instrumentation costs next to nothing.
+    The metrics can be written out as json lines or prometheus text once the scrape
+    is done, and when push_to is set they are also pushed every push_interval seconds
+    while it runs, see push.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        push_to: Optional[str] = None,
+        push_interval: float = METRICS_PUSH_INTERVAL,
+    ):
+        self.enabled = enabled
+        self.push_to = push_to
+        self.push_interval = push_interval
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.histograms: Dict[str, Histogram] = {}
+        # how long each stage of the scrape took, in the order they finished
+        self.timings: List[Dict[str, Any]] = []
+
+    def inc(self, name: str, value: int = 1) -> None:
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name: str, value: float) -> None:
+        if not self.enabled:
+            return
+        self.gauges[name] = value
+
+    def observe(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.observe(seconds)
+
+    def merge(self, other: "ScrapeMetrics", **labels: Any) -> None:
+        """
+        adds the counts and timings of another scrape's metrics to these, eg a shard's
+        the gauges are left out, they only mean something for the process they came from
+        :param labels: added to each of the other scrape's timings, eg its shard
+        """
+        for name, count in other.counters.items():
+            self.inc(name, count)
+        if not self.enabled:
+            return
+        for name, theirs in other.histograms.items():
+            histogram = self.histograms.setdefault(name, Histogram(theirs.buckets))
+            histogram.counts = [a + b for a, b in zip(histogram.counts, theirs.counts)]
+            histogram.sum += theirs.sum
+            histogram.count += theirs.count
+        self.timings += [{**timing, **labels} for timing in other.timings]
+
+    @contextlib.contextmanager
+    def time(self, stage: str, **labels: Any) -> Iterator[Dict[str, Any]]:
+        """
+        times the stage in the with block, the labels are kept with the timing and
+        can be added to inside the block, eg the number of pages the stage got through
+        """
+        if not self.enabled:
+            yield labels
+            return
+        start = time.perf_counter()
+        try:
+            yield labels
+        finally:
+            self.record(stage, time.perf_counter() - start, **labels)
+
+    def record(self, stage: str, seconds: float, **labels: Any) -> None:
+        """
+        adds the timing of a stage that was measured some other way than with time,
+        eg the stages of the pipeline that overlap each other
+        """
+        if not self.enabled:
+            return
+        self.timings.append({"stage": stage, **labels, "seconds": seconds})
+
+    def to_json_lines(self) -> str:
+        """
+        one json object for each metric, all with the time they were taken at
+        """
+        now = time.time()
+        lines: List[Dict[str, Any]] = []
+        for name, count in sorted(self.counters.items()):
+            lines.append({"type": "counter", "name": name, "value": count})
+        for name, value in sorted(self.gauges.items()):
+            lines.append({"type": "gauge", "name": name, "value": value})
+        for name, histogram in sorted(self.histograms.items()):
+            lines.append(
+                {
+                    "type": "histogram",
+                    "name": name,
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "buckets": dict(histogram.cumulative()),
+                }
+            )
+        for timing in self.timings:
+            lines.append({"type": "timing", **timing})
+        return "".join(json.dumps({"time": now, **line}) + "\n" for line in lines)
+
+    def to_prometheus(self) -> str:
+        """
+        the metrics in the prometheus text format. the timings of a stage are added
+        up for each shard, and the pages the stage got through go in a gauge of their own
+        """
+        lines = []
+        for name, count in sorted(self.counters.items()):
+            metric = f"{METRICS_PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {count}"]
+        for name, value in sorted(self.gauges.items()):
+            metric = f"{METRICS_PREFIX}_{name}"
+            lines += [f"# TYPE {metric} gauge", f"{metric} {value}"]
+        for name, histogram in sorted(self.histograms.items()):
+            metric = f"{METRICS_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} histogram")
+            for bound, count in histogram.cumulative():
+                lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+            lines += [
+                f"{metric}_sum {histogram.sum}",
+                f"{metric}_count {histogram.count}",
+            ]
+        stages: Dict[str, float] = {}
+        pages: Dict[str, int] = {}
+        for timing in self.timings:
+            labels = ",".join(
+                f'{key}="{timing[key]}"' for key in STAGE_LABELS if key in timing
+            )
+            stages[labels] = stages.get(labels, 0.0) + timing["seconds"]
+            if "pages" in timing:
+                pages[labels] = pages.get(labels, 0) + timing["pages"]
+        for name, values in (("stage_seconds", stages), ("stage_pages", pages)):
+            if not values:
+                continue
+            metric = f"{METRICS_PREFIX}_{name}"
+            lines.append(f"# TYPE {metric} gauge")
+            lines += [
+                f"{metric}{{{labels}}} {value}" for labels, value in values.items()
+            ]
+        return "".join(line + "\n" for line in lines)
+
+    def write(self, path: str) -> None:
+        """
+        writes the metrics to a local or s3 path, as prometheus text if it ends
+        in .prom and as json lines otherwise
+        """
+        text = self.to_prometheus() if path.endswith(".prom") else self.to_json_lines()
+        write_file(path, text.encode())
+
+    async def push(self, session: aiohttp.ClientSession) -> None:
+        """
+        sends the metrics to push_to. an http url is taken to be a prometheus pushgateway
+        group, eg http://pushgateway:9091/metrics/job/bjjstats_extract, and gets the
+        prometheus text, anything else is a local file the json lines are added to
+        a push that fails is only reported, it shouldn't stop the scrape
+        """
+        assert self.push_to is not None
+        if not self.push_to.startswith(("http://", "https://")):
+            with open(self.push_to, "a") as f:
+                f.write(self.to_json_lines())
+            return
+        try:
+            async with session.put(self.push_to, data=self.to_prometheus()) as response:
+                response.raise_for_status()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"could not push the metrics to {self.push_to}: {e!r}")
+
+    async def push_periodically(self, session: aiohttp.ClientSession) -> None:
+        while True:
+            await asyncio.sleep(self.push_interval)
+            await self.push(session)
+
+
+# the columns that identify a row of each table, the rest are compared to find updates
+TABLE_KEYS = {
+    "athlete": ["id"],
+    "match": ["id"],
+    "performance": ["match_id", "athlete_id"],
+}
+TABLE_TYPES: Dict[str, Type[RecordTable]] = {
+    "athlete": AthleteTable,
+    "match": MatchTable,
+    "performance": PerformanceTable,
+}
+# the snapshot folders are named after the day of the scrape
+SNAPSHOT_FOLDER = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def read_snapshot_table(directory: str, name: str) -> pd.DataFrame:
+    """
+    reads a table of a snapshot with the columns in the same types whatever version
+    of the scraper wrote it, the older snapshots have the years as strings
+    """
+    filesystem, path = resolve_directory(directory)
+    df: pd.DataFrame = pq.read_table(
+        f"{path}/{name}.parquet", filesystem=filesystem
+    ).to_pandas()
+    for field in TABLE_TYPES[name].arrow_schema:
+        if pa.types.is_integer(field.type):
+            df[field.name] = pd.to_numeric(df[field.name], errors="coerce").astype(
+                "Int64"
+            )
+        else:
+            df[field.name] = df[field.name].astype("string")
+    columns: pd.DataFrame = df[TABLE_TYPES[name].arrow_schema.names]
+    return columns
+
+
+def previous_snapshot(root: str, folder: str) -> Optional[str]:
+    """
+    the latest snapshot in root from before the snapshot in folder, if there is one
+    :param root: the directory the snapshot folders are in, eg s3://bjjstats/bjjheroes-scrape-v1
+    """
+    filesystem, path = resolve_directory(root)
+    candidates = []
+    for info in filesystem.get_file_info(pyarrow.fs.FileSelector(path)):
+        name = info.base_name
+        if (
+            info.type == pyarrow.fs.FileType.Directory
+            and SNAPSHOT_FOLDER.fullmatch(name)
+            and name < folder
+        ):
+            candidates.append(name)
+    for name in sorted(candidates, reverse=True):
+        # a folder without the match table is a scrape that didn't finish
+        info = filesystem.get_file_info(f"{path}/{name}/match.parquet")
+        if info.type == pyarrow.fs.FileType.File:
+            return f"{root.rstrip('/')}/{name}"
+    return None
+
+
+def compute_delta(
+    previous: str, current: str, destination: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    This function compares two snapshots and writes the rows of each table that were
+    inserted, updated, or deleted between them, so the loads downstream only have to
+    deal with what changed. Rows are matched up by the TABLE_KEYS, which only works
+    because the ids are stable from one scrape to the next.
+    The rows go in {destination}/{table}/inserted.parquet (and updated and deleted),
+    with the counts in {destination}/summary.json.
+    :param previous: the directory of the older snapshot, local or s3://
+    :param current: the directory of the newer snapshot, local or s3://
+    :param destination: where to write the delta, {current}/delta by default
+    :return: the summary
+    """
+    if destination is None:
+        destination = f"{current.rstrip('/')}/delta"
+    filesystem, path = resolve_directory(destination)
+    summary: Dict[str, Any] = {"previous": previous, "current": current, "tables": {}}
+    for name, table_type in TABLE_TYPES.items():
+        keys = TABLE_KEYS[name]
+        values = [
+            column for column in table_type.arrow_schema.names if column not in keys
+        ]
+        old = read_snapshot_table(previous, name)
+        new = read_snapshot_table(current, name)
+        merged = new.merge(
+            old, on=keys, how="outer", suffixes=("", "_old"), indicator=True
         )
+        both = merged[merged["_merge"] == "both"]
+        changed = pd.Series(False, index=both.index)
+        for column in values:
+            # nulls on both sides count as the same
+            old_column = both[f"{column}_old"]
+            changed |= ~(
+                (both[column] == old_column).fillna(False)
+                | (both[column].isna() & old_column.isna())
+            )
+        rows = {
+            "inserted": merged[merged["_merge"] == "left_only"][keys + values],
+            "updated": both[changed][keys + values],
+            "deleted": merged[merged["_merge"] == "right_only"][
+                keys + [f"{column}_old" for column in values]
+            ].rename(columns={f"{column}_old": column for column in values}),
+        }
+        filesystem.create_dir(f"{path}/{name}", recursive=True)
+        for change, df in rows.items():
+            pq.write_table(
+                pa.Table.from_pandas(
+                    df[table_type.arrow_schema.names],
+                    schema=table_type.arrow_schema,
+                    preserve_index=False,
+                ),
+                f"{path}/{name}/{change}.parquet",
+                filesystem=filesystem,
+            )
+        summary["tables"][name] = {
+            **{change: len(df) for change, df in rows.items()},
+            "total": len(new),
+        }
+    with filesystem.open_output_stream(f"{path}/summary.json") as f:
+        f.write(json.dumps(summary, indent=2).encode())
+    return summary
 
 
-@dataclasses.dataclass(frozen=True)
-class Match:
-    id: int
-    year: str
-    competition: str
-    method: str
-    stage: str
-    weight: str
+def shard_of(url: str, num_shards: int) -> int:
+    """
+    the shard that downloads the athlete page at this url, this has to be the same
+    in every process so it can't use python's hash
+    """
+    return int(hashlib.md5(url.encode()).hexdigest(), 16) % num_shards
 
-    def to_csv_row(self) -> str:
-        return f'{self.id},{self.year},"{self.competition}","{self.method}","{self.stage}","{self.weight}"'
 
-    def __hash__(self) -> int:
-        return hash(
-            (self.id, self.year, self.competition, self.method, self.stage, self.weight)
-        )
+class ShardCoordinator:
+    """
+    Lets the shards of a sharded crawl send each other the athletes they find that
+    belong to another shard, through files in a directory that every shard can
+    reach (a local directory, or eg an EFS mount for lambdas).
+    Each shard has an inbox-{shard}.jsonl that the others append athletes to, and a
+    state-{shard}.json with whether it is idle and how many athletes it has sent and
+    received. The crawl is done once every shard is idle and every athlete that was
+    sent has been received. The states are read twice, and have to be the same both
+    times, since a shard can change its state while the others are being read.
+    """
 
-    def __eq__(self, other: Any) -> bool:
-        if not isinstance(other, Match):
-            return False
-        return (
-            self.id == other.id
-            and self.year == other.year
-            and self.competition == other.competition
-            and self.method == other.method
-            and self.stage == other.stage
-            and self.weight == other.weight
-        )
+    def __init__(self, directory: str, num_shards: int, shard: int):
+        self.directory = directory
+        self.num_shards = num_shards
+        self.shard = shard
+        self.sent = 0
+        self.received = 0
+        os.makedirs(directory, exist_ok=True)
 
+    def inbox(self, shard: int) -> str:
+        return os.path.join(self.directory, f"inbox-{shard}.jsonl")
 
-@dataclasses.dataclass(frozen=True)
-class Performance:
-    match_id: int
-    athlete_id: int
-    result: str
+    def state(self, shard: int) -> str:
+        return os.path.join(self.directory, f"state-{shard}.json")
 
-    def to_csv_row(self) -> str:
-        return f'{self.match_id},{self.athlete_id},"{self.result}"'
+    def send(self, shard: int, athletes: List[Tuple[str, str]]) -> None:
+        """
+        :param athletes: the url and name of each athlete
+        """
+        lines = "".join(json.dumps(athlete) + "\n" for athlete in athletes)
+        with open(self.inbox(shard), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(lines)
+        self.sent += len(athletes)
 
-    def __hash__(self) -> int:
-        return hash((self.match_id, self.athlete_id, self.result))
+    def receive(self) -> List[Tuple[str, str]]:
+        try:
+            with open(self.inbox(self.shard), "r+") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                lines = f.readlines()
+                f.truncate(0)
+        except FileNotFoundError:
+            return []
+        self.received += len(lines)
+        return [tuple(json.loads(line)) for line in lines]
 
-    def __eq__(self, other: Any) -> bool:
-        if not isinstance(other, Performance):
+    def report(self, idle: bool) -> None:
+        path = self.state(self.shard)
+        with open(f"{path}.tmp", "w") as f:
+            json.dump({"idle": idle, "sent": self.sent, "received": self.received}, f)
+        os.replace(f"{path}.tmp", path)
+
+    def read_states(self) -> List[Optional[Dict[str, Any]]]:
+        states: List[Optional[Dict[str, Any]]] = []
+        for shard in range(self.num_shards):
+            try:
+                with open(self.state(shard)) as f:
+                    states.append(json.load(f))
+            except FileNotFoundError:
+                # this shard hasn't started yet
+                states.append(None)
+        return states
+
+    def finished(self) -> bool:
+        first = self.read_states()
+        if not all(state is not None and state["idle"] for state in first):
             return False
-        return (
-            self.match_id == other.match_id
-            and self.athlete_id == other.athlete_id
-            and self.result == other.result
-        )
+        sent = sum(state["sent"] for state in first if state is not None)
+        received = sum(state["received"] for state in first if state is not None)
+        return sent == received and self.read_states() == first
 
 
 class Scraper:
-    def __init__(self, num_to_scrape: Optional[int] = None):
+    def __init__(
+        self,
+        num_to_scrape: Optional[int] = None,
+        pipelined: bool = False,
+        max_concurrency: int = MAX_CONCURRENCY,
+        connection_limit: int = CONNECTION_LIMIT,
+        request_timeout: float = REQUEST_TIMEOUT,
+        page_cache: Optional[PageCache] = None,
+        parse_workers: int = 0,
+        parser_backend: str = "bs4",
+        time_remaining: Optional[Callable[[], int]] = None,
+        stop_margin_ms: int = STOP_MARGIN_MS,
+        max_retries: int = MAX_RETRIES,
+        retry_backoff: float = RETRY_BACKOFF,
+        max_queued_pages: int = SCRAPE_QUEUE_SIZE,
+        spill_dir: Optional[str] = None,
+        record_to: Optional[PageArchive] = None,
+        replay_from: Optional[PageArchive] = None,
+        parquet_output: Optional[ParquetOutput] = None,
+        shard: int = 0,
+        num_shards: int = 1,
+        coordinator: Optional[ShardCoordinator] = None,
+        id_registry: Optional[IdRegistry] = None,
+        metrics: Optional[ScrapeMetrics] = None,
+    ):
+        if parser_backend not in PARSER_BACKENDS:
+            raise ValueError(
+                f"unknown parser backend {parser_backend}, expected one of {list(PARSER_BACKENDS)}"
+            )
         self.num_to_scrape = num_to_scrape
+        self.pipelined = pipelined
+        self.max_concurrency = max_concurrency
+        self.connection_limit = connection_limit
+        self.request_timeout = request_timeout
+        # the concurrency starts at max_concurrency and backs off when the site struggles
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.page_cache = page_cache
+        # the number of processes that parse the athlete pages, 0 parses them in this process
+        self.parse_workers = parse_workers
+        self.parser_backend = parser_backend
+        # returns the milliseconds left before the scrape has to stop, eg the lambda
+        # context's get_remaining_time_in_millis
+        self.time_remaining = time_remaining
+        self.stop_margin_ms = stop_margin_ms
+        # every page that is downloaded is also written to record_to, and when there
+        # is a replay_from archive the pages are read from it instead of the site
+        self.record_to = record_to
+        self.replay_from = replay_from
+        # when given, the records are streamed into it as the pages are scraped,
+        # it still has to be closed with the tables once the scrape is done
+        self.parquet_output = parquet_output
+        # in a sharded crawl, this scraper only downloads the pages of the athletes
+        # whose urls hash to its shard, and sends the others it finds to their shards
+        # through the coordinator
+        self.shard = shard
+        self.num_shards = num_shards
+        self.coordinator = coordinator
+        self.outbox: Dict[int, List[Tuple[str, str]]] = collections.defaultdict(list)
+        # gives every athlete the same id as in the scrapes before
+        self.id_registry = id_registry if id_registry is not None else IdRegistry()
+        # nothing is measured unless the scraper is given metrics that are enabled
+        self.metrics = metrics if metrics is not None else ScrapeMetrics(enabled=False)
 
         self.download_queue: Set[Tuple[int, str]] = set()
-        self.scrape_queue: Set[Tuple[int, str]] = set()
+        # the downloaded pages waiting to be parsed, see PageQueue
+        self.scrape_queue = PageQueue(max_queued_pages, spill_dir)
         self.scrape_iteration: int = 0
 
         self.url_search: Dict[str, int] = {}
         self.name_search: Dict[str, int] = {}
 
-        self.athletes: Set[Athlete] = set()
-        self.matches: Set[Match] = set()
-        self.performances: Set[Performance] = set()
+        self.athletes = AthleteTable()
+        self.matches = MatchTable()
+        self.performances = PerformanceTable()
+        # the number of athletes that came from the a-z list, they are the first ones
+        self.num_listed = 0
+
+        # the urls that could not be downloaded after every retry, and the last error for each
+        self.failed_downloads: Dict[str, str] = {}
 
     @property
     def athlete_csv(self) -> str:
         header = "id,name,nickname,url"
-        rows = [a.to_csv_row() for a in self.athletes]
+        rows = [
+            f'{id_},"{name}","{nickname}","{url}"'
+            for id_, name, nickname, url in self.athletes.rows()
+        ]
         return "\n".join([header] + rows)
 
     @property
     def match_csv(self) -> str:
         header = "id,year,competition,method,stage,weight"
-        rows = [m.to_csv_row() for m in self.matches]
+        rows = [
+            f'{id_},{year},"{competition}","{method}","{stage}","{weight}"'
+            for id_, year, competition, method, stage, weight in self.matches.rows()
+        ]
         return "\n".join([header] + rows)
 
     @property
     def performance_csv(self) -> str:
         header = "match_id,athlete_id,result"
-        rows = [p.to_csv_row() for p in self.performances]
+        rows = [
+            f'{match_id},{athlete_id},"{result}"'
+            for match_id, athlete_id, result in self.performances.rows()
+        ]
         return "\n".join([header] + rows)
 
-    def upload_to_s3(self, s3_folder: str) -> None:
-        athlete_columns = ["id", "name", "nickname", "url"]
-        athlete_df = pd.DataFrame(
-            [[a.id, a.name, a.nickname, a.url] for a in self.athletes],
-            columns=athlete_columns,
-        )
-        match_columns = ["id", "year", "competition", "method", "stage", "weight"]
-        match_df = pd.DataFrame(
-            [
-                [m.id, m.year, m.competition, m.method, m.stage, m.weight]
-                for m in self.matches
-            ],
-            columns=match_columns,
-        )
-        performance_columns = ["match_id", "athlete_id", "result"]
-        performance_df = pd.DataFrame(
-            [[p.match_id, p.athlete_id, p.result] for p in self.performances],
-            columns=performance_columns,
-        )
-        athlete_df.to_parquet(
-            f"s3://bjjstats/bjjheroes-scrape-v1/{s3_folder}/athlete.parquet"
-        )
-        match_df.to_parquet(
-            f"s3://bjjstats/bjjheroes-scrape-v1/{s3_folder}/match.parquet"
-        )
-        performance_df.to_parquet(
-            f"s3://bjjstats/bjjheroes-scrape-v1/{s3_folder}/performance.parquet"
-        )
+    @property
+    def tables(self) -> Dict[str, RecordTable]:
+        """
+        the record tables keyed by the name of their table in the database
+        """
+        return {
+            "athlete": self.athletes,
+            "match": self.matches,
+            "performance": self.performances,
+        }
+
+    def write_parquet(
+        self, destination: str, compression: str = PARQUET_COMPRESSION
+    ) -> None:
+        """
+        writes athlete.parquet, match.parquet and performance.parquet to a local
+        directory or an s3://bucket/prefix
+        """
+        ParquetOutput(destination, compression).close(self.tables)
+
+    def upload_to_s3(
+        self, s3_folder: str, compression: str = PARQUET_COMPRESSION
+    ) -> None:
+        self.write_parquet(f"{SNAPSHOT_ROOT}/{s3_folder}", compression)
 
     def output_to_csv(self, output_dir: str) -> None:
         with open(os.path.join(output_dir, "athlete.csv"), "w") as f:
@@ -171,17 +1667,103 @@ class Scraper:
         with open(os.path.join(output_dir, "performance.csv"), "w") as f:
             f.write(self.performance_csv)
 
-    def add_athlete(self, athlete: Athlete) -> None:
+    @property
+    def finished(self) -> bool:
+        """
+        whether every athlete that was found has been scraped
+        """
+        return not self.download_queue and not self.scrape_queue
+
+    def out_of_time(self) -> bool:
+        """
+        whether the scrape should stop so that it can be checkpointed before the time runs out
+        """
+        if self.time_remaining is None:
+            return False
+        return self.time_remaining() < self.stop_margin_ms
+
+    def to_checkpoint(self) -> bytes:
+        """
+        This function serializes everything needed to carry on with the scrape into
+        gzipped json. Pages that were downloaded but not scraped yet are not included,
+        call requeue_unscraped_pages first to put them back in the download queue.
+        """
+        state = {
+            "scrape_iteration": self.scrape_iteration,
+            "num_listed": self.num_listed,
+            "download_queue": sorted(self.download_queue),
+            "athletes": list(self.athletes.rows()),
+            "matches": list(self.matches.rows()),
+            "performances": list(self.performances.rows()),
+            "url_search": self.url_search,
+            "name_search": self.name_search,
+            "failed_downloads": self.failed_downloads,
+            "id_registry": self.id_registry.ids,
+        }
+        return gzip.compress(json.dumps(state, separators=(",", ":")).encode())
+
+    def load_checkpoint(self, checkpoint: bytes) -> None:
+        """
+        This function restores the state of a scrape from the output of to_checkpoint
+        """
+        state = json.loads(gzip.decompress(checkpoint))
+        self.scrape_iteration = state["scrape_iteration"]
+        self.num_listed = state.get("num_listed", 0)
+        self.download_queue = {(id_, url) for id_, url in state["download_queue"]}
+        self.scrape_queue.clear()
+        self.athletes = AthleteTable()
+        for row in state["athletes"]:
+            self.athletes.add_row(*row)
+        self.matches = MatchTable()
+        for row in state["matches"]:
+            self.matches.add_row(*row)
+        self.performances = PerformanceTable()
+        for row in state["performances"]:
+            self.performances.add_row(*row)
+        self.url_search = state["url_search"]
+        self.name_search = state["name_search"]
+        self.failed_downloads = state["failed_downloads"]
+        self.id_registry = IdRegistry(state.get("id_registry"))
+
+    def save_checkpoint(self, path: str) -> None:
+        """
+        saves the checkpoint to a local path or an s3://bucket/key path
+        """
+        self.requeue_unscraped_pages()
+        write_file(path, self.to_checkpoint())
+
+    def resume_from_checkpoint(self, path: str) -> None:
+        self.load_checkpoint(read_file(path))
+
+    def requeue_unscraped_pages(self) -> None:
+        """
+        puts the athletes whose pages were downloaded but not scraped yet back in
+        the download queue, so that the checkpoint doesn't have to hold their html
+        """
+        urls = {id_: url for url, id_ in self.url_search.items()}
+        for i in self.scrape_queue.ids():
+            self.download_queue.add((i, urls[i]))
+        self.scrape_queue.clear()
+
+    def add_athlete(self, athlete: Athlete, share: bool = True) -> None:
         """
         This should be the only place that a url is added to the download queue
         otherwise we might end up in an infinite loop
         :param athlete:
+        :param share: in a sharded crawl, whether to send the athlete to its shard
+        if it belongs to another one
         :return:
         """
         self.athletes.add(athlete)
         if athlete.url:
             self.url_search[athlete.url] = athlete.id
-            if self.num_to_scrape is None or len(self.athletes) <= self.num_to_scrape:
+            owner = shard_of(athlete.url, self.num_shards)
+            if owner != self.shard:
+                # every shard reads the whole a-z list, so only the athletes found
+                # on the pages have to be sent to their shard
+                if share:
+                    self.outbox[owner].append((athlete.url, athlete.name))
+            elif self.num_to_scrape is None or len(self.athletes) <= self.num_to_scrape:
                 self.download_queue.add((athlete.id, athlete.url))
         else:
             self.name_search[athlete.name] = athlete.id
@@ -191,55 +1773,40 @@ class Scraper:
         This function scrapes the initial list of athletes from the bjjheroes website
         :param html: html string of the bjjheroes a-z list of athletes
         """
-        soup = bs4.BeautifulSoup(html, "html.parser")
-        table = soup.find_all("tr")
-        for rowNumber, row in enumerate(table):
-            data = row.find_all("td")
-            if data:
-                name = f"{data[0].text} {data[1].text}"
-                name = name.replace("  ", " ")
-                self.add_athlete(
-                    Athlete(
-                        id=rowNumber,
-                        name=name,
-                        nickname=data[2].text,
-                        url=f"{SOURCE_HOSTNAME}{data[0].find('a').get('href')}",
-                    )
-                )
+        for record in PARSER_BACKENDS[self.parser_backend].parse_athlete_list(html):
+            self.add_athlete(
+                Athlete(
+                    id=self.id_registry.athlete_id(
+                        url=f"{SOURCE_HOSTNAME}{record.href}"
+                    ),
+                    name=record.name,
+                    nickname=record.nickname,
+                    url=f"{SOURCE_HOSTNAME}{record.href}",
+                ),
+                share=False,
+            )
+        self.num_listed = len(self.athletes)
 
-    def scrape_athlete_page(self, athlete_id: int, html: str) -> None:
+    def add_match_records(self, athlete_id: int, records: List[MatchRecord]) -> None:
         """
-        This function scrapes the matches and performances from the athlete page
-        it also adds new athletes to the self.athlete_df attribute, some of which
-        will have urls that then need to be scraped
-        :param athlete_id: the athlete id as it was in the dataframe
-        :param html: the text html of the athlete's page
+        This function adds the matches parsed from an athlete's page to the scraper.
+        It is the only place that opponents are looked up in url_search and name_search
+        and given new ids, so it always runs in the main process even when the pages
+        are parsed in a process pool.
+        :param athlete_id: the id of the athlete whose page the records were parsed from
+        :param records: the match records returned by parse_athlete_page
         """
-        bs = bs4.BeautifulSoup(html, "html.parser")
-        table = bs.find("table", {"class": "table table-striped sort_table"})
-        if table is None:
-            # this is an athlete that has no recorded matches
-            return
-        body = table.find("tbody")
-        rows = body.find_all("tr")
-        for row in rows:
-            match_details = row.find_all("td")
-
-            match_id = match_details[0].text
-            result = match_details[2].text
-            method = match_details[3].text
-            competition = match_details[4].text
-            weight = match_details[5].text
-            stage = match_details[6].text
-            year = match_details[7].text
+        for record in records:
+            match_id = record.match_id
+            result = record.result
             self.matches.add(
                 Match(
                     id=match_id,
-                    year=year,
-                    competition=competition,
-                    method=method,
-                    stage=stage,
-                    weight=weight,
+                    year=record.year,
+                    competition=record.competition,
+                    method=record.method,
+                    stage=record.stage,
+                    weight=record.weight,
                 )
             )
             # add the performance to the performances_df
@@ -251,17 +1818,13 @@ class Scraper:
                 )
             )
             # check if the opponent has been scraped yet:
-            opponent_name_cell = match_details[1]
-            opponent_name = opponent_name_cell.find("span").text
-            if opponent_name.lower() in ["n/a", "na"]:
-                opponent_name = "Unknown"
-            opponent_url_element = opponent_name_cell.find("a")
-            if opponent_url_element is not None:
+            opponent_name = record.opponent_name
+            if record.opponent_href is not None:
                 # if there is a link, then we want to use that to find the athlete in the dataframe
-                opponent_url = f"{SOURCE_HOSTNAME}{opponent_url_element.get('href')}"
+                opponent_url = f"{SOURCE_HOSTNAME}{record.opponent_href}"
                 opponent_id = self.url_search.get(opponent_url)
                 if opponent_id is None:
-                    opponent_id = len(self.athletes) + 1
+                    opponent_id = self.id_registry.athlete_id(url=opponent_url)
                     self.add_athlete(
                         Athlete(
                             id=opponent_id,
@@ -274,7 +1837,7 @@ class Scraper:
                 opponent_id = self.name_search.get(opponent_name)
                 if opponent_id is None:
                     # we have not scraped this athlete yet
-                    opponent_id = len(self.athletes) + 1
+                    opponent_id = self.id_registry.athlete_id(name=opponent_name)
                     self.add_athlete(
                         Athlete(
                             id=opponent_id,
@@ -297,18 +1860,55 @@ class Scraper:
                         result=opponent_result,
                     )
                 )
+        self.metrics.inc("pages_scraped")
+        if self.parquet_output is not None:
+            self.parquet_output.write(self.tables)
+        if self.coordinator is not None:
+            self.send_athletes()
 
-    def clear_scrape_queue(self) -> None:
-        start_time = datetime.now()
-        while self.scrape_queue:
-            remaining = len(self.scrape_queue)
-            if remaining % 100 == 0:
-                print(
-                    f"{remaining} athletes left to scrape for scrape {self.scrape_iteration}"
+    def record_queue_depths(
+        self, download_queue: Set[Tuple[int, str]], downloading: int
+    ) -> None:
+        """
+        sets the gauges of how many pages are waiting at each stage of the scrape
+        :param download_queue: the queue being downloaded
+        :param downloading: the downloads in flight
+        """
+        metrics = self.metrics
+        if not metrics.enabled:
+            return
+        metrics.set("download_queue_depth", len(download_queue))
+        metrics.set("downloads_in_flight", downloading)
+        metrics.set("concurrency_limit", self.limiter.concurrency)
+        metrics.set("scrape_queue_in_memory", self.scrape_queue.in_memory)
+        metrics.set("scrape_queue_spilled", self.scrape_queue.spilled)
+
+    def send_athletes(self) -> None:
+        """
+        sends the athletes in the outbox to the shards they belong to
+        """
+        assert self.coordinator is not None
+        for shard, athletes in self.outbox.items():
+            if athletes:
+                self.coordinator.send(shard, athletes)
+        self.outbox.clear()
+
+    def receive_athletes(self) -> None:
+        """
+        adds the athletes that the other shards sent to this one, the ones that
+        haven't been seen yet go in the download queue
+        """
+        assert self.coordinator is not None
+        for url, name in self.coordinator.receive():
+            if url not in self.url_search:
+                self.add_athlete(
+                    Athlete(
+                        id=self.id_registry.athlete_id(url=url),
+                        name=name,
+                        nickname="",
+                        url=url,
+                    )
                 )
-                print(f"elapsed time: {datetime.now() - start_time}")
-            i, html = self.scrape_queue.pop()
-            self.scrape_athlete_page(i, html)
 
     async def add_page_to_scrape_queue(
         self,
@@ -318,75 +1918,577 @@ class Scraper:
     ) -> None:
         """
         This function downloads the html of the athlete page and adds it to the scrape queue
+        if the page is in the page cache, it is only downloaded again when it has changed.
+        Throttled, failed and timed out downloads are retried with a jittered exponential
+        backoff, and the pages that still can't be downloaded go in failed_downloads.
         """
-        async with session.get(url) as response:
+        if self.replay_from is not None:
+            replayed = self.replay_from.get(url)
+            if replayed is None:
+                self.failed_downloads[url] = "not in the archive"
+                return
+            self.metrics.inc("pages_replayed")
+            await self.scrape_queue.put(athlete_id, replayed)
+            return
+        metrics = self.metrics
+        cache = self.page_cache
+        cached = cache.get(url) if cache is not None else None
+        headers = cached.revalidation_headers() if cached is not None else {}
+        for attempt in range(self.max_retries + 1):
+            started_at = time.monotonic()
+            retry_after = None
             try:
-                page = await response.text()
-                self.scrape_queue.add((athlete_id, page))
+                async with session.get(url, headers=headers) as response:
+                    if response.status in RETRY_STATUSES:
+                        error = f"status {response.status}"
+                        retry_after = response.headers.get("Retry-After")
+                    elif (
+                        cache is not None
+                        and cached is not None
+                        and response.status == 304
+                    ):
+                        page = cached.page
+                        cache.touch(url)
+                        metrics.inc("pages_fetched")
+                        metrics.inc("pages_not_modified")
+                        break
+                    else:
+                        page = await response.text()
+                        if metrics.enabled:
+                            metrics.inc("pages_fetched")
+                            # the body that text() decoded, it's kept on the response
+                            metrics.inc("bytes_downloaded", len(await response.read()))
+                        if cache is not None and response.status == 200:
+                            cache.put(
+                                url,
+                                page,
+                                response.headers.get("ETag"),
+                                response.headers.get("Last-Modified"),
+                            )
+                        break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = repr(e)
             except Exception as e:
-                print(f"could not download page {url}")
-                print("due to the following error")
-                print(e)
+                # eg a page that can't be decoded with the charset it was sent with,
+                # which would only fail the same way again, so it isn't retried
+                self.download_failed(url, repr(e), attempt)
+                return
+            finally:
+                metrics.observe("download_seconds", time.monotonic() - started_at)
+            self.limiter.on_throttle(started_at)
+            if attempt == self.max_retries:
+                self.download_failed(url, error, attempt)
+                return
+            if self.out_of_time():
+                # the page goes in the checkpoint rather than waiting for a retry
+                self.download_queue.add((athlete_id, url))
+                return
+            metrics.inc("download_retries")
+            await asyncio.sleep(self.retry_delay(attempt, retry_after))
+        self.limiter.on_success()
+        self.failed_downloads.pop(url, None)
+        if self.record_to is not None:
+            self.record_to.put(url, page)
+        # this waits while the scrape queue is full, and run_pipeline doesn't start
+        # another download until this one is done, so the downloads wait for the parsing
+        await self.scrape_queue.put(athlete_id, page)
+
+    def download_failed(self, url: str, error: str, attempt: int) -> None:
+        """
+        reports a page that couldn't be downloaded and keeps it in failed_downloads,
+        the rest of the crawl carries on without it
+        """
+        print(f"could not download page {url} after {attempt + 1} attempts")
+        print("due to the following error")
+        print(error)
+        self.failed_downloads[url] = error
+        self.metrics.inc("download_failures")
+
+    def retry_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        """
+        the seconds to wait before retrying a download, this is the exponential backoff
+        with full jitter so that the retries of a burst of failures are spread out,
+        unless the site asked for a specific delay with a Retry-After header
+        """
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), MAX_RETRY_BACKOFF)
+        backoff = min(self.retry_backoff * 2**attempt, MAX_RETRY_BACKOFF)
+        return random.uniform(0, 2 * backoff)
 
-    async def clear_download_queue(
+    def failure_report(self) -> Dict[str, Any]:
+        return {
+            "failed_downloads": len(self.failed_downloads),
+            "concurrency": self.limiter.concurrency,
+            "failures": dict(sorted(self.failed_downloads.items())),
+        }
+
+    def create_session(self) -> aiohttp.ClientSession:
+        """
+        This function creates the session that is shared by every download in a crawl,
+        so that keep-alive connections are reused instead of reconnecting for each batch.
+        The timeout applies to each request on its own, so one slow page cannot stall the rest.
+        """
+        connector = aiohttp.TCPConnector(limit=self.connection_limit)
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def run_pipeline(
         self,
+        session: aiohttp.ClientSession,
+        pool: Optional[Executor] = None,
+        download_queue: Optional[Set[Tuple[int, str]]] = None,
     ) -> None:
         """
-        This function uses asyncio to scrape the athlete pages in parallel.
-        When called, it downloads the html from all the athlete pages in the download_queue
-        and adds the html to the scrape_queue.
-        """
-        # We split the scraping into chunks of 100 to avoid a timeout error from asyncio
-        step = 0
-        total_steps = len(self.download_queue) // 100
-        while self.download_queue:
-            step_start_time = datetime.now()
-            async with aiohttp.ClientSession() as session:
-                tasks = []
-                for i in range(100):
-                    if not self.download_queue:
-                        break
-                    id_, url = self.download_queue.pop()
-                    tasks.append(self.add_page_to_scrape_queue(session, id_, url))
-                await asyncio.gather(*tasks)
+        This function downloads and scrapes the athlete pages as one continuous pipeline.
+        Each page is parsed as soon as it arrives while the event loop keeps downloading,
+        and the opponents found on a page go straight back into the download queue
+        instead of waiting for the next scrape iteration.
+        When the scrape queue is full, the downloads wait for the parsing to catch up,
+        so only so many pages are ever held in memory.
+        :param pool: when given, up to parse_workers pages are parsed at once in this pool,
+        otherwise pages are parsed one at a time in a worker thread
+        :param download_queue: the athletes to download, when given only these are downloaded
+        and the opponents found are left in the scraper's download queue for the next iteration
+        """
+        if download_queue is None:
+            download_queue = self.download_queue
+        self.scrape_queue.open()
+        loop = asyncio.get_running_loop()
+        downloads: Set[asyncio.Future[Any]] = set()
+        # the pages being parsed and their athlete ids, in the order they were sent to
+        # be parsed. their records are added in that order whatever order the pool
+        # finishes them in, so the opponents get the same ids as a serial parse gives
+        parsing: Deque[Tuple[asyncio.Future[Any], int]] = collections.deque()
+        start_time = datetime.now()
+        scraped = 0
+        downloaded = 0
+        # how long there were downloads and parses in flight, the two overlap
+        busy = {"download": 0.0, "parse": 0.0}
+        with ThreadPoolExecutor(max_workers=1) as thread:
+            parser = pool if pool is not None else thread
+            max_parsing = self.parse_workers if pool is not None else 1
+            while True:
+                # once the time is up, the downloads and parses in flight are
+                # finished off but nothing new is started
+                stopping = self.out_of_time()
+                if stopping:
+                    # the downloads waiting for room in the scrape queue would wait
+                    # forever now that nothing more is parsed
+                    self.scrape_queue.close()
+                while (
+                    not stopping
+                    and download_queue
+                    and len(downloads) < self.limiter.concurrency
+                ):
+                    id_, url = download_queue.pop()
+                    downloads.add(
+                        asyncio.ensure_future(
+                            self.add_page_to_scrape_queue(session, id_, url)
+                        )
+                    )
+                while not stopping and self.scrape_queue and len(parsing) < max_parsing:
+                    i, html = self.scrape_queue.pop()
+                    parse = loop.run_in_executor(
+                        parser, parse_athlete_page, html, self.parser_backend
+                    )
+                    parse.add_done_callback(
+                        functools.partial(self.parsed, started_at=time.perf_counter())
+                    )
+                    parsing.append((parse, i))
+                self.record_queue_depths(download_queue, len(downloads))
+                # only the first page sent to be parsed can have its records added,
+                # the ones after it that finish first wait for it
+                pending = downloads | {parsing[0][0]} if parsing else set(downloads)
+                if not pending:
+                    break
+                waited_at = time.perf_counter()
+                stages = {"download": bool(downloads), "parse": bool(parsing)}
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done & downloads:
+                    downloads.discard(future)
+                    future.result()
+                    downloaded += 1
+                while parsing and parsing[0][0].done():
+                    # the records are added on the event loop's thread, so the
+                    # download queue is never touched from two threads at once
+                    parse, i = parsing.popleft()
+                    self.add_match_records(i, parse.result())
+                    scraped += 1
+                    if scraped % 100 == 0:
+                        print(
+                            f"scraped {scraped} athletes, {len(download_queue) + len(downloads)} left to download"
+                        )
+                        print(f"elapsed time: {datetime.now() - start_time}")
+                # this includes adding the records, which is part of the parsing
+                waited = time.perf_counter() - waited_at
+                for stage, in_flight in stages.items():
+                    if in_flight:
+                        busy[stage] += waited
+        self.metrics.record("download", busy["download"], pages=downloaded)
+        self.metrics.record("parse", busy["parse"], pages=scraped)
+
+    def parsed(self, parse: "asyncio.Future[Any]", started_at: float) -> None:
+        """
+        observes how long a page took to parse as soon as it's done, its records can
+        wait longer than that to be added
+        """
+        self.metrics.observe("parse_seconds", time.perf_counter() - started_at)
+
+    def create_parse_pool(self) -> Optional[Executor]:
+        """
+        This function creates the process pool that parses the athlete pages, if
+        parse_workers is set. Workers are spawned rather than forked because the
+        pool is started from inside the running event loop.
+        Note that this doesn't work on lambda, which has no /dev/shm for the pool's queues.
+        """
+        if not self.parse_workers:
+            return None
+        return ProcessPoolExecutor(
+            max_workers=self.parse_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    async def crawl(self) -> None:
+        """
+        This function scrapes every athlete in the download queue, and every athlete
+        found along the way, over a single pooled session.
+        If the metrics have somewhere to be pushed to, they are pushed every
+        push_interval seconds while it runs and once more at the end.
+        """
+        pool = self.create_parse_pool()
+        metrics = self.metrics
+        try:
+            async with self.create_session() as session:
+                pusher = (
+                    asyncio.create_task(metrics.push_periodically(session))
+                    if metrics.enabled and metrics.push_to is not None
+                    else None
+                )
+                try:
+                    await self.crawl_iterations(session, pool)
+                finally:
+                    if pusher is not None:
+                        pusher.cancel()
+                        await metrics.push(session)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    async def crawl_iterations(
+        self, session: aiohttp.ClientSession, pool: Optional[Executor] = None
+    ) -> None:
+        """
+        This function is the crawl itself, in shards, one pipeline or batch iterations.
+        """
+        metrics = self.metrics
+        if self.coordinator is not None:
+            await self.crawl_shard(session, pool)
+        elif self.pipelined:
+            print(
+                f"found {len(self.download_queue)} athletes to scrape, starting pipelined scrape"
+            )
+            with metrics.time("pipeline", pages=len(self.download_queue)):
+                await self.run_pipeline(session, pool)
+        while self.download_queue and not self.out_of_time():
             print(
-                f"scrape {self.scrape_iteration}, download step {step}/{total_steps} took {datetime.now() - step_start_time}"
+                f"found {len(self.download_queue)} athletes to scrape, starting scrape {self.scrape_iteration}"
             )
-            step += 1
+            # the pages of this iteration are parsed while they download, but the
+            # opponents found on them wait in the download queue for the next one
+            download_queue, self.download_queue = self.download_queue, set()
+            try:
+                with metrics.time(
+                    "iteration",
+                    iteration=self.scrape_iteration,
+                    pages=len(download_queue),
+                ):
+                    await self.run_pipeline(session, pool, download_queue)
+            finally:
+                self.download_queue |= download_queue
+            print(f"finished scrape {self.scrape_iteration}")
+            self.scrape_iteration += 1
+
+    async def crawl_shard(
+        self, session: aiohttp.ClientSession, pool: Optional[Executor] = None
+    ) -> None:
+        """
+        This function crawls this scraper's shard. It scrapes its athletes with the
+        pipeline, then waits for the other shards to send it more, until the
+        coordinator says that every shard is done.
+        """
+        assert self.coordinator is not None
+        while not self.out_of_time():
+            self.receive_athletes()
+            if self.download_queue:
+                self.coordinator.report(idle=False)
+                print(
+                    f"shard {self.shard} found {len(self.download_queue)} athletes to scrape"
+                )
+                with self.metrics.time("pipeline", shard=self.shard):
+                    await self.run_pipeline(session, pool)
+                continue
+            self.coordinator.report(idle=True)
+            if self.coordinator.finished():
+                break
+            await asyncio.sleep(SHARD_POLL_INTERVAL)
 
     def scrape(
         self,
     ) -> None:
-        start_time = datetime.now()
-        res = requests.get(f"{SOURCE_HOSTNAME}/a-z-bjj-fighters-list")
-        self.get_initial_athlete_list(res.text)
+        url = f"{SOURCE_HOSTNAME}/a-z-bjj-fighters-list"
+        with self.metrics.time("athlete_list"):
+            if self.replay_from is not None:
+                html = self.replay_from.get(url)
+                if html is None:
+                    raise ValueError(
+                        f"{url} is not in the archive {self.replay_from.path}"
+                    )
+            else:
+                html = requests.get(url).text
+        if self.record_to is not None:
+            self.record_to.put(url, html)
+        self.get_initial_athlete_list(html)
         self.scrape_iteration = 0
-        while self.download_queue:
+        self.continue_scrape()
+
+    def continue_scrape(self) -> None:
+        """
+        This function scrapes the athletes in the download queue until there are none
+        left or the time runs out, it is used directly to carry on from a checkpoint
+        """
+        start_time = datetime.now()
+        with self.metrics.time("crawl"):
+            asyncio.run(self.crawl())
+        if not self.finished:
             print(
-                f"found {len(self.download_queue)} athletes to scrape, starting scrape {self.scrape_iteration}"
+                f"stopping with {len(self.download_queue) + len(self.scrape_queue)} athletes left to scrape"
             )
-            asyncio.run(self.clear_download_queue())
-            self.clear_scrape_queue()
-            print(f"finished scrape {self.scrape_iteration}")
-            self.scrape_iteration += 1
+        if self.failed_downloads:
+            print(f"failed to download {len(self.failed_downloads)} pages:")
+            for url, error in sorted(self.failed_downloads.items()):
+                print(f"{url}: {error}")
         print(f"total time: {datetime.now() - start_time}")
 
 
+def merge_shards(
+    checkpoints: List[bytes], id_registry: Optional[IdRegistry] = None
+) -> Scraper:
+    """
+    This function merges the checkpoints of the shards of a sharded crawl, in order
+    of their shard, into one scraper with the same records as a single crawl.
+    Each shard gave the athletes it found new ids of its own, so the athletes are
+    matched up by url, or by name for the ones without a page, the same way a single
+    crawl dedupes them, and then given their ids from the id_registry the shards started
+    with. The new athletes are registered in the order of the a-z list and then of their
+    urls and names, so the ids don't depend on which shard found an athlete first.
+    An athlete's record comes from the shard that owns its url when that shard has it.
+    """
+    shards = []
+    for checkpoint in checkpoints:
+        shard = Scraper()
+        shard.load_checkpoint(checkpoint)
+        shards.append(shard)
+    num_shards = len(shards)
+    merged = Scraper()
+
+    def key(athlete: Athlete) -> Tuple[str, str]:
+        return ("url", athlete.url) if athlete.url else ("name", athlete.name)
+
+    records: Dict[Tuple[str, str], Athlete] = {}
+    for i, shard in enumerate(shards):
+        for athlete in shard.athletes:
+            athlete_key = key(athlete)
+            owned = bool(athlete.url) and shard_of(athlete.url, num_shards) == i
+            if athlete_key not in records or owned:
+                records[athlete_key] = athlete
+    listed = [
+        key(athlete)
+        for athlete in itertools.islice(shards[0].athletes, shards[0].num_listed)
+    ]
+    merged.num_listed = len(listed)
+    merged.id_registry = id_registry if id_registry is not None else IdRegistry()
+    ids = {}
+    for athlete_key in listed + sorted(records.keys() - set(listed)):
+        kind, value = athlete_key
+        ids[athlete_key] = (
+            merged.id_registry.athlete_id(url=value)
+            if kind == "url"
+            else merged.id_registry.athlete_id(name=value)
+        )
+    for athlete_key, athlete in sorted(records.items(), key=lambda item: ids[item[0]]):
+        merged.athletes.add(dataclasses.replace(athlete, id=ids[athlete_key]))
+        if athlete.url:
+            merged.url_search[athlete.url] = ids[athlete_key]
+        else:
+            merged.name_search[athlete.name] = ids[athlete_key]
+
+    for shard in shards:
+        global_ids = {athlete.id: ids[key(athlete)] for athlete in shard.athletes}
+        for match in shard.matches:
+            merged.matches.add(match)
+        for match_id, athlete_id, result in shard.performances.rows():
+            merged.performances.add_row(match_id, global_ids[athlete_id], result)
+        merged.failed_downloads.update(shard.failed_downloads)
+        merged.download_queue |= {
+            (ids[key(athlete)], athlete.url)
+            for athlete in shard.athletes
+            if (athlete.id, athlete.url) in shard.download_queue
+        }
+    return merged
+
+
+def run_shard(
+    directory: str,
+    shard: int,
+    num_shards: int,
+    options: Dict[str, Any],
+    source_hostname: str = SOURCE_HOSTNAME,
+) -> Tuple[str, ScrapeMetrics]:
+    """
+    This function crawls one shard and saves its checkpoint in the directory
+    :param options: the keyword arguments for the shard's Scraper
+    :param source_hostname: the site to crawl, this runs in a spawned process
+    that wouldn't see a SOURCE_HOSTNAME that was changed in the parent
+    :return: the path of the checkpoint and the shard's metrics
+    """
+    global SOURCE_HOSTNAME
+    SOURCE_HOSTNAME = source_hostname
+    metrics = options.get("metrics")
+    if metrics is not None and (metrics.push_to or "").startswith("http"):
+        # each shard pushes to a pushgateway group of its own, instead of overwriting
+        # the others' metrics
+        metrics.push_to = f"{metrics.push_to}/shard/{shard}"
+    scraper = Scraper(
+        shard=shard,
+        num_shards=num_shards,
+        coordinator=ShardCoordinator(directory, num_shards, shard),
+        **options,
+    )
+    scraper.scrape()
+    path = os.path.join(directory, f"shard-{shard}.json.gz")
+    scraper.save_checkpoint(path)
+    return path, scraper.metrics
+
+
+def scrape_sharded(
+    num_shards: int, directory: Optional[str] = None, **options: Any
+) -> Scraper:
+    """
+    This function crawls the site with num_shards local processes and merges the shards
+    :param directory: where the shards exchange athletes and save their checkpoints,
+    a new temporary directory by default
+    :param options: the keyword arguments for each shard's Scraper, the metrics
+    of the shards are added up in the metrics given here, if any
+    """
+    if directory is None:
+        directory = tempfile.mkdtemp(prefix="bjjstats-shards-")
+    with ProcessPoolExecutor(
+        max_workers=num_shards, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        shards = list(
+            pool.map(
+                run_shard,
+                [directory] * num_shards,
+                range(num_shards),
+                [num_shards] * num_shards,
+                [options] * num_shards,
+                [SOURCE_HOSTNAME] * num_shards,
+            )
+        )
+    scraper = merge_shards(
+        [read_file(path) for path, _ in shards], options.get("id_registry")
+    )
+    metrics = options.get("metrics")
+    if metrics is not None:
+        for shard, (_, shard_metrics) in enumerate(shards):
+            metrics.merge(shard_metrics, shard=shard)
+        scraper.metrics = metrics
+    return scraper
+
+
 def lambda_handler(event: ALBEvent, context: LambdaContext) -> dict[str, Any]:
     """
     returns s3 folder name that the data was uploaded to
+    if the scrape could not finish before the lambda times out, it returns the path
+    of a checkpoint instead, the step function should call the lambda again with
+    the same event plus the checkpoint until the checkpoint comes back as None
+    with "metrics" set in the event, the metrics of each invocation are written to
+    the s3 folder and their path is returned, "metrics_push" is a pushgateway url
+    to push them to while the scrape runs
     """
     num_to_scrape = event.get("num_to_scrape")
-    scraper = Scraper(num_to_scrape)
-    scraper.scrape()
+    # the cache only pays off when cache_dir is on storage that outlives the
+    # invocation, eg an EFS mount
+    cache_dir = event.get("cache_dir")
+    scraper = Scraper(
+        num_to_scrape,
+        pipelined=bool(event.get("pipelined")),
+        page_cache=PageCache(cache_dir) if cache_dir else None,
+        parser_backend=event.get("parser") or "bs4",
+        time_remaining=context.get_remaining_time_in_millis,
+        # eg /tmp, so that the downloads don't have to wait for the parsing
+        spill_dir=event.get("spill_dir"),
+        metrics=(
+            ScrapeMetrics(push_to=event.get("metrics_push"))
+            if event.get("metrics")
+            else None
+        ),
+    )
     s3_folder = event.get("s3_folder")
     if s3_folder is None:
         s3_folder = datetime.now().strftime("%Y-%m-%d")
-    scraper.upload_to_s3(s3_folder)
+    metrics_path = None
+    if scraper.metrics.enabled:
+        started = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
+        metrics_path = f"{SNAPSHOT_ROOT}/{s3_folder}/metrics/{started}.jsonl"
+    id_registry_path = event.get("id_registry") or ID_REGISTRY_PATH
+    checkpoint = event.get("checkpoint")
+    if checkpoint:
+        # the registry carries on from the checkpoint
+        scraper.resume_from_checkpoint(checkpoint)
+        scraper.continue_scrape()
+    else:
+        scraper.id_registry = IdRegistry.load(id_registry_path)
+        scraper.scrape()
+    if not scraper.finished:
+        checkpoint = f"{SNAPSHOT_ROOT}/{s3_folder}/checkpoint.json.gz"
+        scraper.save_checkpoint(checkpoint)
+        if metrics_path is not None:
+            scraper.metrics.write(metrics_path)
+        return {
+            "statusCode": 202,
+            "body": "scrape checkpointed",
+            "s3_folder": s3_folder,
+            "checkpoint": checkpoint,
+            "metrics": metrics_path,
+        }
+    # the records are only written once the scrape is done, streaming them during an
+    # invocation that ends up checkpointing would leave half written files behind
+    scraper.upload_to_s3(s3_folder, event.get("compression") or PARQUET_COMPRESSION)
+    # a copy of the registry goes with the snapshot it was used for
+    scraper.id_registry.save(f"{SNAPSHOT_ROOT}/{s3_folder}/id_registry.json")
+    scraper.id_registry.save(id_registry_path)
+    # the changes since the last snapshot go in {s3_folder}/delta
+    previous = (
+        f"{SNAPSHOT_ROOT}/{event['previous_s3_folder']}"
+        if event.get("previous_s3_folder")
+        else previous_snapshot(SNAPSHOT_ROOT, s3_folder)
+    )
+    delta = (
+        compute_delta(previous, f"{SNAPSHOT_ROOT}/{s3_folder}") if previous else None
+    )
+    if metrics_path is not None:
+        scraper.metrics.write(metrics_path)
     return {
         "statusCode": 200,
         "body": "upload complete",
         "s3_folder": s3_folder,
+        "checkpoint": None,
+        "failure_report": scraper.failure_report(),
+        "delta": delta,
+        "metrics": metrics_path,
     }
 
 
@@ -411,10 +2513,150 @@ if __name__ == "__main__":
         default=None,
         help="the number of athletes to scrape",
     )
+    parser.add_argument(
+        "--pipelined",
+        action="store_true",
+        help="scrape each page as soon as it is downloaded instead of in batches",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=str,
+        help="a directory to cache the athlete pages in between runs",
+    )
+    parser.add_argument(
+        "--parse-workers",
+        type=int,
+        default=0,
+        help="the number of processes to parse the athlete pages with",
+    )
+    parser.add_argument(
+        "--parser",
+        type=str,
+        default="bs4",
+        choices=list(PARSER_BACKENDS),
+        help="the html parser to scrape the pages with",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=SCRAPE_QUEUE_SIZE,
+        help="the number of downloaded pages to hold in memory waiting to be parsed",
+    )
+    parser.add_argument(
+        "--spill-dir",
+        type=str,
+        help="a directory to spill downloaded pages to when the queue is full",
+    )
+    parser.add_argument(
+        "--record",
+        type=str,
+        help="a zip file to record every downloaded page to",
+    )
+    parser.add_argument(
+        "--replay",
+        type=str,
+        help="a zip file recorded with --record to read the pages from instead of the site",
+    )
+    parser.add_argument(
+        "--parquet",
+        type=str,
+        help="a directory to stream the records to as parquet files while scraping",
+    )
+    parser.add_argument(
+        "--compression",
+        type=str,
+        default=PARQUET_COMPRESSION,
+        help="the compression of the parquet files, eg zstd, snappy, gzip or none",
+    )
+    parser.add_argument(
+        "--id-registry",
+        type=str,
+        help="a json file of the ids given to athletes in earlier scrapes, it is updated with the new ones",
+    )
+    parser.add_argument(
+        "--previous",
+        type=str,
+        help="an earlier snapshot to write the changes in the --parquet output against, to a delta folder in it",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="the number of processes to split the crawl between",
+    )
+    parser.add_argument(
+        "--metrics",
+        type=str,
+        help="a file to write the scrape's metrics to, as prometheus text if it ends in .prom and json lines otherwise",
+    )
+    parser.add_argument(
+        "--metrics-push",
+        type=str,
+        help="a pushgateway url or a json lines file to push the metrics to while scraping",
+    )
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=METRICS_PUSH_INTERVAL,
+        help="the seconds between pushes of the metrics",
+    )
     args = parser.parse_args()
-    scraper = Scraper(args.num_to_scrape)
-    scraper.scrape()
+    if args.shards > 1 and (args.record or args.replay):
+        # an archive is one zip file, the shards can't all write to it or share it
+        parser.error("--record and --replay can't be used with --shards")
+    record_to = PageArchive(args.record, "w") if args.record else None
+    replay_from = PageArchive(args.replay) if args.replay else None
+    scraper = Scraper(
+        args.num_to_scrape,
+        pipelined=args.pipelined,
+        page_cache=PageCache(args.cache_dir) if args.cache_dir else None,
+        parse_workers=args.parse_workers,
+        parser_backend=args.parser,
+        max_queued_pages=args.queue_size,
+        spill_dir=args.spill_dir,
+        record_to=record_to,
+        replay_from=replay_from,
+        parquet_output=(
+            ParquetOutput(args.parquet, args.compression) if args.parquet else None
+        ),
+        id_registry=IdRegistry.load(args.id_registry) if args.id_registry else None,
+        metrics=ScrapeMetrics(
+            enabled=bool(args.metrics or args.metrics_push),
+            push_to=args.metrics_push,
+            push_interval=args.metrics_interval,
+        ),
+    )
+    try:
+        if args.shards > 1:
+            # the shards are merged at the end, so the parquet files are only written then
+            parquet_output = scraper.parquet_output
+            scraper = scrape_sharded(
+                args.shards,
+                pipelined=args.pipelined,
+                page_cache=scraper.page_cache,
+                parse_workers=args.parse_workers,
+                parser_backend=args.parser,
+                max_queued_pages=args.queue_size,
+                spill_dir=args.spill_dir,
+                id_registry=scraper.id_registry,
+                metrics=scraper.metrics,
+            )
+            scraper.parquet_output = parquet_output
+        else:
+            scraper.scrape()
+    finally:
+        for archive in (record_to, replay_from):
+            if archive is not None:
+                archive.close()
+    if scraper.parquet_output is not None:
+        scraper.parquet_output.close(scraper.tables)
+        if args.previous:
+            print(json.dumps(compute_delta(args.previous, args.parquet)["tables"]))
+    if args.id_registry:
+        scraper.id_registry.save(args.id_registry)
     if args.s3:
-        scraper.upload_to_s3(args.s3)
+        scraper.upload_to_s3(args.s3, args.compression)
     if args.output:
         scraper.output_to_csv(args.output)
+    if args.metrics:
+        scraper.metrics.write(args.metrics)
@@ -3,40 +3,862 @@ this script takes defines a function that takes in 3 dataframes
 and loads them into the database. The dataframes are the athlete,
 performance, and match tables.
 here's how you would invoke it from the command line
-DB_URL=[SECRET] python load.py directory_with_csv_files
+DB_URL=[SECRET] python load.py directory_with_parquet_or_csv_files
 or to load from s3 you would use the --s3 argument:
 DB_URL=[SECRET] python load.py --s3 name_of_s3_folder
 """
 
-from typing import Dict, Any
+from typing import Dict, Any, Iterable, Iterator, List, Mapping, Optional, Tuple, Union
 
 import pandas as pd
 import sqlalchemy as sa
 import os
+import re
 import argparse
+import itertools
+import resource
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
+import pyarrow as pa  # type: ignore
+import pyarrow.compute as pc  # type: ignore
+import pyarrow.csv  # type: ignore
+import pyarrow.fs  # type: ignore
+import pyarrow.parquet as pq  # type: ignore
 from aws_lambda_powertools.utilities.data_classes import ALBEvent
 from aws_lambda_powertools.utilities.typing import LambdaContext
-import awswrangler as wr
 
-CHUNKSIZE = 1000
+# the rows read from the source and sent to the database at a time
+CHUNKSIZE = 10_000
+# the columns that identify a row of each table, the tables are loaded in this order
+TABLE_KEYS = {
+    "match": ["id"],
+    "athlete": ["id"],
+    "performance": ["match_id", "athlete_id"],
+}
+# the aggregates of the tables for the dashboards, see refresh_stats
+STATS_TABLES = ["athlete_stats", "athlete_method_stats"]
+# the tables the swap load replaces with shadow tables
+SWAPPED_TABLES = [*TABLE_KEYS, *STATS_TABLES]
+# how a load can replace what is in the database, see upload_data
+LOAD_MODES = ["replace", "incremental", "swap", "parallel"]
+# the connections the parallel load loads the performances over at once
+LOAD_WORKERS = 4
+# the shadow tables are loaded under the tables' names with this on the end
+SHADOW_SUFFIX = "_shadow"
+# how long the swap waits for the dashboards' queries to let go of the tables
+SWAP_LOCK_TIMEOUT = "10s"
+# where the extract uploads the snapshots
+SNAPSHOT_ROOT = "s3://bjjstats/bjjheroes-scrape-v1"
+
+# a chunk of a table's rows, either a dataframe or an arrow record batch
+Chunk = Union[pd.DataFrame, pa.RecordBatch]
+# a table's rows, either all at once or as chunks of them from one of the read_*
+# functions, so that only a chunk of the table is in memory at a time
+TableData = Union[pd.DataFrame, pa.Table, Iterable[Chunk]]
+
+
+class SharedChunks:
+    """
+    an iterator over chunks that several threads can take chunks from at once,
+    each chunk goes to whichever thread asks for one next
+    """
+
+    def __init__(self, chunks: Iterator[Chunk]):
+        self.chunks = chunks
+        self.lock = threading.Lock()
+
+    def __iter__(self) -> "SharedChunks":
+        return self
+
+    def __next__(self) -> Chunk:
+        with self.lock:
+            return next(self.chunks)
+
+
+class ChunkReader:
+    """
+    a file-like object over an iterator of bytes, psycopg2's copy_expert reads the
+    rows to COPY from one of these so that only a chunk of them is in memory at once
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self.chunks = chunks
+        self.buffer = bytearray()
+        # how far into the buffer has been read
+        self.offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self.buffer) - self.offset < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            # what was already read is only dropped when a chunk comes in, so each
+            # byte is copied a fixed number of times however small the reads are
+            del self.buffer[: self.offset]
+            self.offset = 0
+            self.buffer += chunk
+        end = (
+            len(self.buffer) if size < 0 else min(self.offset + size, len(self.buffer))
+        )
+        data = bytes(self.buffer[self.offset : end])
+        self.offset = end
+        return data
+
+
+def prepare_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    the float columns that only hold whole numbers, eg years read from a csv with
+    missing values, are made integers again so that they can go in integer columns
+    """
+    for column in df.columns:
+        values = df[column]
+        if values.dtype.kind == "f" and (values.dropna() % 1 == 0).all():
+            df = df.assign(**{column: values.astype("Int64")})
+    return df
+
+
+def prepare_batch(batch: pa.RecordBatch) -> pa.RecordBatch:
+    """
+    prepare_frame for arrow, the float columns that only hold whole numbers are
+    made integers
+    """
+    columns = list(batch.columns)
+    for i, column in enumerate(columns):
+        if pa.types.is_floating(column.type):
+            # the nulls are skipped, and a column of them is left as it is
+            if pc.all(pc.equal(pc.floor(column), column)).as_py():
+                columns[i] = pc.cast(column, pa.int64())
+    return type(batch).from_arrays(columns, names=batch.schema.names)
+
+
+def chunk_columns(chunk: Chunk) -> List[str]:
+    if isinstance(chunk, pd.DataFrame):
+        return list(chunk.columns)
+    return list(chunk.schema.names)
+
+
+def as_chunks(data: TableData, chunksize: int = CHUNKSIZE) -> Iterator[Chunk]:
+    """
+    the rows of a table chunksize rows at a time, ready to go in the database.
+    arrow data stays in arrow, the slices of it share its buffers
+    """
+    frames: Iterable[Chunk] = (
+        [data] if isinstance(data, (pd.DataFrame, pa.Table)) else data
+    )
+    for df in frames:
+        for start in range(0, len(df), chunksize):
+            if isinstance(df, pd.DataFrame):
+                yield prepare_frame(df.iloc[start : start + chunksize])
+            else:
+                yield prepare_batch(df.slice(start, chunksize))
+
+
+def csv_chunks(chunks: Iterable[Chunk]) -> Iterator[bytes]:
+    """
+    each chunk of a table as csv, with the nulls written so that they can be told
+    apart from empty strings. pandas writes them as \\N, and arrow writes them
+    as nothing and quotes the empty strings, see copy_null
+    """
+    for chunk in chunks:
+        if isinstance(chunk, pd.DataFrame):
+            yield chunk.to_csv(header=False, index=False, na_rep="\\N").encode()
+        else:
+            buffer = pa.BufferOutputStream()
+            pyarrow.csv.write_csv(
+                chunk, buffer, pyarrow.csv.WriteOptions(include_header=False)
+            )
+            yield buffer.getvalue().to_pybytes()
+
+
+def copy_null(chunk: Chunk) -> str:
+    """
+    how csv_chunks writes the nulls of the chunk
+    """
+    return "\\N" if isinstance(chunk, pd.DataFrame) else ""
+
+
+def copy_rows(
+    con: sa.engine.Connection,
+    table: str,
+    columns: List[str],
+    chunks: Iterable[Chunk],
+    null: str = "\\N",
+) -> None:
+    """
+    This function streams the chunks into a postgres table with COPY FROM STDIN.
+    It works with both psycopg2 and psycopg 3.
+    :param null: how the nulls are written in the chunks' csv, see copy_null
+    """
+    statement = (
+        f"COPY {table} ({', '.join(columns)})"
+        f" FROM STDIN WITH (FORMAT csv, NULL '{null}')"
+    )
+    cursor = con.connection.cursor()
+    data = csv_chunks(chunks)
+    try:
+        if hasattr(cursor, "copy_expert"):
+            cursor.copy_expert(statement, ChunkReader(data))
+        else:
+            with cursor.copy(statement) as copy:
+                for chunk in data:
+                    copy.write(chunk)
+    finally:
+        cursor.close()
+
+
+def frame_rows(chunk: Chunk) -> List[Tuple[Any, ...]]:
+    """
+    the rows of the chunk as tuples of python values, with None for the nulls
+    """
+    if isinstance(chunk, pd.DataFrame):
+        values = chunk.astype(object)
+        return list(
+            values.where(values.notna(), None).itertuples(index=False, name=None)
+        )
+    # a column at a time, straight from arrow's buffers
+    return list(zip(*(column.to_pylist() for column in chunk.columns)))
+
+
+def insert_rows(
+    con: sa.engine.Connection,
+    table: str,
+    columns: List[str],
+    chunks: Iterable[Chunk],
+) -> None:
+    """
+    This function inserts the chunks into the table with executemany, a chunk at a
+    time, it's how the rows are loaded into databases without COPY eg sqlite
+    """
+    placeholders = ", ".join(
+        "?" if con.dialect.paramstyle == "qmark" else "%s" for _ in columns
+    )
+    statement = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    for chunk in chunks:
+        con.exec_driver_sql(statement, frame_rows(chunk))
+
+
+def bulk_load(
+    con: sa.engine.Connection,
+    table: str,
+    data: TableData,
+    chunksize: int = CHUNKSIZE,
+) -> List[str]:
+    """
+    loads the rows into the table with COPY on postgres and executemany otherwise,
+    only chunksize rows of them are in memory at once if they come in chunks
+    :return: the columns that were loaded, none if there weren't any rows
+    """
+    chunks = as_chunks(data, chunksize)
+    first = next(chunks, None)
+    if first is None:
+        return []
+    columns = chunk_columns(first)
+    chunks = itertools.chain([first], chunks)
+    if "postgres" in con.engine.url.drivername:
+        copy_rows(con, table, columns, chunks, copy_null(first))
+    else:
+        insert_rows(con, table, columns, chunks)
+    return columns
+
+
+def secondary_indexes(
+    con: sa.engine.Connection, tables: Iterable[str]
+) -> List[Tuple[str, str]]:
+    """
+    This function finds the indexes on the tables other than the ones their primary
+    keys and constraints come with, eg the dashboards' indexes from the migrations
+    :return: the name of each index and the sql that creates it
+    """
+    if con.dialect.name == "postgresql":
+        indexes: List[Tuple[str, str]] = []
+        for name in tables:
+            # the index names come back as text, quoted and qualified if they need it
+            rows = con.execute(
+                sa.text(
+                    "SELECT CAST(CAST(indexrelid AS regclass) AS text), pg_get_indexdef(indexrelid)"
+                    " FROM pg_index WHERE indrelid = CAST(:name AS regclass)"
+                    " AND NOT EXISTS"
+                    " (SELECT 1 FROM pg_constraint WHERE conindid = indexrelid)"
+                ),
+                {"name": name},
+            )
+            indexes += [(str(index), definition) for index, definition in rows]
+        return indexes
+    # the indexes that come with the tables, eg for their primary keys, have no sql
+    return [
+        (index, definition)
+        for index, definition in con.execute(
+            sa.text(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index'"
+                " AND sql IS NOT NULL AND tbl_name IN :names"
+            ).bindparams(sa.bindparam("names", expanding=True)),
+            {"names": list(tables)},
+        )
+    ]
+
+
+def drop_indexes(con: sa.engine.Connection) -> List[str]:
+    """
+    This function drops the secondary indexes of the tables, so that a bulk load
+    doesn't have to update them a row at a time
+    :return: the sql that creates them again, for rebuild_indexes
+    """
+    indexes = secondary_indexes(con, TABLE_KEYS)
+    for index, _ in indexes:
+        con.execute(sa.text(f"DROP INDEX {index}"))
+    return [definition for _, definition in indexes]
+
+
+def rebuild_indexes(con: sa.engine.Connection, definitions: List[str]) -> None:
+    """
+    This function builds the indexes dropped by drop_indexes in one pass over the
+    loaded tables, then analyzes the tables so that the planner knows what's in them
+    """
+    for definition in definitions:
+        # the definitions come from the database, so they don't go through sa.text
+        con.exec_driver_sql(definition)
+    for name in TABLE_KEYS:
+        con.execute(sa.text(f"ANALYZE {name}"))
+
+
+def stage_table(
+    con: sa.engine.Connection,
+    name: str,
+    data: TableData,
+    chunksize: int = CHUNKSIZE,
+) -> Tuple[str, List[str]]:
+    """
+    This function loads the rows into a temporary table with the same columns
+    as the table they're going to be merged into, indexed by the table's keys
+    :return: the name of the temporary table and the columns that were loaded
+    """
+    stage = f"stage_{name}"
+    con.execute(sa.text(f"DROP TABLE IF EXISTS {stage}"))
+    con.execute(
+        sa.text(f"CREATE TEMPORARY TABLE {stage} AS SELECT * FROM {name} WHERE 1 = 0")
+    )
+    columns = bulk_load(con, stage, data, chunksize)
+    # without it sqlite scans the whole stage for each row delete_missing looks up
+    con.execute(
+        sa.text(f"CREATE INDEX {stage}_keys ON {stage} ({', '.join(TABLE_KEYS[name])})")
+    )
+    return stage, columns
+
+
+def merge_table(
+    con: sa.engine.Connection, name: str, stage: str, columns: List[str]
+) -> int:
+    """
+    This function upserts the rows of the stage table into the table, the rows that
+    are already there are only updated if one of their columns changed
+    :return: the number of rows that were inserted or updated
+    """
+    if not columns:
+        # nothing was staged
+        return 0
+    keys = TABLE_KEYS[name]
+    values = [column for column in columns if column not in keys]
+    # sqlite has to be told the select has a where clause to parse the on conflict
+    statement = (
+        f"INSERT INTO {name} ({', '.join(columns)})"
+        f" SELECT {', '.join(columns)} FROM {stage} WHERE true"
+        f" ON CONFLICT ({', '.join(keys)})"
+    )
+    if values:
+        # the comparisons have to treat two nulls as the same
+        distinct = "IS NOT" if con.dialect.name == "sqlite" else "IS DISTINCT FROM"
+        updates = ", ".join(f"{column} = excluded.{column}" for column in values)
+        changed = " OR ".join(
+            f"{name}.{column} {distinct} excluded.{column}" for column in values
+        )
+        statement += f" DO UPDATE SET {updates} WHERE {changed}"
+    else:
+        statement += " DO NOTHING"
+    written: int = con.execute(sa.text(statement)).rowcount
+    return written
+
+
+def delete_missing(con: sa.engine.Connection, name: str, stage: str) -> int:
+    """
+    This function deletes the rows of the table that aren't in the stage table
+    :return: the number of rows deleted
+    """
+    matching = " AND ".join(f"{stage}.{key} = {name}.{key}" for key in TABLE_KEYS[name])
+    deleted: int = con.execute(
+        sa.text(
+            f"DELETE FROM {name} WHERE NOT EXISTS (SELECT 1 FROM {stage} WHERE {matching})"
+        )
+    ).rowcount
+    return deleted
+
+
+def merge_data(
+    con: sa.engine.Connection,
+    frames: Mapping[str, TableData],
+    chunksize: int = CHUNKSIZE,
+) -> Dict[str, Dict[str, int]]:
+    """
+    This function merges a new snapshot into the tables instead of replacing them.
+    Each dataframe is staged in a temporary table, upserted into its table, and then
+    the rows that are no longer in the snapshot are deleted. Only the rows that
+    changed are written, which relies on the athletes keeping their ids between
+    scrapes, see the extract's IdRegistry.
+    :param frames: the rows keyed by the name of their table
+    :return: the number of rows written and deleted in each table
+    """
+    stages = {
+        name: stage_table(con, name, frames[name], chunksize) for name in TABLE_KEYS
+    }
+    counts = {}
+    for name, (stage, columns) in stages.items():
+        counts[name] = {"written": merge_table(con, name, stage, columns)}
+    # the performances go first since they refer to the matches and athletes
+    for name, (stage, _) in reversed(stages.items()):
+        counts[name]["deleted"] = delete_missing(con, name, stage)
+    for stage, _ in stages.values():
+        con.execute(sa.text(f"DROP TABLE {stage}"))
+    return counts
+
+
+def refresh_stats(con: sa.engine.Connection, suffix: str = "") -> None:
+    """
+    This function rebuilds the stats tables from the tables, in the same transaction
+    as the load so that the dashboards never see stats of a different load.
+    athlete_stats has the wins, finishes and matches of each athlete with a page on
+    bjjheroes, and athlete_method_stats their wins by each method.
+    :param suffix: the suffix of the tables, to build the shadow stats tables from
+    the shadow tables
+    """
+    athlete, performance, match = (
+        f"athlete{suffix}",
+        f"performance{suffix}",
+        f"match{suffix}",
+    )
+    athlete_stats, athlete_method_stats = (f"{name}{suffix}" for name in STATS_TABLES)
+    con.execute(sa.text(f"DELETE FROM {athlete_method_stats}"))
+    con.execute(sa.text(f"DELETE FROM {athlete_stats}"))
+    # the finishes are the wins that weren't on points or decisions, the same as
+    # the dashboards used to count them
+    con.execute(
+        sa.text(
+            f"""
+            INSERT INTO {athlete_stats} (athlete_id, name, wins, subs, total_matches)
+            SELECT a.id,
+                   a.name,
+                   SUM(CASE WHEN p.result = 'W' THEN 1 ELSE 0 END),
+                   SUM(CASE
+                           WHEN m.method LIKE 'Pts:%' THEN 0
+                           WHEN m.method IN ('N/A', 'Points', 'DQ', 'Referee Decision', 'Adv', 'Pen', '---', 'Advantages') THEN 0
+                           WHEN m.method LIKE 'EBI%' THEN 0
+                           WHEN p.result = 'W' THEN 1
+                           ELSE 0
+                       END),
+                   COUNT(*)
+            FROM {athlete} a
+                     JOIN {performance} p ON a.id = p.athlete_id
+                     JOIN {match} m ON p.match_id = m.id
+            WHERE a.url != ''
+            GROUP BY a.id, a.name
+            """
+        )
+    )
+    con.execute(
+        sa.text(
+            f"""
+            INSERT INTO {athlete_method_stats} (method, athlete_id, wins)
+            SELECT m.method, a.id, COUNT(*)
+            FROM {athlete} a
+                     JOIN {performance} p ON a.id = p.athlete_id
+                     JOIN {match} m ON p.match_id = m.id
+            WHERE a.url != ''
+              AND p.result = 'W'
+              AND m.method IS NOT NULL
+            GROUP BY m.method, a.id
+            """
+        )
+    )
+    for name in [athlete_stats, athlete_method_stats]:
+        con.execute(sa.text(f"ANALYZE {name}"))
+
+
+def create_shadow_tables(con: sa.engine.Connection) -> None:
+    """
+    This function creates an empty shadow table for each table, with the same
+    columns and defaults but none of the indexes, those are built once it's loaded
+    """
+    for name in reversed(SWAPPED_TABLES):
+        con.execute(sa.text(f"DROP TABLE IF EXISTS {name}{SHADOW_SUFFIX}"))
+    for name in SWAPPED_TABLES:
+        shadow = f"{name}{SHADOW_SUFFIX}"
+        if con.dialect.name == "postgresql":
+            con.execute(
+                sa.text(
+                    f"CREATE TABLE {shadow} (LIKE {name} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+                )
+            )
+            copy_privileges(con, name, shadow)
+        else:
+            table_sql = con.execute(
+                sa.text(
+                    "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"
+                ),
+                {"name": name},
+            ).scalar_one()
+            con.exec_driver_sql(
+                re.sub(
+                    rf'^CREATE TABLE\s+"?{name}"?', f"CREATE TABLE {shadow}", table_sql
+                )
+            )
+
+
+def copy_privileges(con: sa.engine.Connection, name: str, shadow: str) -> None:
+    """
+    This function gives the postgres shadow table the same owner and grants as the
+    table, LIKE doesn't copy them and the dashboards' role would lose its SELECT on
+    the tables after the swap otherwise.
+    There's no postgres in the tests, to check it by hand run a swap load against a
+    database where the tables are granted to another role and compare \\dp before
+    and after
+    """
+    owner = con.execute(
+        sa.text(
+            "SELECT quote_ident(pg_get_userbyid(relowner)) FROM pg_class"
+            " WHERE oid = CAST(:name AS regclass)"
+        ),
+        {"name": name},
+    ).scalar_one()
+    con.execute(sa.text(f"ALTER TABLE {shadow} OWNER TO {owner}"))
+    # the owner's own privileges come with owning the table
+    grants = con.execute(
+        sa.text(
+            "SELECT CASE WHEN acl.grantee = 0 THEN 'PUBLIC'"
+            " ELSE quote_ident(pg_get_userbyid(acl.grantee)) END,"
+            " acl.privilege_type, acl.is_grantable"
+            " FROM pg_class, aclexplode(pg_class.relacl) AS acl"
+            " WHERE pg_class.oid = CAST(:name AS regclass)"
+            " AND acl.grantee != pg_class.relowner"
+        ),
+        {"name": name},
+    )
+    for grantee, privilege, grantable in grants:
+        con.execute(
+            sa.text(
+                f"GRANT {privilege} ON {shadow} TO {grantee}"
+                + (" WITH GRANT OPTION" if grantable else "")
+            )
+        )
+
+
+def index_shadow_tables(con: sa.engine.Connection) -> None:
+    """
+    This function builds the same indexes and constraints on the postgres shadow tables
+    as the tables have, named with the shadow suffix, and the foreign keys refer to
+    the other shadow tables. Then it analyzes them.
+    """
+    foreign_keys = []
+    for name in SWAPPED_TABLES:
+        shadow = f"{name}{SHADOW_SUFFIX}"
+        indexes = con.execute(
+            sa.text(
+                "SELECT indexname, indexdef FROM pg_indexes"
+                " WHERE schemaname = current_schema() AND tablename = :name"
+            ),
+            {"name": name},
+        ).all()
+        for index, definition in indexes:
+            definition = definition.replace(
+                f" INDEX {index} ON ", f" INDEX {index}{SHADOW_SUFFIX} ON ", 1
+            )
+            definition = re.sub(
+                rf" ON (ONLY )?(\S+\.)?{name} ", rf" ON \g<2>{shadow} ", definition, 1
+            )
+            # the definitions come from postgres, so they don't go through sa.text
+            con.exec_driver_sql(definition)
+        constraints = con.execute(
+            sa.text(
+                "SELECT conname, contype, pg_get_constraintdef(oid) FROM pg_constraint"
+                " WHERE conrelid = CAST(:name AS regclass) AND contype IN ('p', 'u', 'f')"
+            ),
+            {"name": name},
+        ).all()
+        for constraint, kind, definition in constraints:
+            if kind == "f":
+                foreign_keys.append((shadow, constraint, definition))
+                continue
+            # the index the constraint needs was just built, with the constraint's name
+            con.execute(
+                sa.text(
+                    f"ALTER TABLE {shadow} ADD CONSTRAINT {constraint}{SHADOW_SUFFIX}"
+                    f" {'PRIMARY KEY' if kind == 'p' else 'UNIQUE'}"
+                    f" USING INDEX {constraint}{SHADOW_SUFFIX}"
+                )
+            )
+    # the foreign keys can only be added once the tables they refer to have their keys
+    for shadow, constraint, definition in foreign_keys:
+        definition = re.sub(
+            rf"REFERENCES ({'|'.join(TABLE_KEYS)})\(",
+            rf"REFERENCES \1{SHADOW_SUFFIX}(",
+            definition,
+        )
+        con.exec_driver_sql(
+            f"ALTER TABLE {shadow} ADD CONSTRAINT {constraint}{SHADOW_SUFFIX} {definition}"
+        )
+    for name in TABLE_KEYS:
+        con.execute(sa.text(f"ANALYZE {name}{SHADOW_SUFFIX}"))
+
+
+def load_shadow_tables(
+    con: sa.engine.Connection,
+    frames: Mapping[str, TableData],
+    chunksize: int = CHUNKSIZE,
+) -> None:
+    """
+    This function loads the rows into new shadow tables, builds the shadow stats
+    tables from them, then builds their indexes and analyzes them, without touching
+    the tables the dashboards read
+    :param frames: the rows keyed by the name of their table
+    """
+    create_shadow_tables(con)
+    for name in TABLE_KEYS:
+        bulk_load(con, f"{name}{SHADOW_SUFFIX}", frames[name], chunksize)
+    refresh_stats(con, SHADOW_SUFFIX)
+    if con.dialect.name == "postgresql":
+        index_shadow_tables(con)
+
+
+def load_shadow_table(
+    engine: sa.engine.Engine, name: str, data: TableData, chunksize: int = CHUNKSIZE
+) -> None:
+    """
+    loads the rows into a shadow table over a connection of its own, and commits them
+    """
+    with engine.begin() as con:
+        bulk_load(con, f"{name}{SHADOW_SUFFIX}", data, chunksize)
+
+
+def load_shadow_tables_parallel(
+    engine: sa.engine.Engine,
+    frames: Mapping[str, TableData],
+    chunksize: int = CHUNKSIZE,
+    workers: int = LOAD_WORKERS,
+) -> None:
+    """
+    This function loads the shadow tables like load_shadow_tables, but over several
+    of the engine's connections at once. The matches and athletes are loaded side by
+    side, then the performances' chunks are shared out between the workers.
+    Each worker commits what it loaded, which is safe since the dashboards only read
+    the tables, they see none of it until the shadow tables are swapped in. If a
+    worker fails the tables are untouched, and the next load starts the shadow
+    tables over.
+    Sqlite only lets one connection write at a time, so there they're loaded
+    one after another over one connection.
+    :param frames: the rows keyed by the name of their table
+    :param workers: how many connections the performances are loaded over
+    """
+    if engine.dialect.name != "postgresql":
+        with engine.begin() as con:
+            load_shadow_tables(con, frames, chunksize)
+        return
+    with engine.begin() as con:
+        create_shadow_tables(con)
+    # the shadow tables have no foreign keys yet, so the tables can be loaded in any order
+    with ThreadPoolExecutor(max_workers=max(workers, 2)) as pool:
+        loads = [
+            pool.submit(load_shadow_table, engine, name, frames[name], chunksize)
+            for name in ["match", "athlete"]
+        ]
+        for load in loads:
+            load.result()
+        performances = SharedChunks(as_chunks(frames["performance"], chunksize))
+        loads = [
+            pool.submit(
+                load_shadow_table, engine, "performance", performances, chunksize
+            )
+            for _ in range(workers)
+        ]
+        for load in loads:
+            load.result()
+    with engine.begin() as con:
+        refresh_stats(con, SHADOW_SUFFIX)
+        index_shadow_tables(con)
+
+
+def swap_shadow_tables(con: sa.engine.Connection) -> None:
+    """
+    This function replaces the tables with their shadow tables, it has to run in a
+    transaction of its own. On postgres it only drops and renames things, so it
+    takes the same few milliseconds however big the tables are, and the dashboards'
+    queries see either all of the old tables or all of the new ones.
+    Sqlite can't rename indexes, so there the indexes are built after the swap,
+    still inside the transaction.
+    """
+    if con.dialect.name != "postgresql":
+        definitions = [sql for _, sql in secondary_indexes(con, SWAPPED_TABLES)]
+        for name in reversed(SWAPPED_TABLES):
+            con.execute(sa.text(f"DROP TABLE {name}"))
+        for name in SWAPPED_TABLES:
+            con.execute(sa.text(f"ALTER TABLE {name}{SHADOW_SUFFIX} RENAME TO {name}"))
+        rebuild_indexes(con, definitions)
+        return
+    # rather than queueing the dashboards' queries behind it for long, the swap gives up
+    con.execute(sa.text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'"))
+    for name in SWAPPED_TABLES:
+        shadow = f"{name}{SHADOW_SUFFIX}"
+        # the shadow tables' ids take their defaults from the tables' sequences,
+        # which would be dropped with the tables if they still owned them
+        sequences = con.execute(
+            sa.text(
+                "SELECT attname, pg_get_serial_sequence(:name, attname) FROM pg_attribute"
+                " WHERE attrelid = CAST(:name AS regclass) AND attnum > 0 AND NOT attisdropped"
+            ),
+            {"name": name},
+        )
+        for column, sequence in sequences:
+            if sequence is not None:
+                con.execute(
+                    sa.text(f"ALTER SEQUENCE {sequence} OWNED BY {shadow}.{column}")
+                )
+    con.execute(sa.text(f"DROP TABLE {', '.join(SWAPPED_TABLES)}"))
+    for name in SWAPPED_TABLES:
+        shadow = f"{name}{SHADOW_SUFFIX}"
+        indexes = (
+            con.execute(
+                sa.text(
+                    "SELECT indexname FROM pg_indexes"
+                    " WHERE schemaname = current_schema() AND tablename = :shadow"
+                ),
+                {"shadow": shadow},
+            )
+            .scalars()
+            .all()
+        )
+        foreign_keys = (
+            con.execute(
+                sa.text(
+                    "SELECT conname FROM pg_constraint"
+                    " WHERE conrelid = CAST(:shadow AS regclass) AND contype = 'f'"
+                ),
+                {"shadow": shadow},
+            )
+            .scalars()
+            .all()
+        )
+        con.execute(sa.text(f"ALTER TABLE {shadow} RENAME TO {name}"))
+        # renaming the index of a primary key or unique constraint renames it too
+        for index in indexes:
+            con.execute(
+                sa.text(f"ALTER INDEX {index} RENAME TO {index[: -len(SHADOW_SUFFIX)]}")
+            )
+        for constraint in foreign_keys:
+            con.execute(
+                sa.text(
+                    f"ALTER TABLE {name} RENAME CONSTRAINT {constraint}"
+                    f" TO {constraint[: -len(SHADOW_SUFFIX)]}"
+                )
+            )
+
+
+def read_parquet_batches(
+    path: str, chunksize: int = CHUNKSIZE, region: Optional[str] = None
+) -> Iterator[pa.RecordBatch]:
+    """
+    reads a local or s3 parquet file chunksize rows at a time, as arrow record
+    batches that go into the database without being made into dataframes
+    """
+    if path.startswith("s3://"):
+        filesystem, path = pyarrow.fs.S3FileSystem(region=region), path[len("s3://") :]
+    else:
+        filesystem, path = pyarrow.fs.LocalFileSystem(), os.path.abspath(path)
+    with filesystem.open_input_file(path) as f:
+        parquet_file = pq.ParquetFile(f)
+        # the index pandas may have written the file with isn't one of the table's columns
+        columns = [
+            name
+            for name in parquet_file.schema_arrow.names
+            if not name.startswith("__index_level_")
+        ]
+        yield from parquet_file.iter_batches(batch_size=chunksize, columns=columns)
+
+
+def read_csv_chunks(path: str, chunksize: int = CHUNKSIZE) -> Iterator[pd.DataFrame]:
+    """
+    reads a csv file chunksize rows at a time
+    """
+    with pd.read_csv(path, chunksize=chunksize) as reader:
+        yield from reader
+
+
+def peak_rss_mb() -> float:
+    """
+    the most memory this process has had. on linux it's read from /proc, since
+    ru_maxrss carries over the peak of the process that started this one, eg the
+    one that made up the snapshots for the load benchmark
+    """
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    # ru_maxrss is in KB on linux and bytes on macos
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024**2
 
 
 def upload_data(
-    athlete_df: pd.DataFrame,
-    performance_df: pd.DataFrame,
-    match_df: pd.DataFrame,
+    athlete_df: TableData,
+    performance_df: TableData,
+    match_df: TableData,
     engine: sa.engine.Engine,
+    chunksize: int = CHUNKSIZE,
+    mode: str = "replace",
+    workers: int = LOAD_WORKERS,
 ) -> None:
     """
     This function takes in 3 dataframes and an engine and loads the data into the database
-    the following parameters match the tables in the target database
+    the following parameters match the tables in the target database, each one can also
+    be an iterator of chunks of the table, which are loaded as they are read
     :param athlete_df:
     :param performance_df:
     :param match_df:
     :param engine: the sqlalchemy engine to use
+    :param chunksize: the rows sent to the database at a time, see bulk_load
+    :param mode: replace deletes everything in the tables and loads the dataframes,
+    with the secondary indexes dropped until they're loaded, see drop_indexes,
+    incremental merges them into what's there and only writes what changed, see merge_data,
+    swap loads them into shadow tables and swaps those in, see swap_shadow_tables,
+    parallel does the same over several connections, see load_shadow_tables_parallel
+    :param workers: the connections the parallel mode loads the performances over
+    every mode refreshes the stats tables in the same transaction as the tables they
+    come from, see refresh_stats
     """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"unknown load mode {mode}, expected one of {LOAD_MODES}")
+    frames = {"athlete": athlete_df, "performance": performance_df, "match": match_df}
+    if mode in ["swap", "parallel"]:
+        print("loading shadow tables")
+        if mode == "parallel":
+            load_shadow_tables_parallel(engine, frames, chunksize, workers)
+        else:
+            with engine.begin() as con:
+                load_shadow_tables(con, frames, chunksize)
+        with engine.begin() as con:
+            print("swapping in shadow tables")
+            swap_shadow_tables(con)
+        return
+    if mode == "incremental":
+        with engine.begin() as con:
+            print("merging data")
+            counts = merge_data(con, frames, chunksize)
+            print("refreshing stats")
+            refresh_stats(con)
+        for name, table_counts in counts.items():
+            print(
+                f"{name}: {table_counts['written']} rows written, {table_counts['deleted']} deleted"
+            )
+        return
     with engine.begin() as con:
+        print("dropping indexes")
+        indexes = drop_indexes(con)
         # here i check whether its a postgres or sqlite database
         if "sqlite" in engine.url.drivername:
             print("deleting existing data")
@@ -54,35 +876,77 @@ def upload_data(
             )
             con.execute(statement)
         print("loading data")
-        match_df.to_sql("match", con, if_exists="append", index=False, method="multi")
-        athlete_df.to_sql(
-            "athlete", con, if_exists="append", index=False, method="multi"
-        )
-        performance_df.to_sql(
-            "performance", con, if_exists="append", index=False, method="multi"
-        )
+        bulk_load(con, "match", match_df, chunksize)
+        bulk_load(con, "athlete", athlete_df, chunksize)
+        bulk_load(con, "performance", performance_df, chunksize)
+        print("rebuilding indexes")
+        rebuild_indexes(con, indexes)
+        print("refreshing stats")
+        refresh_stats(con)
 
 
 def upload_from_s3(
-    s3_folder: str, engine: sa.engine.Engine, region: str = "us-east-2"
+    s3_folder: str,
+    engine: sa.engine.Engine,
+    region: str = "us-east-2",
+    mode: str = "replace",
+    chunksize: int = CHUNKSIZE,
+    workers: int = LOAD_WORKERS,
 ) -> None:
     """
     This function takes in an s3 folder and an engine and loads the data from the s3 folder into the database
+    the parquet files are streamed into the database chunksize rows at a time, in arrow
     :param s3_folder: either test or a date string in the format YYYY-MM-DD
     :param engine: the sqlalchemy engine to use
+    :param mode: how the data replaces what is in the database, see upload_data
     """
-    athlete_df = wr.pandas.read_parquet(
-        path=f"s3://bjjstats/bjjheroes-scrape-v1/{s3_folder}/athlete.parquet?region={region}"
+    frames = {
+        name: read_parquet_batches(
+            f"{SNAPSHOT_ROOT}/{s3_folder}/{name}.parquet", chunksize, region
+        )
+        for name in TABLE_KEYS
+    }
+    upload_data(
+        frames["athlete"],
+        frames["performance"],
+        frames["match"],
+        engine,
+        chunksize=chunksize,
+        mode=mode,
+        workers=workers,
     )
 
-    performance_df = wr.pandas.read_parquet(
-        path=f"s3://bjjstats/bjjheroes-scrape-v1/{s3_folder}/performance.parquet?region={region}"
-    )
 
-    match_df = wr.pandas.read_parquet(
-        path=f"s3://bjjstats/bjjheroes-scrape-v1/{s3_folder}/match.parquet?region={region}"
+def upload_from_directory(
+    directory: str,
+    engine: sa.engine.Engine,
+    mode: str = "replace",
+    chunksize: int = CHUNKSIZE,
+    workers: int = LOAD_WORKERS,
+) -> None:
+    """
+    This function loads the tables from a local directory into the database, chunksize
+    rows at a time. Each table is read from its parquet file, eg the extract's --parquet
+    output, or from its csv file if it has none, eg the extract's --output.
+    """
+    frames: Dict[str, TableData] = {}
+    for name in TABLE_KEYS:
+        path = os.path.join(directory, f"{name}.parquet")
+        if os.path.exists(path):
+            frames[name] = read_parquet_batches(path, chunksize)
+        else:
+            frames[name] = read_csv_chunks(
+                os.path.join(directory, f"{name}.csv"), chunksize
+            )
+    upload_data(
+        frames["athlete"],
+        frames["performance"],
+        frames["match"],
+        engine,
+        chunksize=chunksize,
+        mode=mode,
+        workers=workers,
     )
-    upload_data(athlete_df, performance_df, match_df, engine)
 
 
 def lambda_handler(event: ALBEvent, context: LambdaContext) -> Dict[str, Any]:
@@ -92,28 +956,64 @@ def lambda_handler(event: ALBEvent, context: LambdaContext) -> Dict[str, Any]:
         if DB_URL is None:
             raise Exception("You must set the DB_URL environment variable")
         engine = sa.create_engine(DB_URL)
-        upload_from_s3(s3_folder, engine)
+        upload_from_s3(
+            s3_folder,
+            engine,
+            mode=event.get("mode") or "replace",
+            chunksize=event.get("chunksize") or CHUNKSIZE,
+            workers=event.get("workers") or LOAD_WORKERS,
+        )
         engine.dispose()
     else:
         raise Exception("You must provide an s3_folder in the event")
-    return {"statusCode": 200, "body": "Data loaded"}
+    return {"statusCode": 200, "body": "Data loaded", "peak_rss_mb": peak_rss_mb()}
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Load data into the database")
-    parser.add_argument("input", type=str, help="the directory where the csv files are")
+    parser.add_argument(
+        "input", type=str, help="the directory where the parquet or csv files are"
+    )
     parser.add_argument("--s3", action="store_true", help="whether to load from s3")
+    parser.add_argument(
+        "--mode",
+        type=str,
+        default="replace",
+        choices=LOAD_MODES,
+        help="how the data replaces what's in the tables, see upload_data",
+    )
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=CHUNKSIZE,
+        help="the rows read and loaded at a time",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=LOAD_WORKERS,
+        help="the connections the parallel mode loads over",
+    )
     args = parser.parse_args()
     DB_URL = os.getenv("DB_URL")
     if DB_URL is None:
         raise Exception("You must set the DB_URL environment variable")
     engine = sa.create_engine(DB_URL)
     if args.s3:
-        upload_from_s3(args.input, engine)
+        upload_from_s3(
+            args.input,
+            engine,
+            mode=args.mode,
+            chunksize=args.chunksize,
+            workers=args.workers,
+        )
     else:
-        athlete_df = pd.read_csv(os.path.join(args.input, "athlete.csv"))
-        performance_df = pd.read_csv(os.path.join(args.input, "performance.csv"))
-        match_df = pd.read_csv(os.path.join(args.input, "match.csv"))
-        upload_data(athlete_df, performance_df, match_df, engine)
+        upload_from_directory(
+            args.input,
+            engine,
+            mode=args.mode,
+            chunksize=args.chunksize,
+            workers=args.workers,
+        )
     engine.dispose()
-    print("data loaded")
+    print(f"data loaded, peak memory {peak_rss_mb():.0f} MB")
@@ -0,0 +1,143 @@
+"""
+a local stand-in for the bjjheroes website that the scraper tests can crawl.
+the server runs in a background thread so that both the blocking requests.get
+of the a-z list and the aiohttp downloads in the scraper can reach it.
+"""
+
+import asyncio
+import hashlib
+import threading
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+
+class StandInSite:
+    """
+    serves athlete pages keyed by the `p` query parameter, the same way bjjheroes
+    links to athletes (eg /?p=9246), and the a-z list at /a-z-bjj-fighters-list
+    athlete pages are served with an ETag and Last-Modified header and answer
+    conditional requests with a 304 when the page has not changed.
+    the site can also be made slow, flaky, or to throttle too many requests at once,
+    and pages can be served with a charset that doesn't match their bytes
+    tests.synthetic_site.generate_site builds a whole site of pages to serve with it
+    usage:
+    with StandInSite({"9246": html}, athlete_list=html) as site:
+        requests.get(f"{site.url}/?p=9246")
+    """
+
+    def __init__(
+        self,
+        pages: Dict[str, str],
+        athlete_list: str = "",
+        delays: Optional[Dict[str, float]] = None,
+        failures: Optional[Dict[str, List[int]]] = None,
+        throttle_above: Optional[int] = None,
+        latency: float = 0.0,
+        charsets: Optional[Dict[str, str]] = None,
+    ) -> None:
+        self.pages = pages
+        self.athlete_list = athlete_list
+        # seconds to wait before answering for a page, keyed like the pages
+        self.delays = delays or {}
+        # seconds to wait before answering for the pages without a delay of their own
+        self.latency = latency
+        # error statuses to answer the first requests for a page with, in order
+        self.failures = failures or {}
+        # answer with a 429 while more than this many pages are being requested at once
+        self.throttle_above = throttle_above
+        # the charset to declare for a page, keyed like the pages. the page is still
+        # sent as utf-8, so a page that isn't ascii can't be decoded with eg ascii
+        self.charsets = charsets or {}
+        # every path that was requested, in the order the requests came in
+        self.requests: List[str] = []
+        # the status of every athlete page response, in the same order
+        self.statuses: List[int] = []
+        # the most athlete page requests that were being served at the same time
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self.url = ""
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._runner: Optional[web.AppRunner] = None
+        self._thread: Optional[threading.Thread] = None
+
+    async def handle_athlete_list(self, request: web.Request) -> web.Response:
+        self.requests.append(request.path_qs)
+        return web.Response(text=self.athlete_list, content_type="text/html")
+
+    async def handle_athlete(self, request: web.Request) -> web.Response:
+        self.requests.append(request.path_qs)
+        key = request.query.get("p", "")
+        self._in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self._in_flight)
+        try:
+            await asyncio.sleep(self.delays.get(key, self.latency))
+            throttled = (
+                self.throttle_above is not None
+                and self._in_flight > self.throttle_above
+            )
+        finally:
+            self._in_flight -= 1
+        if throttled:
+            self.statuses.append(429)
+            return web.Response(status=429)
+        if self.failures.get(key):
+            status = self.failures[key].pop(0)
+            self.statuses.append(status)
+            return web.Response(status=status)
+        page = self.pages.get(key)
+        if page is None:
+            self.statuses.append(404)
+            raise web.HTTPNotFound()
+        etag = f'"{hashlib.md5(page.encode()).hexdigest()}"'
+        headers = {"ETag": etag, "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
+        if request.headers.get("If-None-Match") == etag:
+            self.statuses.append(304)
+            return web.Response(status=304, headers=headers)
+        self.statuses.append(200)
+        if key in self.charsets:
+            return web.Response(
+                body=page.encode(),
+                content_type="text/html",
+                charset=self.charsets[key],
+                headers=headers,
+            )
+        return web.Response(text=page, content_type="text/html", headers=headers)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/a-z-bjj-fighters-list", self.handle_athlete_list)
+        app.router.add_get("/", self.handle_athlete)
+        return app
+
+    async def _start(self) -> None:
+        self._runner = web.AppRunner(self.make_app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        host, port = self._runner.addresses[0][:2]
+        self.url = f"http://{host}:{port}"
+
+    def __enter__(self) -> "StandInSite":
+        self._loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        def run() -> None:
+            assert self._loop is not None
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        assert self._loop is not None and self._runner is not None
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        assert self._thread is not None
+        self._thread.join()
+        self._loop.close()
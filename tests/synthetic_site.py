@@ -0,0 +1,253 @@
+"""
+builds synthetic bjjheroes pages that look like the real ones closely enough
+for the scraper's parsers, for tests and benchmarks that need more than the
+pages in the fixtures directory. generate_site builds a whole site of
+interlinked athletes that can be served with tests.stand_in.StandInSite
+"""
+
+import random
+from typing import Dict, List, NamedTuple, Optional, Sequence
+
+
+class SyntheticMatch(NamedTuple):
+    match_id: int
+    opponent: str
+    # the opponent's link relative to the site, None for opponents without a page
+    href: Optional[str]
+    result: str = "W"
+    method: str = "Armbar"
+    competition: str = "ADCC"
+    weight: str = "77KG"
+    stage: str = "F"
+    year: str = "2019"
+
+
+class SyntheticAthlete(NamedTuple):
+    first_name: str
+    last_name: str
+    nickname: str
+    href: str
+
+
+def athlete_page(matches: Sequence[SyntheticMatch]) -> str:
+    """
+    builds an athlete page with one row in the match table for each match,
+    athletes without matches get a page with no match table at all
+    """
+    if not matches:
+        return "<!doctype html>\n<html><body><p>No matches</p></body></html>\n"
+    rows = []
+    for match in matches:
+        link = (
+            f'<a href="{match.href}">{match.opponent}</a>'
+            if match.href is not None
+            else ""
+        )
+        rows.append(
+            "<tr>\n"
+            f"\t<td>{match.match_id}</td>\n"
+            f'\t<td class="sort"><span>{match.opponent}</span>{link}</td>\n'
+            f'\t<td style="color:#d91300;">{match.result}</td>\n'
+            f'\t<td><a href="/?p=6438">{match.method}</a></td>\n'
+            f"\t<td>{match.competition}</td>\n"
+            f"\t<td>{match.weight}</td>\n"
+            f"\t<td>{match.stage}</td>\n"
+            f"\t<td>{match.year}</td>\n"
+            "</tr>\n"
+        )
+    return (
+        "<!doctype html>\n<html><head><title>athlete</title></head><body>\n"
+        '<table class="table"><tbody><tr><td>not the match table</td></tr></tbody></table>\n'
+        '<table class="table table-striped sort_table">\n'
+        "<thead>\n<tr><th>ID</th><th>Opponent</th><th>W/L</th><th>Method</th>"
+        "<th>Competition</th><th>Weight</th><th>Stage</th><th>Year</th></tr>\n</thead>\n"
+        f"<tbody>\n{''.join(rows)}</tbody>\n</table>\n</body></html>\n"
+    )
+
+
+def athlete_list(athletes: Sequence[SyntheticAthlete]) -> str:
+    """
+    builds the a-z list of athletes
+    """
+    rows = []
+    for i, athlete in enumerate(athletes):
+        nickname = (
+            f'<a href="{athlete.href}">{athlete.nickname}</a>'
+            if athlete.nickname
+            else ""
+        )
+        rows.append(
+            f'<tr class="row-{i + 2}">'
+            f'<td class="column-1"><a href="{athlete.href}">{athlete.first_name}</a></td>'
+            f'<td class="column-2"><a href="{athlete.href}">{athlete.last_name}</a></td>'
+            f'<td class="column-3">{nickname}</td>'
+            '<td class="column-4">Team</td></tr>\n'
+        )
+    return (
+        "<!doctype html>\n<html><body>\n"
+        '<table class="tablepress" id="tablepress-8">\n<thead>\n<tr class="row-1">'
+        "<th>First Name</th><th>Last Name</th><th>Nickname</th><th>Team</th>"
+        "</tr>\n</thead>\n"
+        f'<tbody class="row-hover">\n{"".join(rows)}</tbody>\n</table>\n</body></html>\n'
+    )
+
+
+FIRST_NAMES = [
+    "Andre",
+    "Bruno",
+    "Craig",
+    "Felipe",
+    "Gabi",
+    "Gordon",
+    "Jozef",
+    "Kade",
+    "Lachlan",
+    "Mackenzie",
+    "Marcelo",
+    "Mica",
+    "Nicholas",
+    "Roger",
+    "Tainan",
+    "Tye",
+]
+LAST_NAMES = [
+    "Almeida",
+    "Barbosa",
+    "Dern",
+    "Galvao",
+    "Garcia",
+    "Gracie",
+    "Jones",
+    "Lima",
+    "Meregali",
+    "Pena",
+    "Ruotolo",
+    "Ryan",
+    "Santos",
+    "Silva",
+    "Souza",
+    "Tonon",
+]
+NICKNAMES = ["", "", "", "Buchecha", "Kron", "Tererê", "Cyborg", "Bad Boy"]
+METHODS = [
+    "Points",
+    "Points",
+    "Points",
+    "Adv",
+    "Pen",
+    "Armbar",
+    "RNC",
+    "Triangle",
+    "Heel hook",
+    "Kneebar",
+    "Choke",
+    "Guillotine",
+    "Ezekiel",
+    "Referee Decision",
+]
+COMPETITIONS = [
+    "ADCC",
+    "IBJJF Worlds",
+    "IBJJF Pans",
+    "IBJJF Europeans",
+    "Brasileiro",
+    "WNO",
+    "Polaris",
+    "Kasai",
+    "EBI",
+    "Who's Number One",
+    "Grappling Industries",
+]
+WEIGHTS = ["66KG", "77KG", "88KG", "99KG", "ABS", "+99KG", "60KG", "94KG", "PESADO"]
+STAGES = ["F", "SF", "4F", "8F", "R1", "R2", "RR", "3RD", "SPF"]
+RESULTS = {"W": "L", "L": "W", "D": "D"}
+
+
+class SyntheticSite(NamedTuple):
+    athletes: List[SyntheticAthlete]
+    # the athlete pages keyed by the p query parameter, like StandInSite's pages
+    pages: Dict[str, str]
+    athlete_list: str
+    # the number of distinct matches across all of the pages
+    num_matches: int
+
+
+def generate_site(
+    num_athletes: int,
+    matches_per_athlete: int = 20,
+    opponent_overlap: float = 0.7,
+    seed: int = 0,
+) -> SyntheticSite:
+    """
+    builds the a-z list and athlete pages of a made up site
+    :param num_athletes: the number of athletes on the a-z list, each one has a page
+    :param matches_per_athlete: each athlete starts up to this many matches, so with the
+    matches other athletes start against them they average about this many in total
+    :param opponent_overlap: the fraction of matches that are against another athlete
+    on the list, these show up on both athletes' pages with the same match id and the
+    opposite result. the rest are against opponents without a page, drawn from a pool
+    of names so that the same unlinked opponent turns up on several pages
+    :param seed: the same seed always builds the same site
+    """
+    rng = random.Random(seed)
+    athletes = []
+    for i in range(num_athletes):
+        # the number makes every name unique, like the real list
+        athletes.append(
+            SyntheticAthlete(
+                first_name=rng.choice(FIRST_NAMES),
+                last_name=f"{rng.choice(LAST_NAMES)} {i}",
+                nickname=rng.choice(NICKNAMES),
+                href=f"/?p={i}",
+            )
+        )
+    unlinked = [
+        f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} U{i}"
+        for i in range(max(num_athletes // 2, 1))
+    ]
+    matches: List[List[SyntheticMatch]] = [[] for _ in range(num_athletes)]
+    match_id = 0
+    for i, athlete in enumerate(athletes):
+        for _ in range(rng.randint(0, matches_per_athlete)):
+            match_id += 1
+            details = dict(
+                method=rng.choice(METHODS),
+                competition=rng.choice(COMPETITIONS),
+                weight=rng.choice(WEIGHTS),
+                stage=rng.choice(STAGES),
+                year=str(rng.randint(1996, 2024)),
+            )
+            result = rng.choice("WWWLLD")
+            if num_athletes > 1 and rng.random() < opponent_overlap:
+                j = rng.randrange(num_athletes - 1)
+                j = j if j < i else j + 1
+                opponent = athletes[j]
+                matches[i].append(
+                    SyntheticMatch(
+                        match_id,
+                        f"{opponent.first_name} {opponent.last_name}",
+                        opponent.href,
+                        result,
+                        **details,
+                    )
+                )
+                matches[j].append(
+                    SyntheticMatch(
+                        match_id,
+                        f"{athlete.first_name} {athlete.last_name}",
+                        athlete.href,
+                        RESULTS[result],
+                        **details,
+                    )
+                )
+            else:
+                matches[i].append(
+                    SyntheticMatch(
+                        match_id, rng.choice(unlinked), None, result, **details
+                    )
+                )
+    pages = {
+        athlete.href.split("=")[1]: athlete_page(athlete_matches)
+        for athlete, athlete_matches in zip(athletes, matches)
+    }
+    return SyntheticSite(athletes, pages, athlete_list(athletes), match_id)
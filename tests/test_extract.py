@@ -0,0 +1,1071 @@
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from pipeline.extract import extract
+from pipeline.extract.extract import (
+    PARSER_BACKENDS,
+    AdaptiveLimiter,
+    Athlete,
+    AthleteTable,
+    Histogram,
+    IdRegistry,
+    Match,
+    MatchTable,
+    PageArchive,
+    PageCache,
+    PageQueue,
+    ParquetOutput,
+    Performance,
+    PerformanceTable,
+    ScrapeMetrics,
+    Scraper,
+    ShardCoordinator,
+    compute_delta,
+    previous_snapshot,
+    scrape_sharded,
+)
+from tests.stand_in import StandInSite
+from tests.synthetic_site import (
+    SyntheticAthlete,
+    SyntheticMatch,
+    athlete_list,
+    athlete_page,
+    generate_site,
+)
+
+
+def read_fixture(name: str) -> str:
+    source_dir = os.path.dirname(__file__)
+    with open(os.path.join(source_dir, "fixtures", name)) as f:
+        return f.read()
+
+
+@pytest.fixture  # type: ignore
+def stand_in_site(monkeypatch: pytest.MonkeyPatch) -> Iterator[StandInSite]:
+    """
+    a stand-in bjjheroes with the two athletes from athletes.html and the
+    one opponent that has a link on athlete_1.html
+    """
+    pages = {
+        "8141": read_fixture("athlete_0.html"),
+        "9246": read_fixture("athlete_1.html"),
+        "6531": read_fixture("athlete_0.html"),
+    }
+    with StandInSite(pages, athlete_list=read_fixture("athletes.html")) as site:
+        monkeypatch.setattr(extract, "SOURCE_HOSTNAME", site.url)
+        yield site
+
+
+def run_pipeline(
+    scraper: Scraper,
+    download_queue: Optional[Set[Tuple[int, str]]] = None,
+    pool: Optional[Executor] = None,
+) -> None:
+    async def run() -> None:
+        async with scraper.create_session() as session:
+            await scraper.run_pipeline(session, pool, download_queue)
+
+    asyncio.run(run())
+
+
+def download_all(scraper: Scraper, urls: Dict[int, str]) -> None:
+    """
+    downloads and parses the pages, the opponents found on them are left in the
+    scraper's download queue
+    """
+    run_pipeline(scraper, set(urls.items()))
+
+
+def test_pipelined_scrape_matches_batch_scrape(stand_in_site: StandInSite) -> None:
+    """
+    the pipelined crawl should find the same records as the batched crawl,
+    including the opponent that is only linked from an athlete page
+    """
+    batch = Scraper()
+    batch.scrape()
+    pipelined = Scraper(pipelined=True)
+    pipelined.scrape()
+
+    assert len(batch.matches) == 3
+    assert pipelined.athletes == batch.athletes
+    assert pipelined.matches == batch.matches
+    assert pipelined.performances == batch.performances
+    assert f"{stand_in_site.url}/?p=6531" in pipelined.url_search
+    assert not pipelined.download_queue
+    assert not pipelined.scrape_queue
+
+
+def test_download_queue_is_bounded_and_times_out_slow_pages() -> None:
+    """
+    the downloads should never have more than max_concurrency requests in flight,
+    and a page that is slower than the request timeout should be dropped without
+    holding up the other pages
+    """
+    html = read_fixture("athlete_0.html")
+    pages = {str(p): html for p in range(20)}
+    with StandInSite(pages, delays={"0": 3.0, "1": 0.05, "2": 0.05}) as site:
+        scraper = Scraper(
+            max_concurrency=3,
+            request_timeout=0.5,
+            max_retries=0,
+            metrics=ScrapeMetrics(),
+        )
+        start = time.monotonic()
+        download_all(scraper, {p: f"{site.url}/?p={p}" for p in range(20)})
+        elapsed = time.monotonic() - start
+        max_in_flight = site.max_in_flight
+
+    assert max_in_flight == 3
+    assert elapsed < 2.5
+    assert list(scraper.failed_downloads) == [f"{site.url}/?p=0"]
+    assert scraper.metrics.counters["pages_fetched"] == 19
+
+
+def test_page_cache_revalidates_unchanged_pages(
+    stand_in_site: StandInSite, tmp_path: str
+) -> None:
+    """
+    a second scrape with the same cache should only get 304s for unchanged pages,
+    and a page that changed should be downloaded and cached again
+    """
+    cache_dir = os.path.join(tmp_path, "cache")
+    first = Scraper(page_cache=PageCache(cache_dir))
+    first.scrape()
+    assert stand_in_site.statuses == [200, 200, 200]
+
+    stand_in_site.statuses.clear()
+    second = Scraper(page_cache=PageCache(cache_dir))
+    second.scrape()
+    assert stand_in_site.statuses == [304, 304, 304]
+    assert second.athletes == first.athletes
+    assert second.matches == first.matches
+    assert second.performances == first.performances
+
+    stand_in_site.statuses.clear()
+    stand_in_site.pages["9246"] = read_fixture("athlete_0.html")
+    third = Scraper(page_cache=PageCache(cache_dir))
+    third.scrape()
+    assert sorted(stand_in_site.statuses) == [200, 304]
+    assert not third.matches
+    cached = PageCache(cache_dir).get(f"{stand_in_site.url}/?p=9246")
+    assert cached is not None
+    assert cached.page == read_fixture("athlete_0.html")
+
+
+def test_page_cache_evicts_least_recently_used(tmp_path: str) -> None:
+    cache = PageCache(str(tmp_path), max_bytes=2500)
+    for i in range(3):
+        cache.put(f"url{i}", "x" * 1000, f'"{i}"', None)
+        # make sure the modified times are in the order the pages were used
+        os.utime(cache.path(f"url{i}"), (i, i))
+    assert cache.get("url0") is None
+    assert cache.get("url1") is not None
+    assert cache.get("url2") is not None
+    assert cache.size <= 2500
+
+
+def test_page_cache_evicts_down_to_the_low_water_mark(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: str
+) -> None:
+    """
+    each eviction makes room for a few pages, so a full cache isn't listed again
+    on every put
+    """
+    cache = PageCache(str(tmp_path), max_bytes=20_000)
+    evictions = 0
+    evict = cache.evict
+
+    def counted_evict() -> None:
+        nonlocal evictions
+        evictions += 1
+        evict()
+
+    monkeypatch.setattr(cache, "evict", counted_evict)
+    for i in range(400):
+        cache.put(f"url{i}", "x" * 100, None, None)
+        assert cache.size <= 20_000
+    # about 100 pages fit, each eviction frees room for about 10 more
+    assert 20 <= evictions <= 40
+    assert cache.get("url399") is not None
+
+
+def test_page_cache_shared_with_other_shards(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: str
+) -> None:
+    """
+    the shards share a cache directory, so a page can be evicted by another shard
+    while this one is listing the pages to evict
+    """
+    cache = PageCache(str(tmp_path), max_bytes=2500)
+    for i in range(2):
+        cache.put(f"url{i}", "x" * 1000, f'"{i}"', None)
+        os.utime(cache.path(f"url{i}"), (i, i))
+    other = PageCache(str(tmp_path), max_bytes=2500)
+    scandir = os.scandir
+
+    def evicted_while_listing(path: str) -> List[os.DirEntry[str]]:
+        entries = list(scandir(path))
+        os.remove(cache.path("url0"))
+        return entries
+
+    monkeypatch.setattr(os, "scandir", evicted_while_listing)
+    other.put("url2", "x" * 1000, '"2"', None)
+    monkeypatch.undo()
+    assert cache.get("url0") is None
+    # with that page gone the cache was small enough again
+    assert cache.get("url1") is not None
+    assert other.get("url2") is not None
+    assert other.size == sum(
+        os.path.getsize(entry.path) for entry in os.scandir(tmp_path)
+    )
+
+
+def test_parallel_parsing_matches_serial_parsing() -> None:
+    """
+    parsing the pages in a process pool should give exactly the same records
+    and opponent ids as parsing them one by one
+    """
+    pages = [(1, read_fixture("athlete_1.html")), (2, read_fixture("athlete_0.html"))]
+    for i in range(3, 40):
+        pages.append(
+            (
+                i,
+                athlete_page(
+                    [
+                        SyntheticMatch(i * 10, f"Opponent {i % 7}", None),
+                        SyntheticMatch(i * 10 + 1, f"Linked {i % 5}", f"/?p={i % 5}"),
+                        SyntheticMatch(i * 10 + 2, f"Linked {i}", f"/?p={i}"),
+                    ]
+                ),
+            )
+        )
+    serial = Scraper()
+    parallel = Scraper(parse_workers=2)
+    for scraper in (serial, parallel):
+        for i, html in pages:
+            scraper.scrape_queue.add((i, html))
+
+    run_pipeline(serial, set())
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        run_pipeline(parallel, set(), pool)
+
+    assert len(serial.matches) == 37 * 3 + 3
+    assert parallel.athletes == serial.athletes
+    assert parallel.matches == serial.matches
+    assert parallel.performances == serial.performances
+    assert parallel.url_search == serial.url_search
+    assert parallel.name_search == serial.name_search
+    assert parallel.download_queue == serial.download_queue
+    # the ids are handed out in the same order too, not just to the same athletes
+    assert list(parallel.athletes.rows()) == list(serial.athletes.rows())
+
+
+def test_pipelined_scrape_with_parse_workers(stand_in_site: StandInSite) -> None:
+    batch = Scraper()
+    batch.scrape()
+    pipelined = Scraper(pipelined=True, parse_workers=2, parser_backend="lxml")
+    pipelined.scrape()
+    assert pipelined.athletes == batch.athletes
+    assert pipelined.matches == batch.matches
+    assert pipelined.performances == batch.performances
+
+
+SYNTHETIC_ATHLETE_PAGES = {
+    "no matches": athlete_page([]),
+    "linked and unlinked opponents": athlete_page(
+        [
+            SyntheticMatch(1, "Gordon Ryan", "/?p=1"),
+            SyntheticMatch(2, "N/A", None, result="D", method="N/A"),
+            SyntheticMatch(3, "na", None, result="L", method="Pts: 2x0"),
+        ]
+    ),
+    "entities and nested tags": athlete_page(
+        [
+            SyntheticMatch(
+                4,
+                "Jo&atilde;o <b>Gon&ccedil;alves</b>",
+                "/?p=4&amp;lang=pt",
+                method="Choke &amp; <i>Armlock</i>",
+                competition="  Copa\n Podio ",
+                weight="",
+            ),
+            SyntheticMatch(5, "André Galvão", "/?p=5", stage="SF", year=""),
+        ]
+    ),
+}
+
+
+@pytest.mark.parametrize(  # type: ignore
+    "html",
+    [
+        read_fixture("athlete_0.html"),
+        read_fixture("athlete_1.html"),
+        *SYNTHETIC_ATHLETE_PAGES.values(),
+    ],
+    ids=["athlete_0", "athlete_1", *SYNTHETIC_ATHLETE_PAGES],
+)
+def test_parser_backends_agree_on_athlete_pages(html: str) -> None:
+    expected = PARSER_BACKENDS["bs4"].parse_athlete_page(html)
+    for name, backend in PARSER_BACKENDS.items():
+        assert backend.parse_athlete_page(html) == expected, name
+
+
+@pytest.mark.parametrize(  # type: ignore
+    "html",
+    [
+        read_fixture("athletes.html"),
+        athlete_list(
+            [
+                SyntheticAthlete("Gordon", "Ryan", "The King", "/?p=1"),
+                SyntheticAthlete("Jo&atilde;o", " Miyao", "", "/?p=2"),
+                SyntheticAthlete("Marcus", "Almeida", "<b>Buchecha</b>", "/?p=3"),
+            ]
+        ),
+    ],
+    ids=["athletes", "synthetic"],
+)
+def test_parser_backends_agree_on_athlete_lists(html: str) -> None:
+    expected = PARSER_BACKENDS["bs4"].parse_athlete_list(html)
+    assert expected
+    for name, backend in PARSER_BACKENDS.items():
+        assert backend.parse_athlete_list(html) == expected, name
+
+
+def test_unknown_parser_backend() -> None:
+    with pytest.raises(ValueError):
+        Scraper(parser_backend="regex")
+
+
+class Deadline:
+    """
+    stands in for the lambda context's get_remaining_time_in_millis,
+    the time runs out once the scraper has found `athletes` athletes
+    """
+
+    def __init__(self, scraper: Scraper, athletes: int) -> None:
+        self.scraper = scraper
+        self.athletes = athletes
+
+    def __call__(self) -> int:
+        return 0 if len(self.scraper.athletes) >= self.athletes else 10**9
+
+
+@pytest.mark.parametrize("pipelined", [False, True])  # type: ignore
+@pytest.mark.parametrize("stop_after", [2, 5])  # type: ignore
+def test_checkpoint_and_resume(
+    stand_in_site: StandInSite, tmp_path: str, pipelined: bool, stop_after: int
+) -> None:
+    """
+    a scrape that runs out of time and is resumed from its checkpoint should end
+    up with exactly the same records as a scrape that ran in one go
+    """
+    expected = Scraper()
+    expected.scrape()
+
+    first = Scraper(pipelined=pipelined)
+    first.time_remaining = Deadline(first, stop_after)
+    first.scrape()
+    assert not first.finished
+    checkpoint = os.path.join(tmp_path, "checkpoint.json.gz")
+    first.save_checkpoint(checkpoint)
+
+    resumed = Scraper(pipelined=pipelined, time_remaining=lambda: 10**9)
+    resumed.resume_from_checkpoint(checkpoint)
+    resumed.continue_scrape()
+    assert resumed.finished
+    assert resumed.athletes == expected.athletes
+    assert resumed.matches == expected.matches
+    assert resumed.performances == expected.performances
+    assert resumed.url_search == expected.url_search
+    assert resumed.name_search == expected.name_search
+
+
+def test_unscraped_pages_are_requeued_for_the_checkpoint() -> None:
+    scraper = Scraper(time_remaining=lambda: 0)
+    scraper.add_athlete(extract.Athlete(1, "Aaron Johnson", "Tex", "url1"))
+    scraper.download_queue.clear()
+    scraper.scrape_queue.add((1, read_fixture("athlete_1.html")))
+    run_pipeline(scraper)
+    assert not scraper.matches
+    assert len(scraper.scrape_queue) == 1
+
+    restored = Scraper()
+    scraper.requeue_unscraped_pages()
+    restored.load_checkpoint(scraper.to_checkpoint())
+    assert restored.download_queue == {(1, "url1")}
+    assert restored.athletes == scraper.athletes
+
+
+def test_adaptive_limiter_backs_off_and_ramps_up() -> None:
+    limiter = AdaptiveLimiter(max_limit=16)
+    assert limiter.concurrency == 16
+    started_at = time.monotonic()
+    # a burst of failures from the same window only cuts the limit once
+    for _ in range(5):
+        limiter.on_throttle(started_at)
+    assert limiter.concurrency == 8
+    limiter.on_throttle(time.monotonic())
+    assert limiter.concurrency == 4
+    for _ in range(10):
+        limiter.on_success()
+    assert 4 < limiter.concurrency < 16
+    for _ in range(1000):
+        limiter.on_success()
+    assert limiter.concurrency == 16
+
+
+def test_downloads_are_retried_and_failures_reported() -> None:
+    html = read_fixture("athlete_0.html")
+    pages = {str(p): html for p in range(10)}
+    failures = {"1": [429, 503], "2": [500, 500, 500, 500, 500]}
+    with StandInSite(pages, failures=failures, delays={"3": 2.0}) as site:
+        scraper = Scraper(
+            max_retries=3,
+            retry_backoff=0.01,
+            request_timeout=0.5,
+            metrics=ScrapeMetrics(),
+        )
+        download_all(scraper, {p: f"{site.url}/?p={p}" for p in range(10)})
+        report = scraper.failure_report()
+
+    # the page that failed twice made it, the one that kept failing or timing out didn't
+    assert scraper.metrics.counters["pages_fetched"] == 8
+    assert report["failed_downloads"] == 2
+    assert report["failures"] == {
+        f"{site.url}/?p=2": "status 500",
+        f"{site.url}/?p=3": "TimeoutError()",
+    }
+    assert failures == {"1": [], "2": [500]}
+
+
+def test_undecodable_page_fails_without_stopping_the_crawl() -> None:
+    """
+    a page whose bytes don't match the charset it was sent with goes in the failed
+    downloads, without being retried, and the other pages are still scraped
+    """
+    html = read_fixture("athlete_0.html")
+    pages = {str(p): html for p in range(5)}
+    pages["0"] = html + "Jos\u00e9"
+    with StandInSite(pages, charsets={"0": "ascii"}) as site:
+        scraper = Scraper(max_retries=3, retry_backoff=0.01, metrics=ScrapeMetrics())
+        download_all(scraper, {p: f"{site.url}/?p={p}" for p in range(5)})
+        requests = site.requests
+
+    assert list(scraper.failed_downloads) == [f"{site.url}/?p=0"]
+    assert scraper.failed_downloads[f"{site.url}/?p=0"].startswith("UnicodeDecodeError")
+    assert requests.count("/?p=0") == 1
+    assert scraper.metrics.counters["pages_scraped"] == 4
+    assert scraper.metrics.counters["download_failures"] == 1
+
+
+def test_concurrency_backs_off_when_throttled() -> None:
+    html = read_fixture("athlete_1.html")
+    pages = {str(p): html for p in range(60)}
+    delays = {str(p): 0.02 for p in range(60)}
+    with StandInSite(pages, delays=delays, throttle_above=4) as site:
+        scraper = Scraper(
+            max_concurrency=20,
+            max_retries=8,
+            retry_backoff=0.01,
+            metrics=ScrapeMetrics(),
+        )
+        download_all(scraper, {p: f"{site.url}/?p={p}" for p in range(60)})
+        statuses = site.statuses
+
+    assert scraper.metrics.counters["pages_fetched"] == 60
+    assert not scraper.failed_downloads
+    assert 429 in statuses
+    assert scraper.limiter.concurrency < 20
+
+
+def test_record_tables() -> None:
+    """
+    the record tables only keep the first record for each key and give back the
+    same records, rows, and dataframes that they were given
+    """
+    matches = MatchTable()
+    assert matches.add(Match(1, "2019", "ADCC", "Armbar", "F", "77KG"))
+    assert matches.add(Match(2, "2019", "ADCC", "Points", "SF", "77KG"))
+    # a match seen again from the opponent's page is ignored
+    assert not matches.add(Match(1, "2019", "ADCC", "Armbar", "F", "77KG"))
+    assert len(matches) == 2
+    assert Match(2, "2019", "ADCC", "Points", "SF", "77KG") in matches
+    assert list(matches) == [
+        Match(1, "2019", "ADCC", "Armbar", "F", "77KG"),
+        Match(2, "2019", "ADCC", "Points", "SF", "77KG"),
+    ]
+    # the repeated strings are only stored once
+    assert matches.columns["competition"].values == ["ADCC"]  # type: ignore
+
+    performances = PerformanceTable()
+    assert performances.add(Performance(1, 7, "W"))
+    assert performances.add(Performance(1, 8, "L"))
+    assert not performances.add(Performance(1, 7, "W"))
+    # nor is a different result for the same athlete, the database only takes one
+    assert Performance(1, 7, "L") in performances
+    assert not performances.add(Performance(1, 7, "L"))
+    assert Performance(2, 7, "W") not in performances
+    assert list(performances.rows()) == [(1, 7, "W"), (1, 8, "L")]
+
+    athletes = AthleteTable()
+    athletes.add(Athlete(1, "Gordon Ryan", "King", "https://www.bjjheroes.com/?p=1"))
+    athletes.add(Athlete(2, "Jos\u00e9 Aldo", "", ""))
+    df = athletes.to_dataframe()
+    assert list(df.columns) == ["id", "name", "nickname", "url"]
+    assert df.to_dict("records") == [
+        {
+            "id": 1,
+            "name": "Gordon Ryan",
+            "nickname": "King",
+            "url": "https://www.bjjheroes.com/?p=1",
+        },
+        {"id": 2, "name": "Jos\u00e9 Aldo", "nickname": "", "url": ""},
+    ]
+    # tables are equal when they hold the same records, whatever the order
+    reordered = AthleteTable()
+    for athlete in reversed(list(athletes)):
+        reordered.add(athlete)
+    assert reordered == athletes
+
+
+def test_page_queue_backpressure_and_spill(tmp_path: str) -> None:
+    """
+    a full queue makes put wait for a pop, unless it can spill the pages to disk
+    """
+
+    async def fill() -> List[str]:
+        queue = PageQueue(max_pages=2)
+        events = []
+
+        async def producer() -> None:
+            for i in range(4):
+                await queue.put(i, f"page {i}")
+                events.append(f"put {i}")
+
+        task = asyncio.create_task(producer())
+        await asyncio.sleep(0.01)
+        # the producer is stuck until a page is popped
+        assert events == ["put 0", "put 1"]
+        events.append(f"pop {queue.pop()[0]}")
+        await asyncio.sleep(0.01)
+        events.append(f"pop {queue.pop()[0]}")
+        await task
+        return events
+
+    assert asyncio.run(fill()) == ["put 0", "put 1", "pop 0", "put 2", "pop 1", "put 3"]
+
+    queue = PageQueue(max_pages=2, spill_dir=str(tmp_path))
+    for i in range(5):
+        asyncio.run(queue.put(i, f"page {i}"))
+    assert (queue.in_memory, queue.spilled) == (2, 3)
+    assert len(os.listdir(tmp_path)) == 3
+    assert list(queue) == [(i, f"page {i}") for i in range(5)]
+    assert [queue.pop() for _ in range(3)] == [(i, f"page {i}") for i in range(3)]
+    queue.clear()
+    assert not queue
+    assert os.listdir(tmp_path) == []
+
+    # a queue with no room would keep put waiting forever
+    with pytest.raises(ValueError):
+        PageQueue(max_pages=0)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])  # type: ignore
+def test_small_scrape_queue_scrapes_the_same(
+    stand_in_site: StandInSite, tmp_path: str, pipelined: bool
+) -> None:
+    expected = Scraper(pipelined=pipelined)
+    expected.scrape()
+    for spill_dir in [None, str(tmp_path)]:
+        scraper = Scraper(pipelined=pipelined, max_queued_pages=1, spill_dir=spill_dir)
+        scraper.scrape()
+        assert scraper.athletes == expected.athletes
+        assert scraper.matches == expected.matches
+        assert scraper.performances == expected.performances
+        assert not scraper.scrape_queue
+    assert os.listdir(tmp_path) == []
+
+
+def crawl_peak_memory(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: str, max_queued_pages: int
+) -> int:
+    """
+    crawls a synthetic site of 150 athlete pages of about 200 KB each under memray,
+    with a parser that is slower than the downloads so that the scrape queue fills up
+    :return: the peak bytes allocated during the crawl
+    """
+    memray = pytest.importorskip("memray")
+    athletes = [
+        SyntheticAthlete(f"First{i}", f"Last{i}", "", f"/?p={i}") for i in range(150)
+    ]
+    padding = f"<!-- {'x' * 200_000} -->"
+    pages = {
+        str(i): athlete_page(
+            [SyntheticMatch(i, f"First{(i + 1) % 150}", f"/?p={(i + 1) % 150}")]
+        ).replace("</body>", f"{padding}</body>")
+        for i in range(150)
+    }
+    parse_athlete_page = extract.parse_athlete_page
+
+    def slow_parse_athlete_page(html: str, backend: str = "bs4") -> Any:
+        time.sleep(0.01)
+        return parse_athlete_page(html, backend)
+
+    monkeypatch.setattr(extract, "parse_athlete_page", slow_parse_athlete_page)
+    with StandInSite(pages, athlete_list=athlete_list(athletes)) as site:
+        monkeypatch.setattr(extract, "SOURCE_HOSTNAME", site.url)
+        scraper = Scraper(
+            max_queued_pages=max_queued_pages, max_concurrency=5, parser_backend="lxml"
+        )
+        output = os.path.join(tmp_path, f"crawl-{max_queued_pages}.bin")
+        with memray.Tracker(output):
+            scraper.scrape()
+    assert len(scraper.athletes) == 150
+    return int(memray.FileReader(output).metadata.peak_memory)
+
+
+def test_bounded_scrape_queue_memory_ceiling(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: str
+) -> None:
+    """
+    with a small scrape queue the crawl only holds a few pages at once, while
+    without one the pages pile up in the queue waiting for the slow parser
+    """
+    bounded = crawl_peak_memory(monkeypatch, tmp_path, max_queued_pages=10)
+    unbounded = crawl_peak_memory(monkeypatch, tmp_path, max_queued_pages=10**6)
+    assert bounded < 16 * 1024**2
+    assert unbounded > 24 * 1024**2
+
+
+@pytest.mark.parametrize("pipelined", [False, True])  # type: ignore
+def test_replay_from_archive_without_the_site(
+    stand_in_site: StandInSite,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: str,
+    pipelined: bool,
+) -> None:
+    path = os.path.join(tmp_path, "scrape.zip")
+    with PageArchive(path, "w") as archive:
+        recorded = Scraper(pipelined=pipelined, record_to=archive)
+        recorded.scrape()
+    with PageArchive(path) as archive:
+        # the list and the three athlete pages
+        assert len(archive) == 4
+        assert f"{stand_in_site.url}/?p=9246" in archive
+        # nothing is listening here, so any request would fail
+        monkeypatch.setattr(extract, "SOURCE_HOSTNAME", "http://127.0.0.1:9")
+        replayed = Scraper(pipelined=pipelined, replay_from=archive)
+        replayed.scrape()
+    # the athlete urls are on the new host, but otherwise the scrape is the same
+    assert {
+        (a.id, a.name, a.nickname, PageArchive.key(a.url)) for a in replayed.athletes
+    } == {(a.id, a.name, a.nickname, PageArchive.key(a.url)) for a in recorded.athletes}
+    assert replayed.matches == recorded.matches
+    assert replayed.performances == recorded.performances
+    assert not replayed.failed_downloads
+
+
+def test_replay_reports_pages_missing_from_the_archive(tmp_path: str) -> None:
+    path = os.path.join(tmp_path, "scrape.zip")
+    with PageArchive(path, "w") as archive:
+        archive.put("https://www.bjjheroes.com/?p=1", read_fixture("athlete_1.html"))
+    with PageArchive(path) as archive:
+        scraper = Scraper(replay_from=archive)
+        scraper.download_queue = {
+            (1, "http://localhost/?p=1"),
+            (2, "http://localhost/?p=2"),
+        }
+        scraper.continue_scrape()
+    assert len(scraper.matches) == 3
+    # the opponent found on the page wasn't recorded either
+    assert scraper.failed_downloads == {
+        "http://localhost/?p=2": "not in the archive",
+        "https://www.bjjheroes.com/?p=6531": "not in the archive",
+    }
+
+
+@pytest.mark.parametrize("pipelined", [False, True])  # type: ignore
+def test_crawl_generated_site(monkeypatch: pytest.MonkeyPatch, pipelined: bool) -> None:
+    site = generate_site(60, matches_per_athlete=8, opponent_overlap=0.5)
+    unlinked = {
+        match.opponent_name
+        for page in site.pages.values()
+        for match in PARSER_BACKENDS["lxml"].parse_athlete_page(page)
+        if match.opponent_href is None
+    }
+    with StandInSite(site.pages, athlete_list=site.athlete_list, latency=0.005) as s:
+        monkeypatch.setattr(extract, "SOURCE_HOSTNAME", s.url)
+        scraper = Scraper(pipelined=pipelined, max_concurrency=10)
+        scraper.scrape()
+        requested = len(s.requests)
+    # every page is downloaded once, along with the list
+    assert requested == 61
+    assert len(scraper.athletes) == 60 + len(unlinked)
+    assert len(scraper.matches) == site.num_matches
+    # both sides of every match have a performance
+    assert len(scraper.performances) == 2 * site.num_matches
+
+
+@pytest.mark.parametrize("pipelined", [False, True])  # type: ignore
+def test_parquet_output_streams_row_groups(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: str, pipelined: bool
+) -> None:
+    """
+    the records are written as row groups while the pages are scraped, and the
+    files come out typed with the repeated strings dictionary encoded
+    """
+    site = generate_site(40, matches_per_athlete=6)
+    output = ParquetOutput(str(tmp_path), compression="gzip", row_group_size=25)
+    row_groups_during_scrape = []
+
+    with StandInSite(site.pages, athlete_list=site.athlete_list) as s:
+        monkeypatch.setattr(extract, "SOURCE_HOSTNAME", s.url)
+        scraper = Scraper(pipelined=pipelined, parquet_output=output)
+        write = output.write
+
+        def count_row_groups(*args: Any, **kwargs: Any) -> None:
+            write(*args, **kwargs)
+            row_groups_during_scrape.append(dict(output.written))
+
+        monkeypatch.setattr(output, "write", count_row_groups)
+        scraper.scrape()
+    output.close(scraper.tables)
+
+    # the match rows were written out long before the scrape finished
+    assert row_groups_during_scrape[len(row_groups_during_scrape) // 2]["match"] > 0
+    for name, table in scraper.tables.items():
+        path = os.path.join(tmp_path, f"{name}.parquet")
+        metadata = pq.ParquetFile(path).metadata
+        assert metadata.num_row_groups == -(-len(table) // 25)
+        written = pq.read_table(path)
+        assert written.schema == table.arrow_schema
+        assert written.num_rows == len(table)
+        for i, field in enumerate(written.schema):
+            column = metadata.row_group(0).column(i)
+            assert column.compression == "GZIP"
+            if field.name in table.dictionary_columns:
+                assert "RLE_DICTIONARY" in column.encodings
+    matches = pq.read_table(os.path.join(tmp_path, "match.parquet"))
+    assert matches.schema.field("year").type == pa.int16()
+    assert set(matches.to_pydict()["year"]) <= set(range(1996, 2025))
+    # the rows are the same as the ones in the tables
+    performances = pq.read_table(os.path.join(tmp_path, "performance.parquet"))
+    assert set(zip(*performances.to_pydict().values())) == set(
+        scraper.performances.rows()
+    )
+    athletes = pq.read_table(os.path.join(tmp_path, "athlete.parquet"))
+    assert list(zip(*athletes.to_pydict().values())) == list(scraper.athletes.rows())
+
+
+def test_write_parquet_years_and_empty_tables(tmp_path: str) -> None:
+    scraper = Scraper()
+    scraper.matches.add(Match(1, "2019", "ADCC", "Armbar", "F", "77KG"))
+    scraper.matches.add(Match(2, "", "ADCC", "Points", "SF", "77KG"))
+    scraper.write_parquet(str(tmp_path), compression="none")
+    matches = pq.read_table(os.path.join(tmp_path, "match.parquet")).to_pydict()
+    assert matches["year"] == [2019, None]
+    assert pq.read_table(os.path.join(tmp_path, "athlete.parquet")).num_rows == 0
+
+
+def athlete_keys(scraper: Scraper) -> Dict[int, str]:
+    """
+    the url of each athlete by id, or the name for the athletes without a page,
+    so that two crawls can be compared whatever ids they gave the athletes
+    """
+    return {a.id: a.url or a.name for a in scraper.athletes}
+
+
+@pytest.mark.parametrize("num_shards", [1, 3])  # type: ignore
+def test_sharded_crawl_matches_single_crawl(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: str, num_shards: int
+) -> None:
+    site = generate_site(80, matches_per_athlete=6)
+    with StandInSite(site.pages, athlete_list=site.athlete_list) as s:
+        monkeypatch.setattr(extract, "SOURCE_HOSTNAME", s.url)
+        single = Scraper(pipelined=True)
+        single.scrape()
+        metrics = ScrapeMetrics()
+        merged = scrape_sharded(
+            num_shards, str(tmp_path), parser_backend="lxml", metrics=metrics
+        )
+        # every page was only downloaded by the shard that owns it
+        assert len(s.requests) == 2 * 81 + num_shards - 1
+
+    single_keys = athlete_keys(single)
+    merged_keys = athlete_keys(merged)
+    assert {(single_keys[a.id], a.name, a.nickname) for a in single.athletes} == {
+        (merged_keys[a.id], a.name, a.nickname) for a in merged.athletes
+    }
+    # the athletes from the list keep their ids
+    assert list(merged.athletes)[:80] == list(single.athletes)[:80]
+    assert merged.matches == single.matches
+    assert {(m, single_keys[a], r) for m, a, r in single.performances.rows()} == {
+        (m, merged_keys[a], r) for m, a, r in merged.performances.rows()
+    }
+    assert len(merged.performances) == 2 * site.num_matches
+    assert merged.finished
+    # the shards' metrics are added up
+    assert merged.metrics is metrics
+    assert metrics.counters["pages_scraped"] == 80
+    assert {t["shard"] for t in metrics.timings} == set(range(num_shards))
+    text = metrics.to_prometheus()
+    for shard in range(num_shards):
+        assert f'bjjstats_extract_stage_pages{{stage="parse",shard="{shard}"}}' in text
+
+
+def test_shard_coordinator_termination(tmp_path: str) -> None:
+    first, second = (ShardCoordinator(str(tmp_path), 2, shard) for shard in range(2))
+    assert not first.finished()
+    first.report(idle=True)
+    second.report(idle=False)
+    assert not first.finished()
+    second.send(0, [("https://www.bjjheroes.com/?p=1", "Gordon Ryan")])
+    second.report(idle=True)
+    # the athlete that was sent hasn't been received yet
+    assert not first.finished()
+    assert first.receive() == [("https://www.bjjheroes.com/?p=1", "Gordon Ryan")]
+    assert first.receive() == []
+    first.report(idle=True)
+    assert first.finished()
+    assert second.finished()
+
+
+def test_id_registry_keys() -> None:
+    registry = IdRegistry()
+    assert registry.athlete_id(url="https://www.bjjheroes.com/?p=9246") == 1
+    # the host and a trailing slash don't matter
+    assert registry.athlete_id(url="http://localhost:8080/?p=9246") == 1
+    assert registry.athlete_id(url="https://www.bjjheroes.com/a-z/") == 2
+    assert registry.athlete_id(url="https://www.bjjheroes.com/a-z") == 2
+    assert registry.athlete_id(name="John  Doe") == 3
+    assert registry.athlete_id(name="john doe") == 3
+    restored = IdRegistry.from_json(registry.to_json())
+    assert restored.athlete_id(name="JOHN DOE") == 3
+    assert restored.athlete_id(name="Jane Doe") == 4
+
+
+def test_ids_are_stable_across_scrapes(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: str
+) -> None:
+    """
+    the next month's scrape finds the athletes in a different order, and there is
+    a new athlete at the top of the a-z list, but everyone keeps their id
+    """
+    registry_path = os.path.join(tmp_path, "id_registry.json")
+    site = generate_site(40, matches_per_athlete=6)
+    with StandInSite(site.pages, athlete_list=site.athlete_list) as s:
+        monkeypatch.setattr(extract, "SOURCE_HOSTNAME", s.url)
+        first = Scraper(pipelined=True, id_registry=IdRegistry.load(registry_path))
+        first.scrape()
+    first.id_registry.save(registry_path)
+
+    newcomer = SyntheticAthlete("Helena", "Crevar", "", "/?p=new")
+    opponent = site.athletes[5]
+    pages = dict(site.pages)
+    pages["new"] = athlete_page(
+        [
+            SyntheticMatch(
+                10_000, f"{opponent.first_name} {opponent.last_name}", opponent.href
+            ),
+            SyntheticMatch(10_001, "Someone New", None),
+        ]
+    )
+    listed = [newcomer] + list(reversed(site.athletes))
+    with StandInSite(pages, athlete_list=athlete_list(listed)) as s:
+        monkeypatch.setattr(extract, "SOURCE_HOSTNAME", s.url)
+        second = Scraper(id_registry=IdRegistry.load(registry_path))
+        second.scrape()
+
+    def ids(scraper: Scraper) -> Dict[str, int]:
+        return {
+            IdRegistry.url_key(a.url) if a.url else a.name: a.id
+            for a in scraper.athletes
+        }
+
+    first_ids = ids(first)
+    second_ids = ids(second)
+    assert len(second_ids) == len(first_ids) + 2
+    for athlete_key, athlete_id in first_ids.items():
+        assert second_ids[athlete_key] == athlete_id
+    new_ids = {second_ids["url:/?p=new"], second_ids["Someone New"]}
+    assert min(new_ids) > max(first_ids.values())
+
+
+def test_delta_between_snapshots(tmp_path: str) -> None:
+    previous = os.path.join(tmp_path, "2024-01-01")
+    current = os.path.join(tmp_path, "2024-02-01")
+    old = Scraper()
+    old.athletes.add(Athlete(1, "Gordon Ryan", "", "https://www.bjjheroes.com/?p=1"))
+    old.athletes.add(Athlete(2, "Andre Galvao", "", "https://www.bjjheroes.com/?p=2"))
+    old.athletes.add(Athlete(3, "Retired Guy", "", ""))
+    old.matches.add(Match(10, "2019", "ADCC", "Armbar", "F", "ABS"))
+    old.performances.add(Performance(10, 1, "W"))
+    old.performances.add(Performance(10, 2, "L"))
+    old.write_parquet(previous)
+
+    new = Scraper()
+    # gordon got a nickname, andre is unchanged, the retired guy is gone
+    new.athletes.add(
+        Athlete(1, "Gordon Ryan", "King", "https://www.bjjheroes.com/?p=1")
+    )
+    new.athletes.add(Athlete(2, "Andre Galvao", "", "https://www.bjjheroes.com/?p=2"))
+    new.athletes.add(Athlete(4, "Nicky Rod", "", "https://www.bjjheroes.com/?p=4"))
+    new.matches.add(Match(10, "2019", "ADCC", "Armbar", "F", "ABS"))
+    new.matches.add(Match(11, "", "WNO", "Points", "F", "ABS"))
+    new.performances.add(Performance(10, 1, "W"))
+    new.performances.add(Performance(10, 2, "L"))
+    new.performances.add(Performance(11, 1, "W"))
+    new.performances.add(Performance(11, 4, "L"))
+    new.write_parquet(current)
+
+    summary = compute_delta(previous, current)
+    assert summary["tables"] == {
+        "athlete": {"inserted": 1, "updated": 1, "deleted": 1, "total": 3},
+        "match": {"inserted": 1, "updated": 0, "deleted": 0, "total": 2},
+        "performance": {"inserted": 2, "updated": 0, "deleted": 0, "total": 4},
+    }
+    delta = os.path.join(current, "delta")
+    with open(os.path.join(delta, "summary.json")) as f:
+        assert json.load(f) == summary
+
+    def rows(table: str, change: str) -> List[Dict[str, Any]]:
+        path = os.path.join(delta, table, f"{change}.parquet")
+        rows: List[Dict[str, Any]] = pq.read_table(path).to_pylist()
+        return rows
+
+    assert rows("athlete", "updated") == [
+        {
+            "id": 1,
+            "name": "Gordon Ryan",
+            "nickname": "King",
+            "url": "https://www.bjjheroes.com/?p=1",
+        }
+    ]
+    assert rows("athlete", "deleted") == [
+        {"id": 3, "name": "Retired Guy", "nickname": "", "url": ""}
+    ]
+    assert rows("match", "inserted") == [
+        {
+            "id": 11,
+            "year": None,
+            "competition": "WNO",
+            "method": "Points",
+            "stage": "F",
+            "weight": "ABS",
+        }
+    ]
+    assert pq.read_table(os.path.join(delta, "match", "inserted.parquet")).schema == (
+        MatchTable.arrow_schema
+    )
+
+    # the delta folder inside the current snapshot isn't mistaken for a snapshot
+    os.makedirs(os.path.join(tmp_path, "2024-03-01"))
+    assert previous_snapshot(str(tmp_path), "2024-03-01") == f"{tmp_path}/2024-02-01"
+    assert previous_snapshot(str(tmp_path), "2024-02-01") == f"{tmp_path}/2024-01-01"
+    assert previous_snapshot(str(tmp_path), "2024-01-01") is None
+
+
+def test_delta_reads_old_string_typed_snapshots(tmp_path: str) -> None:
+    """
+    the snapshots from before the typed parquet output have years as strings
+    and every column as objects, they still compare equal to the same rows
+    """
+    previous = os.path.join(tmp_path, "old")
+    current = os.path.join(tmp_path, "new")
+    scraper = Scraper()
+    scraper.athletes.add(
+        Athlete(1, "Gordon Ryan", "", "https://www.bjjheroes.com/?p=1")
+    )
+    scraper.matches.add(Match(10, "2019", "ADCC", "Armbar", "F", "ABS"))
+    scraper.performances.add(Performance(10, 1, "W"))
+    scraper.write_parquet(current)
+    os.makedirs(previous)
+    for name, table in scraper.tables.items():
+        table.to_dataframe().to_parquet(os.path.join(previous, f"{name}.parquet"))
+    summary = compute_delta(previous, current)
+    for counts in summary["tables"].values():
+        assert (counts["inserted"], counts["updated"], counts["deleted"]) == (0, 0, 0)
+
+
+def test_histogram_buckets() -> None:
+    histogram = Histogram((0.1, 1.0))
+    for value in [0.05, 0.1, 0.5, 2.0]:
+        histogram.observe(value)
+    # the buckets count everything at or below their bound
+    assert histogram.cumulative() == [("0.1", 2), ("1.0", 3), ("+Inf", 4)]
+    assert (histogram.count, histogram.sum) == (4, 2.65)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])  # type: ignore
+def test_scrape_metrics(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: str, pipelined: bool
+) -> None:
+    site = generate_site(40, matches_per_athlete=5)
+    pushed = os.path.join(tmp_path, "pushed.jsonl")
+    metrics = ScrapeMetrics(push_to=pushed, push_interval=0.02)
+    with StandInSite(
+        site.pages, athlete_list=site.athlete_list, failures={"3": [503]}, latency=0.02
+    ) as s:
+        monkeypatch.setattr(extract, "SOURCE_HOSTNAME", s.url)
+        scraper = Scraper(
+            pipelined=pipelined, max_concurrency=5, retry_backoff=0.01, metrics=metrics
+        )
+        scraper.scrape()
+
+    assert metrics.counters == {
+        "pages_fetched": 40,
+        "bytes_downloaded": sum(len(page.encode()) for page in site.pages.values()),
+        "download_retries": 1,
+        "pages_scraped": 40,
+    }
+    # the failed attempt took time too
+    assert metrics.histograms["download_seconds"].count == 41
+    assert metrics.histograms["parse_seconds"].count == 40
+    assert metrics.gauges["scrape_queue_in_memory"] >= 0
+    stages = [timing["stage"] for timing in metrics.timings]
+    assert stages[0] == "athlete_list" and stages[-1] == "crawl"
+    assert ("pipeline" in stages) == pipelined
+    assert ("iteration" in stages) != pipelined
+    # the crawl times the downloads and the parsing, each of them once per pipeline
+    for stage in ("download", "parse"):
+        timings = [timing for timing in metrics.timings if timing["stage"] == stage]
+        assert sum(timing["pages"] for timing in timings) == 40
+        assert 0 < sum(timing["seconds"] for timing in timings)
+
+    lines = [json.loads(line) for line in metrics.to_json_lines().splitlines()]
+    assert {"type": "counter", "name": "pages_scraped", "value": 40} in [
+        {key: line[key] for key in ("type", "name", "value")}
+        for line in lines
+        if line["type"] == "counter"
+    ]
+    text = metrics.to_prometheus()
+    assert "bjjstats_extract_pages_fetched_total 40\n" in text
+    assert 'bjjstats_extract_download_seconds_bucket{le="+Inf"} 41\n' in text
+    assert '{stage="athlete_list"}' in text
+    assert 'bjjstats_extract_stage_pages{stage="parse"} 40\n' in text
+    assert "iteration=" not in text and "pages=" not in text
+    path = os.path.join(tmp_path, "metrics.prom")
+    metrics.write(path)
+    with open(path) as f:
+        assert f.read() == text
+
+    # the metrics were pushed while the crawl ran, and once more at the end
+    with open(pushed) as f:
+        pushes = {json.loads(line)["time"] for line in f}
+    assert len(pushes) >= 2
+
+
+def test_disabled_metrics_record_nothing(stand_in_site: StandInSite) -> None:
+    scraper = Scraper()
+    scraper.scrape()
+    assert not scraper.metrics.enabled
+    assert scraper.metrics.to_json_lines() == ""
+    assert scraper.metrics.to_prometheus() == ""
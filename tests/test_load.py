@@ -0,0 +1,367 @@
+import gc
+import os
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa  # type: ignore
+import pyarrow.pandas_compat  # type: ignore
+import pytest
+import sqlalchemy as sa
+from alembic import command  # type: ignore
+from alembic.config import Config
+
+from pipeline.load.load import (
+    LOAD_MODES,
+    ChunkReader,
+    SharedChunks,
+    as_chunks,
+    csv_chunks,
+    load_shadow_tables,
+    merge_data,
+    swap_shadow_tables,
+    upload_data,
+    upload_from_directory,
+)
+
+
+@pytest.fixture  # type: ignore
+def engine(monkeypatch: pytest.MonkeyPatch, tmp_path: str) -> Iterator[sa.Engine]:
+    """
+    a sqlite database migrated to the latest schema
+    """
+    url = f"sqlite:///{os.path.join(tmp_path, 'test.db')}"
+    monkeypatch.setenv("DB_URL", url)
+    command.upgrade(Config("alembic.ini"), "head")
+    engine = sa.create_engine(url)
+    yield engine
+    engine.dispose()
+
+
+def make_frames(num_athletes: int = 5) -> Dict[str, pd.DataFrame]:
+    athlete_df = pd.DataFrame(
+        {
+            "id": range(1, num_athletes + 1),
+            "name": [f"athlete {i}" for i in range(1, num_athletes + 1)],
+            # the empty nicknames stay empty strings, the missing ones are null
+            "nickname": ["", None] + ["nick"] * (num_athletes - 2),
+            "url": [f"https://www.bjjheroes.com/?p={i}" for i in range(num_athletes)],
+        }
+    )
+    match_df = pd.DataFrame(
+        {
+            "id": [10, 11, 12],
+            # a missing year makes the column floats, like a csv read by pandas
+            "year": [2019.0, np.nan, 2021.0],
+            "competition": ["ADCC", "Worlds, Gi", 'the "pans"'],
+            "method": ["Armbar", "Pts: 2x0", "RNC"],
+            "stage": ["F", "SF", "R1"],
+            "weight": ["ABS", "77KG", "88KG"],
+        }
+    )
+    performance_df = pd.DataFrame(
+        {
+            "match_id": [10, 10, 11, 11, 12],
+            "athlete_id": [1, 2, 2, 3, 4],
+            "result": ["W", "L", "D", "D", "W"],
+        }
+    )
+    return {"athlete": athlete_df, "match": match_df, "performance": performance_df}
+
+
+def read_table(engine: sa.Engine, name: str, order_by: str) -> List[sa.Row[Any]]:
+    with engine.connect() as con:
+        return list(con.execute(sa.text(f"SELECT * FROM {name} ORDER BY {order_by}")))
+
+
+def test_unique_performance_migration_drops_duplicates(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: str
+) -> None:
+    url = f"sqlite:///{os.path.join(tmp_path, 'test.db')}"
+    monkeypatch.setenv("DB_URL", url)
+    command.upgrade(Config("alembic.ini"), "41d5099e1549")
+    engine = sa.create_engine(url)
+    with engine.begin() as con:
+        con.execute(sa.text("INSERT INTO athlete (id, name) VALUES (1, 'a'), (2, 'b')"))
+        con.execute(sa.text("INSERT INTO match (id) VALUES (10)"))
+        con.execute(
+            sa.text(
+                "INSERT INTO performance (match_id, athlete_id, result) VALUES"
+                " (10, 1, 'W'), (10, 2, 'L'), (10, 1, 'L'), (10, 1, 'W')"
+            )
+        )
+    command.upgrade(Config("alembic.ini"), "8107566f53d5")
+    # the first performance of each athlete in a match is the one that's kept
+    with engine.connect() as con:
+        rows = con.execute(
+            sa.text(
+                "SELECT match_id, athlete_id, result FROM performance"
+                " ORDER BY athlete_id"
+            )
+        )
+        assert list(rows) == [(10, 1, "W"), (10, 2, "L")]
+    engine.dispose()
+
+
+def test_bulk_load_round_trips_the_rows(engine: sa.Engine) -> None:
+    frames = make_frames()
+    for _ in range(2):
+        # the second load replaces the first, in chunks smaller than the tables
+        upload_data(
+            frames["athlete"],
+            frames["performance"],
+            frames["match"],
+            engine,
+            chunksize=2,
+        )
+    athletes = read_table(engine, "athlete", "id")
+    assert [(a.id, a.nickname) for a in athletes[:3]] == [
+        (1, ""),
+        (2, None),
+        (3, "nick"),
+    ]
+    assert len(athletes) == 5
+    matches = read_table(engine, "match", "id")
+    assert [(m.id, m.year, m.competition) for m in matches] == [
+        (10, 2019, "ADCC"),
+        (11, None, "Worlds, Gi"),
+        (12, 2021, 'the "pans"'),
+    ]
+    performances = read_table(engine, "performance", "match_id, athlete_id")
+    assert [(p.match_id, p.athlete_id, p.result) for p in performances] == list(
+        frames["performance"].itertuples(index=False, name=None)
+    )
+
+
+def test_replace_load_rebuilds_the_indexes(engine: sa.Engine) -> None:
+    query = "SELECT name, sql FROM sqlite_master WHERE type = 'index' ORDER BY name"
+    with engine.connect() as con:
+        before = con.execute(sa.text(query)).all()
+    frames = make_frames()
+    upload_data(frames["athlete"], frames["performance"], frames["match"], engine)
+    with engine.connect() as con:
+        assert con.execute(sa.text(query)).all() == before
+        # the tables were analyzed once the indexes were built
+        analyzed = con.execute(sa.text("SELECT idx FROM sqlite_stat1")).scalars().all()
+    assert {"match_finish_id", "performance_athlete_id_result"} <= set(analyzed)
+
+
+def test_copy_csv_chunks() -> None:
+    df = make_frames()["athlete"]
+    chunks = list(csv_chunks(as_chunks(df, chunksize=2)))
+    assert len(chunks) == 3
+    # the empty string and the null are written differently
+    assert chunks[0].decode().splitlines() == [
+        "1,athlete 1,,https://www.bjjheroes.com/?p=0",
+        "2,athlete 2,\\N,https://www.bjjheroes.com/?p=1",
+    ]
+    reader = ChunkReader(iter(chunks))
+    read = b""
+    while data := reader.read(7):
+        read += data
+        # what was read is dropped, the reader never holds much more than a chunk
+        assert len(reader.buffer) < max(map(len, chunks)) + 7
+    assert read == b"".join(chunks)
+    reader = ChunkReader(iter(chunks))
+    assert reader.read(len(chunks[0]) + 1) + reader.read() == b"".join(chunks)
+    assert reader.read() == b""
+
+    # arrow writes the nulls as nothing and quotes the empty strings instead
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    chunks = list(csv_chunks(as_chunks(table, chunksize=2)))
+    assert len(chunks) == 3
+    assert chunks[0].decode().splitlines() == [
+        '1,"athlete 1","","https://www.bjjheroes.com/?p=0"',
+        '2,"athlete 2",,"https://www.bjjheroes.com/?p=1"',
+    ]
+
+
+def test_shared_chunks_go_to_one_thread_each() -> None:
+    df = make_frames(num_athletes=100)["athlete"]
+    chunks = SharedChunks(as_chunks(df, chunksize=3))
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        taken = list(pool.map(lambda _: [list(c.id) for c in chunks], range(4)))
+    ids = sorted(i for worker in taken for chunk in worker for i in chunk)
+    assert ids == list(df.id)
+
+
+def test_incremental_load_only_writes_what_changed(engine: sa.Engine) -> None:
+    frames = make_frames()
+    upload_data(frames["athlete"], frames["performance"], frames["match"], engine)
+    before = {
+        (p.match_id, p.athlete_id): p.id
+        for p in read_table(engine, "performance", "id")
+    }
+
+    athlete_df = frames["athlete"][frames["athlete"].id != 5]
+    match_df = frames["match"].copy()
+    match_df.loc[match_df.id == 11, "competition"] = "Worlds"
+    match_df.loc[len(match_df)] = [13, 2024.0, "WNO", "RNC", "F", "ABS"]
+    performance_df = pd.concat(
+        [
+            frames["performance"][frames["performance"].match_id != 12],
+            pd.DataFrame({"match_id": [13], "athlete_id": [1], "result": ["W"]}),
+        ]
+    )
+    with engine.begin() as con:
+        counts = merge_data(
+            con,
+            {"athlete": athlete_df, "match": match_df, "performance": performance_df},
+        )
+    assert counts == {
+        "match": {"written": 2, "deleted": 0},
+        "athlete": {"written": 0, "deleted": 1},
+        "performance": {"written": 1, "deleted": 1},
+    }
+    matches = read_table(engine, "match", "id")
+    assert [(m.id, m.year, m.competition) for m in matches] == [
+        (10, 2019, "ADCC"),
+        (11, None, "Worlds"),
+        (12, 2021, 'the "pans"'),
+        (13, 2024, "WNO"),
+    ]
+    assert [a.id for a in read_table(engine, "athlete", "id")] == [1, 2, 3, 4]
+    performances = read_table(engine, "performance", "id")
+    assert [(p.match_id, p.athlete_id, p.result) for p in performances] == list(
+        performance_df.itertuples(index=False, name=None)
+    )
+    # the performances that were already there weren't written again
+    for p in performances[:-1]:
+        assert before[(p.match_id, p.athlete_id)] == p.id
+
+    # loading the same data again changes nothing
+    upload_data(athlete_df, performance_df, match_df, engine, mode="incremental")
+    with engine.begin() as con:
+        counts = merge_data(
+            con,
+            {"athlete": athlete_df, "match": match_df, "performance": performance_df},
+        )
+    assert all(c == {"written": 0, "deleted": 0} for c in counts.values())
+
+
+def test_unknown_load_mode(engine: sa.Engine) -> None:
+    frames = make_frames()
+    with pytest.raises(ValueError):
+        upload_data(
+            frames["athlete"], frames["performance"], frames["match"], engine, mode="x"
+        )
+
+
+def test_swap_load_replaces_the_tables_at_once(engine: sa.Engine) -> None:
+    frames = make_frames()
+    upload_data(frames["athlete"], frames["performance"], frames["match"], engine)
+    new_frames = make_frames(num_athletes=8)
+    new_frames["match"].loc[0, "competition"] = "WNO"
+    with engine.begin() as con:
+        load_shadow_tables(con, new_frames)
+    # the dashboards still see the old tables while the shadow tables are loaded
+    assert len(read_table(engine, "athlete", "id")) == 5
+    assert read_table(engine, "match", "id")[0].competition == "ADCC"
+    with engine.begin() as con:
+        swap_shadow_tables(con)
+    assert len(read_table(engine, "athlete", "id")) == 8
+    assert read_table(engine, "match", "id")[0].competition == "WNO"
+    assert len(read_table(engine, "performance", "id")) == 5
+
+    # it can be done again, and the tables keep their indexes
+    upload_data(
+        new_frames["athlete"],
+        new_frames["performance"],
+        new_frames["match"],
+        engine,
+        mode="swap",
+    )
+    with engine.connect() as con:
+        names = con.execute(sa.text("SELECT name FROM sqlite_master")).scalars().all()
+    assert "performance_match_id_athlete_id" in names
+    assert not [name for name in names if name.endswith("_shadow")]
+    assert len(read_table(engine, "athlete", "id")) == 8
+
+
+@pytest.mark.parametrize("mode", LOAD_MODES)  # type: ignore
+def test_load_refreshes_the_stats(engine: sa.Engine, mode: str) -> None:
+    frames = make_frames()
+    # the athletes without a page aren't in the stats
+    frames["athlete"].loc[frames["athlete"].id == 3, "url"] = ""
+    # the stats of the load before are replaced
+    upload_data(frames["athlete"], frames["performance"][:2], frames["match"], engine)
+    upload_data(
+        frames["athlete"], frames["performance"], frames["match"], engine, mode=mode
+    )
+    athlete_stats = read_table(engine, "athlete_stats", "athlete_id")
+    assert [tuple(row) for row in athlete_stats] == [
+        (1, "athlete 1", 1, 1, 1),
+        (2, "athlete 2", 0, 0, 2),
+        (4, "athlete 4", 1, 1, 1),
+    ]
+    # the win on points isn't a finish, and only the wins are counted by method
+    athlete_method_stats = read_table(engine, "athlete_method_stats", "athlete_id")
+    assert [tuple(row) for row in athlete_method_stats] == [
+        ("Armbar", 1, 1),
+        ("RNC", 4, 1),
+    ]
+
+
+@pytest.mark.parametrize("mode", LOAD_MODES)  # type: ignore
+def test_load_streams_chunks_of_the_tables(engine: sa.Engine, mode: str) -> None:
+    """
+    the chunks are loaded as they are read, so the ones that were loaded are let go
+    """
+    frames = make_frames(num_athletes=50)
+    loaded: List[weakref.ref[pd.DataFrame]] = []
+
+    def chunks(df: pd.DataFrame) -> Iterator[pd.DataFrame]:
+        for start in range(0, len(df), 10):
+            gc.collect()
+            # the one before the last chunk was done with before this one was read
+            assert all(ref() is None for ref in loaded[:-1])
+            chunk = df.iloc[start : start + 10].copy()
+            loaded.append(weakref.ref(chunk))
+            yield chunk
+
+    upload_data(
+        chunks(frames["athlete"]),
+        chunks(frames["performance"]),
+        chunks(frames["match"]),
+        engine,
+        chunksize=4,
+        mode=mode,
+    )
+    assert len(loaded) == 5 + 1 + 1
+    assert len(read_table(engine, "athlete", "id")) == 50
+    assert len(read_table(engine, "performance", "id")) == 5
+
+
+@pytest.mark.parametrize("file_type", ["parquet", "csv"])  # type: ignore
+def test_upload_from_directory(
+    engine: sa.Engine, monkeypatch: pytest.MonkeyPatch, tmp_path: str, file_type: str
+) -> None:
+    frames = make_frames(num_athletes=25)
+    for name, df in frames.items():
+        path = os.path.join(tmp_path, f"{name}.{file_type}")
+        if file_type == "parquet":
+            # with row groups smaller than the chunks and the other way around
+            df.to_parquet(path, row_group_size=3)
+        else:
+            df.to_csv(path, index=False)
+
+    def no_dataframes(*args: Any, **kwargs: Any) -> None:
+        raise AssertionError("a dataframe was made")
+
+    with monkeypatch.context() as patch:
+        if file_type == "parquet":
+            # the parquet files go from arrow to the database without pandas
+            patch.setattr(pd.DataFrame, "__init__", no_dataframes)
+            patch.setattr(
+                pyarrow.pandas_compat,
+                "table_to_dataframe",
+                no_dataframes,
+                raising=False,
+            )
+        upload_from_directory(str(tmp_path), engine, chunksize=7)
+    athletes = read_table(engine, "athlete", "id")
+    assert [a.name for a in athletes] == list(frames["athlete"].name)
+    matches = read_table(engine, "match", "id")
+    assert [(m.id, m.year) for m in matches] == [(10, 2019), (11, None), (12, 2021)]
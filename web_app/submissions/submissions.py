@@ -31,7 +31,8 @@ env = Environment(loader=FileSystemLoader(path, encoding="utf8"))
 
 def get_submission_athlete_data(submission: str) -> Sequence[Row]:
     """
-    Get the number of occurrences of each submission type for each athlete
+    Get the number of occurrences of each submission type for each athlete,
+    from the stats the load keeps in athlete_stats and athlete_method_stats
     each row contains the athlete's name, id, wins, method, number of submissions, submissions per win, and win percent
     for example:
     ('Gordon Ryan', 1, 5, 'Armbar', 3, 60.0, 100.0)
@@ -43,41 +44,18 @@ def get_submission_athlete_data(submission: str) -> Sequence[Row]:
     with sa_engine.connect() as conn:
         statement = sa.text(
             """
-            with cte as (SELECT a.name,
-                                a.id,
-                                SUM(CASE
-                                        WHEN result = 'W' THEN 1
-                                        ELSE 0
-                                    END) AS wins,
-                                COUNT(*) AS total_matches,
-                                SUM(CASE
-                                        WHEN result = 'W' and method = :submission THEN 1
-                                        ELSE 0
-                                    END) AS submissions
-                         FROM athlete a
-                                  JOIN performance p on a.id = p.athlete_id
-                                  JOIN match m on p.match_id = m.id
-                         WHERE url != ''
-                         GROUP BY a.name, a.id),
-                 cte2 as (select a.name, a.id, COUNT(*) as total_submissions
-                          from athlete a
-                                   join performance p on a.id = p.athlete_id
-                                   join match m on p.match_id = m.id
-                          where method not like 'Pts:%'
-                            and method not IN ('N/A', 'Points', 'DQ', 'Referee Decision', 'Adv', 'Pen', '---', 'Advantages')
-                            and method not LIKE 'EBI%'
-                            and p.result = 'W'
-                          group by a.name, a.id)
-            select cte.name,
-                   cte.id,
-                   cte.wins,
-                   cte.submissions,
-                   ROUND(cast(cte.wins as decimal) / cte.total_matches * 100, 2)             as win_percent,
-                   ROUND(cast(cte.submissions as decimal) / cte.wins * 100, 2) as sub_percent
-            from cte
-                     join cte2 on cte.id = cte2.id
-            where cte.submissions > 1
-            and cte.wins > 10
+            select s.name,
+                   s.athlete_id,
+                   s.wins,
+                   m.wins                                                       as submissions,
+                   ROUND(cast(s.wins as decimal) / s.total_matches * 100, 2) as win_percent,
+                   ROUND(cast(m.wins as decimal) / s.wins * 100, 2)          as sub_percent
+            from athlete_method_stats m
+                     join athlete_stats s on m.athlete_id = s.athlete_id
+            where m.method = :submission
+              and m.wins > 1
+              and s.wins > 10
+              and s.subs > 0
             """
         )
         statement = statement.bindparams(submission=submission)
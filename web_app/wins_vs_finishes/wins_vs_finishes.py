@@ -33,7 +33,7 @@ env = Environment(loader=FileSystemLoader(path, encoding="utf8"))
 
 def get_records() -> Sequence[Row]:
     """
-    Get the athlete records from the database
+    Get the athlete records from the database, the load keeps them in athlete_stats
     each row contains the athlete's name, id, wins, subs, total_matches, win percent, and sub percent
     in that order
     """
@@ -41,27 +41,8 @@ def get_records() -> Sequence[Row]:
     with sa_engine.connect() as conn:
         statement = sa.text(
             """
-            with cte as (SELECT a.name,
-                                a.id,
-                                SUM(CASE
-                                        WHEN result = 'W' THEN 1
-                                        ELSE 0
-                                   END) AS wins,
-                                SUM(CASE
-                                        WHEN method LIKE 'Pts:%' THEN 0
-                                        WHEN method IN ('N/A', 'Points', 'DQ', 'Referee Decision', 'Adv', 'Pen', '---', 'Advantages') THEN 0
-                                        WHEN method LIKE 'EBI%' THEN 0
-                                        WHEN result = 'W' THEN 1
-                                        ELSE 0
-                                   END) AS subs,
-                                COUNT(*) AS total_matches
-                         FROM athlete a
-                                  JOIN performance p on a.id = p.athlete_id
-                                  JOIN match m on p.match_id = m.id
-                         WHERE url != ''
-                         GROUP BY a.name, a.id)
-            select name, id, wins, subs, total_matches, ROUND(CAST(wins AS DECIMAL) / total_matches * 100, 2) AS win_percent, ROUND(CAST(subs AS DECIMAL) / NULLIF(wins, 0) * 100, 2) AS sub_percent
-            from cte
+            select name, athlete_id, wins, subs, total_matches, ROUND(CAST(wins AS DECIMAL) / total_matches * 100, 2) AS win_percent, ROUND(CAST(subs AS DECIMAL) / NULLIF(wins, 0) * 100, 2) AS sub_percent
+            from athlete_stats
             """
         )
         result = conn.execute(statement)